@@ -0,0 +1,160 @@
+"""
+Enrutado de la base de datos entre el primario y las replicas de solo lectura.
+
+Las lecturas se reparten entre las replicas configuradas en settings.DB_REPLICAS
+y las escrituras siempre van a 'default'. En cuanto una peticion escribe, queda
+fijada al primario hasta el final de la peticion (y durante DB_REPLICA_PIN_SECONDS en
+las siguientes peticiones del mismo cliente) para que lea lo que acaba de escribir.
+
+El estado se guarda en una variable de contexto y no en el hilo, para que lo
+compartan los hilos del pool a los que una peticion asincrona delega el acceso a la
+BD (ver guess/offload.py).
+"""
+
+import asyncio
+import contextvars
+import random
+from contextlib import contextmanager
+from django.apps import apps
+from django.conf import settings
+from django.utils.decorators import sync_and_async_middleware
+
+PRIMARY = 'default'
+PIN_COOKIE = 'db_pin'
+
+
+class PinState:
+    """ Estado del enrutado de una peticion o de un hilo. Es mutable para que las
+    copias del contexto que reciben los hilos del pool lo compartan."""
+    pinned = False
+    wrote = False
+
+
+_state_var = contextvars.ContextVar('db_pin_state')
+
+
+def _state():
+    try:
+        return _state_var.get()
+    except LookupError:
+        state = PinState()
+        _state_var.set(state)
+        return state
+
+
+def is_pinned():
+    """ Indica si el contexto actual debe leer del primario."""
+    return _state().pinned
+
+
+def pin_to_primary():
+    """ Fija el contexto actual al primario."""
+    _state().pinned = True
+
+
+def has_written():
+    """ Indica si el contexto actual ha escrito en el primario desde el ultimo unpin."""
+    return _state().wrote
+
+
+def unpin():
+    """ Libera el contexto actual para que vuelva a leer de las replicas."""
+    state = _state()
+    state.pinned = False
+    state.wrote = False
+
+
+@contextmanager
+def use_primary():
+    """ Fuerza a que todas las lecturas dentro del bloque vayan al primario."""
+    previous = is_pinned()
+    pin_to_primary()
+    try:
+        yield
+    finally:
+        _state().pinned = previous
+
+
+class ReplicaRouter:
+    """ Router que manda las lecturas a las replicas y las escrituras al primario."""
+
+    def db_for_read(self, model, **hints):
+        replicas = getattr(settings, 'DB_REPLICAS', [])
+        # Los modelos historicos de las migraciones se leen de la BD que se migra.
+        if model._meta.apps is not apps:
+            return None
+        if not replicas or is_pinned() or self.primary_only(model):
+            return PRIMARY
+        return random.choice(replicas)
+
+    def primary_only(self, model):
+        """ Modelos que coordinan varios nodos y no toleran el retraso de las replicas."""
+        primary_only = getattr(settings, 'DB_PRIMARY_ONLY', [])
+        return model._meta.app_label in primary_only or model._meta.label_lower in primary_only
+
+    def db_for_write(self, model, **hints):
+        # Tras una escritura el resto de la peticion lee del primario.
+        state = _state()
+        state.pinned = state.wrote = True
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Todas las bases de datos contienen los mismos datos.
+        pool = {PRIMARY, *getattr(settings, 'DB_REPLICAS', [])}
+        if obj1._state.db in pool and obj2._state.db in pool:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Las replicas reciben el esquema por replicacion. En local con SQLite
+        # basta con copiar el fichero del primario despues de migrar.
+        return db == PRIMARY
+
+
+def start_request(request):
+    unpin()
+    if PIN_COOKIE in request.COOKIES:
+        pin_to_primary()
+
+
+def finish_request(response):
+    if has_written() and getattr(settings, 'DB_REPLICAS', []):
+        response.set_cookie(
+            PIN_COOKIE, '1',
+            max_age=settings.DB_REPLICA_PIN_SECONDS,
+            httponly=True,
+            samesite='Lax',
+        )
+
+
+@sync_and_async_middleware
+def primary_pinning_middleware(get_response):
+    """ Middleware que garantiza leer lo escrito (read-your-writes).
+
+    Si la peticion escribe en la BD se envia una cookie de corta duracion para que
+    las siguientes peticiones del cliente (por ejemplo, el redirect tras un POST)
+    tambien lean del primario mientras las replicas se ponen al dia.
+
+    Funciona tanto en WSGI como en ASGI sin saltar de hilo (no accede a la BD).
+    """
+    if asyncio.iscoroutinefunction(get_response):
+        async def middleware(request):
+            # Cada peticion asincrona tiene su propio estado.
+            _state_var.set(PinState())
+            start_request(request)
+            try:
+                response = await get_response(request)
+                finish_request(response)
+            finally:
+                unpin()
+            return response
+    else:
+        def middleware(request):
+            start_request(request)
+            try:
+                response = get_response(request)
+                finish_request(response)
+            finally:
+                unpin()
+            return response
+    return middleware
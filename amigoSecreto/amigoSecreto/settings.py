@@ -39,9 +39,12 @@ def get_env(name, default=None):
 SECRET_KEY = get_env('SECRET_KEY')
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+# Con DEBUG=0 los estaticos se sirven con hash y comprimidos (ver guess/staticfiles.py)
+# despues de ejecutar manage.py collectstatic.
+DEBUG = get_env('DEBUG', '1') == '1'
 
-ALLOWED_HOSTS = []
+# Hosts separados por comas. Con DEBUG=0 tiene que incluir el del servidor.
+ALLOWED_HOSTS = [host for host in get_env('ALLOWED_HOSTS', '').split(',') if host]
 
 LOGIN_URL = '/signin'
 
@@ -55,6 +58,59 @@ APSCHEDULER_DATETIME_FORMAT = 'd/m/Y'   #00/00/0000
 
 APSCHEDULER_RUN_NOW_TIMEOUT = 25  # Seconds
 
+# Carpeta donde se guardan los perfiles de las peticiones (ver guess/profiling.py).
+PROFILES_DIR = get_env('PROFILES_DIR', os.path.join(BASE_DIR, 'profiles'))
+
+# Carpeta donde manage.py archive_games guarda los juegos terminados.
+ARCHIVE_DIR = get_env('ARCHIVE_DIR', os.path.join(BASE_DIR, 'archives'))
+
+# Fichero JSON en el que manage.py bench_forms acumula los resultados de cada ejecucion.
+BENCH_HISTORY = get_env('BENCH_HISTORY', os.path.join(BASE_DIR, 'bench_history.json'))
+
+# Los jobs de las selecciones se guardan en la BD y solo los ejecuta el nodo que
+# tiene el lease del scheduler (ver guess/scheduler.py). Con SCHEDULER_EMBEDDED cada
+# proceso web participa en la eleccion; si no, hay que lanzar manage.py run_scheduler.
+SCHEDULER_EMBEDDED = get_env('SCHEDULER_EMBEDDED', '1') == '1'
+# Segundos que dura el lease del lider sin renovarse.
+SCHEDULER_LEASE_TTL = int(get_env('SCHEDULER_LEASE_TTL', '15'))
+
+# Retraso maximo aceptable (segundos) de un job de seleccion sobre su hora programada.
+SELECTION_LAG_SLA = int(get_env('SELECTION_LAG_SLA', '60'))
+# Token para leer /metrics/ sin sesion (cabecera "Authorization: Bearer <token>").
+# Vacio: solo los superusuarios pueden leerlas.
+METRICS_TOKEN = get_env('METRICS_TOKEN', '')
+
+# Hilos del pool local para tareas en segundo plano (creacion de juegos, etc.)
+BACKGROUND_JOB_WORKERS = int(get_env('BACKGROUND_JOB_WORKERS', '2'))
+
+# Hilos (y conexiones a la BD) con los que las vistas asincronas acceden a la BD
+# bajo ASGI (ver guess/offload.py).
+ASYNC_DB_WORKERS = int(get_env('ASYNC_DB_WORKERS', '8'))
+
+# Correo de los avisos a los jugadores. Por defecto se escriben en la consola; con
+# 'django.core.mail.backends.smtp.EmailBackend' se envian por SMTP.
+EMAIL_BACKEND = get_env('EMAIL_BACKEND', 'django.core.mail.backends.console.EmailBackend')
+EMAIL_HOST = get_env('EMAIL_HOST', 'localhost')
+EMAIL_PORT = int(get_env('EMAIL_PORT', '25'))
+EMAIL_HOST_USER = get_env('EMAIL_HOST_USER', '')
+EMAIL_HOST_PASSWORD = get_env('EMAIL_HOST_PASSWORD', '')
+EMAIL_USE_TLS = get_env('EMAIL_USE_TLS', '0') == '1'
+DEFAULT_FROM_EMAIL = get_env('DEFAULT_FROM_EMAIL', 'amigo-secreto@localhost')
+# Los avisos de cada seleccion se envian en lotes de NOTIFICATION_BATCH_SIZE mensajes
+# por una sola conexion (ver guess/notifications.py). Con NOTIFICATIONS_EMBEDDED los
+# envia el pool de tareas del proceso del scheduler; si no, manage.py send_notifications.
+NOTIFICATION_BATCH_SIZE = int(get_env('NOTIFICATION_BATCH_SIZE', '200'))
+NOTIFICATIONS_EMBEDDED = get_env('NOTIFICATIONS_EMBEDDED', '1') == '1'
+
+# Con GUESS_WRITE_BEHIND las adivinanzas se validan y se anyaden a una cola SQLite
+# local (GUESS_QUEUE_PATH, una por nodo) y se guardan despues por lotes de
+# GUESS_BATCH_SIZE (ver guess/writebehind.py). Con GUESS_QUEUE_EMBEDDED las guarda el
+# pool de tareas del proceso; si no, manage.py process_guesses.
+GUESS_WRITE_BEHIND = get_env('GUESS_WRITE_BEHIND', '0') == '1'
+GUESS_QUEUE_PATH = get_env('GUESS_QUEUE_PATH', os.path.join(BASE_DIR, 'guess_queue.sqlite3'))
+GUESS_QUEUE_EMBEDDED = get_env('GUESS_QUEUE_EMBEDDED', '1') == '1'
+GUESS_BATCH_SIZE = int(get_env('GUESS_BATCH_SIZE', '500'))
+
 # Application definition
 
 INSTALLED_APPS = [
@@ -70,10 +126,17 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'guess.staticfiles.static_files_middleware',
+    # Comprime las paginas y responde 304 si el ETag del contenido no ha cambiado. El
+    # token CSRF de las paginas cambia en cada respuesta, lo que evita BREACH.
+    'django.middleware.gzip.GZipMiddleware',
+    'django.middleware.http.ConditionalGetMiddleware',
+    'amigoSecreto.routers.primary_pinning_middleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'guess.profiling.profiler_middleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -113,6 +176,72 @@ DATABASES = {
     }
 }
 
+# Replicas de solo lectura. DB_REPLICA_NAMES es una lista separada por comas con el
+# NAME de cada replica (con SQLite, la ruta del fichero) y DB_REPLICA_HOSTS permite
+# indicar un host distinto para cada una. El resto de datos se toman del primario.
+_replica_names = [name.strip() for name in get_env('DB_REPLICA_NAMES', '').split(',') if name.strip()]
+_replica_hosts = [host.strip() for host in get_env('DB_REPLICA_HOSTS', '').split(',') if host.strip()]
+
+DB_REPLICAS = []
+for i, name in enumerate(_replica_names):
+    alias = 'replica%d' % (i + 1)
+    DATABASES[alias] = dict(
+        DATABASES['default'],
+        NAME=name,
+        HOST=_replica_hosts[i] if i < len(_replica_hosts) else DATABASES['default']['HOST'],
+        TEST={'MIRROR': 'default'},
+    )
+    DB_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['amigoSecreto.routers.ReplicaRouter']
+
+# Apps o modelos (app_label.modelname) que siempre se leen del primario.
+DB_PRIMARY_ONLY = ['django_apscheduler', 'guess.schedulerlease', 'guess.gameplan',
+                   'guess.gamereveal']
+
+# Segundos que un cliente sigue leyendo del primario despues de escribir.
+DB_REPLICA_PIN_SECONDS = int(get_env('DB_REPLICA_PIN_SECONDS', '5'))
+
+# Cache de Django. Por defecto en la memoria local de cada proceso; para compartirla
+# entre procesos usar un backend comun (p. ej. Memcached).
+CACHES = {
+    'default': {
+        'BACKEND': get_env('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': get_env('CACHE_LOCATION', 'amigosecreto'),
+    }
+}
+
+# Sesiones: con cached_db se leen de la cache y solo se consulta la BD si no estan.
+# Con 'django.contrib.sessions.backends.signed_cookies' van firmadas en la cookie.
+SESSION_ENGINE = get_env('SESSION_ENGINE', 'django.contrib.sessions.backends.cached_db')
+
+# Backends de cache que no se comparten entre procesos o nodos: lo que invalida un
+# proceso sigue valiendo en los demas.
+LOCAL_CACHE_BACKENDS = [
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.filebased.FileBasedCache',
+    'django.core.cache.backends.dummy.DummyCache',
+]
+SHARED_CACHE = CACHES['default']['BACKEND'] not in LOCAL_CACHE_BACKENDS
+
+# Con una cache compartida el usuario de cada peticion se lee de la cache (ver
+# guess/auth_cache.py); con una local cada proceso veria un usuario desactivado hasta
+# que caducara su copia. ModelBackend sigue en la lista para que las sesiones que ya
+# lo tenian guardado sigan siendo validas.
+AUTHENTICATION_BACKENDS = [
+    *(['guess.auth_cache.CachedModelBackend'] if SHARED_CACHE else []),
+    'django.contrib.auth.backends.ModelBackend',
+]
+
+# Limites de peticiones por usuario y por IP (ver guess/ratelimit.py) como
+# "capacidad/segundos". Vacio desactiva el limite.
+RATE_LIMITS = {
+    'guess': get_env('RATE_LIMIT_GUESS', '5/60'),
+    'signup': get_env('RATE_LIMIT_SIGNUP', '3/300'),
+    # Las comprobaciones de nombre libre del registro (GET, una por tecla con pausa).
+    'availability': get_env('RATE_LIMIT_AVAILABILITY', '30/60'),
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.1/ref/settings/#auth-password-validators
@@ -151,3 +280,16 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/3.1/howto/static-files/
 
 STATIC_URL = '/static/'
+
+# Carpeta en la que manage.py collectstatic deja los estaticos.
+STATIC_ROOT = get_env('STATIC_ROOT', os.path.join(BASE_DIR, 'staticfiles'))
+
+# En produccion los nombres llevan el hash del contenido y se guarda su version .gz.
+if not DEBUG:
+    STATICFILES_STORAGE = 'guess.staticfiles.CompressedManifestStaticFilesStorage'
+
+# Si la propia aplicacion sirve STATIC_ROOT (por defecto con DEBUG=0; con DEBUG=1 ya
+# lo hace runserver desde las carpetas static de las apps).
+STATIC_SERVE = get_env('STATIC_SERVE', '0' if DEBUG else '1') == '1'
+# Segundos que el navegador guarda los estaticos con hash.
+STATIC_MAX_AGE = 365*24*60*60
@@ -0,0 +1,49 @@
+"""
+Settings para los benchmarks (manage.py bench_forms) y pruebas rapidas sin Postgres
+ni variables de entorno: BD SQLite en memoria, cache local del proceso y sin
+scheduler ni envio de avisos en segundo plano.
+
+    DJANGO_SETTINGS_MODULE=amigoSecreto.settings_bench python manage.py bench_forms
+"""
+
+import os
+
+# settings.py termina el proceso si faltan estas variables.
+for _name, _value in {
+    'SECRET_KEY': 'bench',
+    'DB_ENGINE': 'django.db.backends.sqlite3',
+    'DB_NAME': ':memory:',
+    'DB_USER': '',
+    'DB_PASSWORD': '',
+    'DB_HOST': '',
+    'DB_PORT': '',
+}.items():
+    os.environ.setdefault(_name, _value)
+
+from .settings import *
+
+DEBUG = False
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': ':memory:',
+    }
+}
+DB_REPLICAS = []
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'amigosecreto-bench',
+        # Sin el limite de 300 claves de LocMemCache, como una cache compartida.
+        'OPTIONS': {'MAX_ENTRIES': 1000000},
+    }
+}
+
+SCHEDULER_EMBEDDED = False
+NOTIFICATIONS_EMBEDDED = False
+GUESS_QUEUE_EMBEDDED = False
+EMAIL_BACKEND = 'django.core.mail.backends.locmem.EmailBackend'
+STATIC_SERVE = False
+STATICFILES_STORAGE = 'django.contrib.staticfiles.storage.StaticFilesStorage'
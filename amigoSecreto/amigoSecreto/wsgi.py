@@ -14,3 +14,22 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'amigoSecreto.settings')
 
 application = get_wsgi_application()
+
+# Cada proceso participa en la eleccion del lider del scheduler de las selecciones.
+from django.conf import settings
+if settings.SCHEDULER_EMBEDDED:
+    from guess.scheduler import start_scheduler
+    start_scheduler()
+
+# Cargamos en segundo plano el indice de nombres ocupados del registro.
+from guess.availability import taken_names
+from guess.jobs import fail_stale_jobs, submit
+submit(taken_names.get)
+
+# Los GameJob que quedaron a medias si el proceso anterior cayo ya no van a terminar.
+submit(fail_stale_jobs)
+
+# Guardamos las adivinanzas que quedaron en la cola si el proceso anterior cayo.
+if settings.GUESS_WRITE_BEHIND:
+    from guess.writebehind import wake
+    wake()
@@ -1,5 +1,33 @@
 from django.contrib import admin
+from django.contrib.auth.admin import UserAdmin
+from django.contrib.auth.models import User
 from .models import *
+from .enrollment import enroll
+
+
+def enroll_in_next_game(modeladmin, request, queryset):
+    """ Accion del admin de usuarios que los inscribe en bloque en el proximo juego."""
+    enrolled = enroll(queryset.values_list('id', flat=True))
+    modeladmin.message_user(request, f"{enrolled} users enrolled in the next game.")
+enroll_in_next_game.short_description = 'Enroll in the next game'
+
+
+class PlayerAdmin(UserAdmin):
+    actions = [enroll_in_next_game]
+
+
+class EnrollmentAdmin(admin.ModelAdmin):
+    list_display = ('user', 'game', 'joined_at')
+    list_select_related = ('user', 'game')
+    raw_id_fields = ('user', 'game')
+
+
+class NotificationBatchAdmin(admin.ModelAdmin):
+    list_display = ('round', 'selection', 'status', 'queued', 'sent', 'failed', 'skipped',
+                    'duration_ms', 'created')
+    list_filter = ('status',)
+    exclude = ('recipients',)
+
 
 # Register your models here.
 admin.site.register(UserData)
@@ -9,4 +37,15 @@ admin.site.register(Teams)
 admin.site.register(GivesTo)
 admin.site.register(UserTeam)
 admin.site.register(Guess)
-admin.site.register(Options)
\ No newline at end of file
+admin.site.register(SelectionOptions)
+admin.site.register(GameJob)
+admin.site.register(SelectionTick)
+admin.site.register(GamePlan)
+admin.site.register(GameReveal)
+admin.site.register(PlayerState)
+admin.site.register(SelectionStats)
+admin.site.register(TeamStats)
+admin.site.register(NotificationBatch, NotificationBatchAdmin)
+admin.site.register(Enrollment, EnrollmentAdmin)
+admin.site.unregister(User)
+admin.site.register(User, PlayerAdmin)
\ No newline at end of file
@@ -0,0 +1,117 @@
+"""
+Indice en memoria de los alias de los jugadores del juego activo.
+
+Los alias se guardan ordenados en una lista para buscar por prefijo con bisect, junto
+con el ID del usuario de cada uno. Cada proceso construye su copia la primera vez que
+se usa y la reconstruye cuando cambia el juego activo, que se lee de la BD en cada uso
+(una consulta por indice), o la version guardada en la cache de Django, que se renueva
+al guardar un UserData o al cambiar los equipos. Asi un proceso con una cache local
+no sigue sirviendo los alias del juego anterior.
+"""
+
+import threading
+from array import array
+from bisect import bisect_left
+from uuid import uuid4
+from django.core.cache import cache
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .models import *
+
+VERSION_KEY = 'guess:aliases:version'
+
+
+class AliasIndex:
+    """ Lista ordenada de alias con el ID del usuario de cada uno."""
+
+    def __init__(self, pairs=()):
+        pairs = sorted(pairs)
+        self.aliases = [alias for alias, _ in pairs]
+        self.user_ids = array('l', [user_id for _, user_id in pairs])
+
+    def __len__(self):
+        return len(self.aliases)
+
+    def lookup(self, alias):
+        """ Devuelve el ID del usuario con ese alias o None si no esta."""
+        i = bisect_left(self.aliases, alias)
+        if i < len(self.aliases) and self.aliases[i] == alias:
+            return self.user_ids[i]
+        return None
+
+    def add(self, alias, user_id):
+        """ Inserta alias manteniendo el orden (o actualiza su usuario si ya esta)."""
+        i = bisect_left(self.aliases, alias)
+        if i < len(self.aliases) and self.aliases[i] == alias:
+            self.user_ids[i] = user_id
+        else:
+            self.aliases.insert(i, alias)
+            self.user_ids.insert(i, user_id)
+
+    def search(self, prefix, page=1, page_size=20):
+        """ Devuelve los alias que empiezan por prefix de la pagina indicada y si hay
+        una pagina siguiente."""
+        start = bisect_left(self.aliases, prefix) + (page - 1)*page_size
+        results = []
+        for alias in self.aliases[start:start + page_size + 1]:
+            if not alias.startswith(prefix):
+                break
+            results.append(alias)
+        return results[:page_size], len(results) > page_size
+
+
+def current_game_id():
+    """ ID del ultimo juego creado o None."""
+    return Game.objects.order_by('-startDate').values_list('id', flat=True).first()
+
+
+class PlayerAliases:
+    """ AliasIndex de los jugadores del juego activo, compartido por el proceso."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._index = None
+        self._key = None
+
+    def get(self):
+        version = cache.get(VERSION_KEY)
+        if version is None:
+            # Primera vez o la cache perdio la clave: fijamos una version nueva.
+            cache.add(VERSION_KEY, uuid4().hex, None)
+            version = cache.get(VERSION_KEY)
+        key = (current_game_id(), version)
+        if self._index is None or key != self._key:
+            with self._lock:
+                if self._index is None or key != self._key:
+                    self._index = AliasIndex(self.load(key[0]))
+                    self._key = key
+        return self._index
+
+    def load(self, game_id):
+        """ Pares (alias, user_id) de los jugadores del juego."""
+        if game_id is None:
+            return []
+        user_ids = UserTeam.objects.filter(team__game_id=game_id).values('user_id')
+        return UserData.objects.filter(user_id__in=user_ids).values_list('alias', 'user_id')
+
+    def lookup(self, alias):
+        return self.get().lookup(alias)
+
+    def search(self, prefix, page=1, page_size=20):
+        return self.get().search(prefix, page, page_size)
+
+    @staticmethod
+    def invalidate():
+        cache.set(VERSION_KEY, uuid4().hex, None)
+
+
+player_aliases = PlayerAliases()
+
+
+@receiver(post_save, sender=UserData)
+@receiver(post_delete, sender=UserData)
+@receiver(post_save, sender=UserTeam)
+@receiver(post_delete, sender=UserTeam)
+def invalidate_player_aliases(sender, **kwargs):
+    """ Cualquier cambio en los alias o en los equipos invalida el indice."""
+    player_aliases.invalidate()
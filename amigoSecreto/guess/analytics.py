@@ -0,0 +1,223 @@
+"""
+Estadisticas de las adivinanzas mantenidas de forma incremental.
+
+Calcularlas desde Guess obliga a recorrer todas las adivinanzas y cruzar su fecha con
+las seis columnas de Round para saber en que seleccion se hizo cada una. En su lugar
+se mantienen dos tablas de contadores:
+    - SelectionStats, una fila por seleccion: la crea (o la actualiza) el job de la
+      seleccion al abrirla (scheduler._set_options) con el inicio de la ventana y el
+      tamanyo del grupo.
+    - TeamStats, una fila por equipo de cada juego: se crean al abrir la primera
+      seleccion de cada ronda.
+GuessForm.save (o el worker de writebehind.py, por lotes) suma las adivinanzas a
+ambas con un UPDATE ... SET campo = campo + n (record_guesses), sin leerlas antes.
+Cada adivinanza cuenta en la ultima fila abierta del juego con la seleccion del
+jugador (PlayerState.selection) y el tiempo hasta adivinar se mide desde su 'opened',
+la hora a la que se programo el job, que no coincide con las ventanas del GamePlan.
+La pagina y el JSON de analiticas (report) solo leen estas tablas, asi que su coste
+no depende del tamanyo de Guess.
+
+rebuild las recalcula desde Guess (comando rebuild_analytics) para los juegos
+anteriores o si alguna vez se desincronizan.
+"""
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils.timezone import now
+from .game_logic import false_positive_weight
+from .models import *
+from .plans import get_plan
+
+BATCH_SIZE = 1000
+
+
+def add(model, keys, defaults=None, **counts):
+    """ Suma counts a los contadores de la fila de keys, creandola si no existe."""
+    updates = {field: F(field) + value for field, value in counts.items()}
+    if model.objects.filter(**keys).update(**updates):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**keys, **(defaults or {}), **counts)
+    except IntegrityError:
+        # Otra adivinanza la creo a la vez.
+        model.objects.filter(**keys).update(**updates)
+
+
+def open_selection(game, round_id, selection, opened, group, first_selection):
+    """ Crea o actualiza la fila de la seleccion al abrirse (ver scheduler._set_options).
+    Devuelve el numero de filas que toco."""
+    SelectionStats.objects.update_or_create(
+        round_id=round_id, selection=selection,
+        defaults={'opened': opened, 'group': len(group)})
+    if not first_selection:
+        return 1
+    teams = Teams.objects.filter(game=game).values_list('name', flat=True)
+    TeamStats.objects.bulk_create(
+        [TeamStats(game=game, team=team) for team in teams], ignore_conflicts=True)
+    return 1 + len(teams)
+
+
+def current_turn(game_id, selection, date):
+    """ (ID de la ronda, apertura) de la ultima fila de SelectionStats del juego con esa
+    seleccion abierta antes de date, o None si su job no la creo."""
+    return SelectionStats.objects.filter(
+        round__game_id=game_id, selection=selection, opened__lte=date,
+    ).order_by('-opened').values_list('round_id', 'opened').first()
+
+
+def guess_counts(correct, answer, players):
+    """ Contadores que suma una adivinanza."""
+    wrong = not correct
+    return {
+        'guesses': 1,
+        'correct': int(correct),
+        'false_positives': int(wrong and answer),
+        'expected_false_positives': false_positive_weight(players) if wrong else 0,
+    }
+
+
+def record_guesses(guesses):
+    """ Suma adivinanzas nuevas a las estadisticas, con un UPDATE por cada seleccion y
+    equipo afectados.
+    INPUTS:
+        - guesses: Lista de (ID del juego, ID del que adivina, seleccion en la que
+                   adivina, su equipo, fecha, si acerto de verdad, respuesta dada,
+                   N con el que se decidio la respuesta (regla de 5/N)).
+    """
+    selections, teams, turns = {}, {}, {}
+    for game_id, user_id, selection, team, date, correct, answer, players in guesses:
+        counts = guess_counts(correct, answer, players)
+        # Un lote es de una o pocas selecciones: una consulta por cada una.
+        if (game_id, selection) not in turns:
+            turns[game_id, selection] = current_turn(game_id, selection, date)
+        turn = turns[game_id, selection]
+        targets = [teams.setdefault((game_id, team), {})]
+        if turn is not None:
+            round_id, opened = turn
+            totals = selections.setdefault((round_id, selection, opened), {})
+            elapsed = max(0, int((date - opened).total_seconds()*1000))
+            totals['time_to_guess_ms'] = totals.get('time_to_guess_ms', 0) + elapsed
+            targets.append(totals)
+        for totals in targets:
+            for field, value in counts.items():
+                totals[field] = totals.get(field, 0) + value
+    for (round_id, selection, opened), totals in selections.items():
+        add(SelectionStats, {'round_id': round_id, 'selection': selection}, {'opened': opened}, **totals)
+    for (game_id, team), totals in teams.items():
+        add(TeamStats, {'game_id': game_id, 'team': team}, **totals)
+
+
+def record_guess(state, guess, correct, players):
+    """ Suma una adivinanza nueva a las estadisticas.
+    INPUTS:
+        - state: PlayerState del que adivina, aun en Guessing.
+        - guess: Guess recien creada.
+        - correct: Si acerto de verdad (guess.answer puede ser un falso positivo).
+        - players: N con el que se decidio la respuesta (regla de 5/N).
+    """
+    record_guesses([(state.game_id, state.user_id, state.selection, state.team,
+                     guess.date, correct, guess.answer, players)])
+
+
+def rate(part, total):
+    return part/total if total else None
+
+
+def report(game_id):
+    """ Estadisticas del juego como diccionario (el JSON de analiticas), leidas solo
+    de SelectionStats y TeamStats."""
+    selections = []
+    for stats in SelectionStats.objects.filter(round__game_id=game_id).order_by('round_id', 'selection'):
+        wrong = stats.guesses - stats.correct
+        selections.append({
+            'round': stats.round_id,
+            'selection': stats.selection + 1,
+            'opened': stats.opened,
+            'group': stats.group,
+            'guesses': stats.guesses,
+            'participation': rate(stats.guesses, stats.group),
+            'correct': stats.correct,
+            'correct_rate': rate(stats.correct, stats.guesses),
+            'false_positives': stats.false_positives,
+            'false_positive_rate': rate(stats.false_positives, wrong),
+            'expected_false_positive_rate': rate(stats.expected_false_positives, wrong),
+            'mean_time_to_guess_s': rate(stats.time_to_guess_ms/1000, stats.guesses),
+        })
+    teams = []
+    for stats in TeamStats.objects.filter(game_id=game_id).order_by('team'):
+        wrong = stats.guesses - stats.correct
+        teams.append({
+            'team': stats.team,
+            'guesses': stats.guesses,
+            'correct': stats.correct,
+            'correct_rate': rate(stats.correct, stats.guesses),
+            'false_positives': stats.false_positives,
+            'false_positive_rate': rate(stats.false_positives, wrong),
+            'expected_false_positive_rate': rate(stats.expected_false_positives, wrong),
+        })
+    return {'game': game_id, 'selections': selections, 'teams': teams}
+
+
+@transaction.atomic
+def rebuild(game):
+    """ Recalcula las estadisticas de un juego recorriendo sus Guess. La seleccion de
+    cada adivinanza es la ultima de su grupo abierta antes que ella: con la apertura
+    que guardo su job o, si no hay fila, con la ventana del GamePlan. Como no se guardo
+    el N con el que se decidio, los falsos positivos esperados usan el numero de
+    jugadores del juego. Devuelve el numero de adivinanzas procesadas."""
+    plan = get_plan(game.id)
+    if plan is None:
+        return 0
+    opened_at = {
+        (round_id, s): opened
+        for round_id, s, opened in SelectionStats.objects.filter(
+            round__game=game).values_list('round_id', 'selection', 'opened')
+    }
+    SelectionStats.objects.filter(round__game=game).delete()
+    TeamStats.objects.filter(game=game).delete()
+
+    states = dict(PlayerState.objects.filter(game=game).values_list('user_id', 'team'))
+    gives_to = dict(GivesTo.objects.filter(game=game).values_list('gifter_id', 'gifted_id'))
+    players = len(states) or 1
+    # Las selecciones ya abiertas, como las habria creado su job.
+    selections = {}
+    current = now()
+    for round in plan.rounds:
+        for s, (group, window) in enumerate(zip(round.groups, round.windows)):
+            opened = opened_at.get((round.id, s), window)
+            if opened <= current:
+                selections[round.id, s] = SelectionStats(
+                    round_id=round.id, selection=s, opened=opened, group=len(group))
+    teams = {
+        name: TeamStats(game=game, team=name)
+        for name in Teams.objects.filter(game=game).values_list('name', flat=True)
+    }
+    # Seleccion de cada usuario en cada turno, por fecha de inicio.
+    turns = {}
+    groups = {round.id: round.groups for round in plan.rounds}
+    for (round_id, s), stats in selections.items():
+        for user_id in groups[round_id][s]:
+            turns.setdefault(user_id, []).append((stats.opened, round_id, s))
+
+    guesses = 0
+    rows = Guess.objects.filter(game=game).values_list(
+        'owner_id', 'gifter_id', 'gifted_id', 'date', 'answer')
+    for owner, gifter, gifted, date, answer in rows.iterator(chunk_size=BATCH_SIZE):
+        counts = guess_counts(gives_to.get(gifter) == gifted, answer, players)
+        started = [turn for turn in turns.get(owner, []) if turn[0] <= date]
+        team = states.get(owner, '')
+        targets = [teams.setdefault(team, TeamStats(game=game, team=team))]
+        if started:
+            opened, round_id, s = max(started)
+            stats = selections[round_id, s]
+            stats.time_to_guess_ms += max(0, int((date - opened).total_seconds()*1000))
+            targets.append(stats)
+        for stats in targets:
+            for field, value in counts.items():
+                setattr(stats, field, getattr(stats, field) + value)
+        guesses += 1
+
+    SelectionStats.objects.bulk_create(selections.values(), batch_size=BATCH_SIZE)
+    TeamStats.objects.bulk_create(teams.values(), batch_size=BATCH_SIZE)
+    return guesses
@@ -2,3 +2,9 @@ from django.apps import AppConfig
 
 class GuessConfig(AppConfig):
     name = 'guess'
+
+    def ready(self):
+        # Registramos los receivers de las signals.
+        from . import aliases, auth_cache, availability, gift_search, player_state
+        # CachedModelBackend solo es seguro con una cache compartida.
+        auth_cache.check_shared_cache()
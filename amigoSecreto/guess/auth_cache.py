@@ -0,0 +1,111 @@
+"""
+Cache del usuario autenticado de cada peticion.
+
+AuthenticationMiddleware carga el usuario con CachedModelBackend.get_user, que lo lee
+de la cache de Django junto con su UserData (user.data) en vez de consultar auth_user
+y guess_userdata en cada peticion. Los campos de los que depende la seguridad
+(AUTH_FIELDS: la contrasenya, con la que se comprueba el hash de la sesion, is_active
+y los permisos de administrador) se leen siempre de la BD con una consulta por la
+clave primaria, asi que una copia atrasada nunca mantiene abierta una sesion.
+
+Las claves llevan una version por usuario (guess:user:<id>:<version>) que se renueva
+al guardar o borrar el User o su UserData, como la de aliases.py: una copia antigua
+no se vuelve a leer aunque otro proceso la escriba despues de la invalidacion. Los
+update() de QuerySet no envian signals, asi que despues hay que llamar a
+invalidate_user. La invalidacion solo llega a todos los procesos con una cache
+compartida: settings solo instala el backend con una (SHARED_CACHE) y
+check_shared_cache impide arrancar si se configura con una local.
+"""
+
+from uuid import uuid4
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.models import User
+from django.core.exceptions import ImproperlyConfigured, PermissionDenied
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .models import UserData
+
+# Segundos que se guarda cada usuario (la version lo invalida antes si cambia).
+USER_TIMEOUT = 60*60
+# Campos que se leen de la BD en cada peticion aunque el usuario este en la cache.
+AUTH_FIELDS = ('password', 'is_active', 'is_staff', 'is_superuser')
+BACKEND = 'guess.auth_cache.CachedModelBackend'
+
+
+def check_shared_cache():
+    """ Falla si CachedModelBackend esta instalado con una cache local a cada proceso."""
+    backend = settings.CACHES['default']['BACKEND']
+    if BACKEND in settings.AUTHENTICATION_BACKENDS and backend in settings.LOCAL_CACHE_BACKENDS:
+        raise ImproperlyConfigured(
+            f"{BACKEND} needs a cache shared by every process, not {backend}")
+
+
+def version_key(user_id):
+    return f"guess:user:{user_id}:version"
+
+
+def get_version(user_id):
+    key = version_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        # Primera vez o la cache perdio la clave: fijamos una version nueva.
+        cache.add(key, uuid4().hex, None)
+        version = cache.get(key)
+    return version
+
+
+def invalidate_user(user_id):
+    cache.set(version_key(user_id), uuid4().hex, None)
+
+
+def get_cached_user(user_id):
+    """ Usuario con su UserData en user.data (None si no tiene) o None si no existe."""
+    key = f"guess:user:{user_id}:{get_version(user_id)}"
+    user = cache.get(key)
+    if user is None:
+        user = User._default_manager.filter(pk=user_id).first()
+        if user is None:
+            return None
+        user.data = UserData.objects.filter(user_id=user_id).first()
+        cache.set(key, user, USER_TIMEOUT)
+    return user
+
+
+class CachedModelBackend(ModelBackend):
+    """ ModelBackend que carga el usuario de la sesion desde la cache.
+
+    settings.AUTHENTICATION_BACKENDS mantiene ModelBackend detras solo para las
+    sesiones iniciadas antes de usar este backend (guardan su ruta). Como comprueba
+    las mismas credenciales, un inicio de sesion fallido se corta aqui para no
+    calcular el hash de la contrasenya dos veces."""
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        user = super().authenticate(request, username, password, **kwargs)
+        if user is None and password is not None:
+            raise PermissionDenied
+        return user
+
+    def get_user(self, user_id):
+        user = get_cached_user(user_id)
+        if user is None:
+            return None
+        fields = User._default_manager.filter(pk=user_id).values_list(*AUTH_FIELDS).first()
+        if fields is None:
+            return None
+        for name, value in zip(AUTH_FIELDS, fields):
+            setattr(user, name, value)
+        return user if self.user_can_authenticate(user) else None
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    invalidate_user(instance.pk)
+
+
+@receiver(post_save, sender=UserData)
+@receiver(post_delete, sender=UserData)
+def invalidate_cached_user_data(sender, instance, **kwargs):
+    invalidate_user(instance.user_id)
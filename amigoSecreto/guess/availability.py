@@ -0,0 +1,112 @@
+"""
+Indice en memoria de los nombres de usuario y alias ocupados, para comprobar mientras
+se escribe en el registro si estan libres sin consultar la BD.
+
+Cada proceso guarda dos AliasIndex (listas ordenadas, ver aliases.py) que se cargan al
+arrancar (wsgi.py / asgi.py) o en el primer uso. Se mantienen al dia con dos versiones
+en la cache de Django:
+    - VERSION_KEY cambia con cada alta de User o UserData: el proceso carga solo las
+      filas con ID mayor que las que ya tiene.
+    - GENERATION_KEY cambia cuando se edita un usuario o un alias ya existente: el
+      proceso vuelve a cargar todo.
+Si un nombre esta en el indice la BD decide (el usuario se puede haber borrado). Si no
+esta, esta libre solo con una cache compartida (settings.SHARED_CACHE): con una cache
+local por proceso las versiones de las altas de otros procesos no llegan y el indice
+puede no tenerlas, asi que tambien lo confirma la BD. El registro sigue validando
+contra la BD al enviarlo.
+"""
+
+import threading
+from uuid import uuid4
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from .aliases import AliasIndex
+from .models import UserData
+
+VERSION_KEY = 'guess:names:version'
+GENERATION_KEY = 'guess:names:generation'
+
+# Campo del registro -> (modelo, campo del modelo, campo con el ID del usuario)
+FIELDS = {
+    'username': (User, 'username', 'id'),
+    'alias': (UserData, 'alias', 'user_id'),
+}
+
+
+def current(key):
+    version = cache.get(key)
+    if version is None:
+        # Primera vez o la cache perdio la clave: fijamos una version nueva.
+        cache.add(key, uuid4().hex, None)
+        version = cache.get(key)
+    return version
+
+
+class TakenNames:
+    """ AliasIndex de los nombres ocupados de cada campo de FIELDS, compartidos por
+    el proceso."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._indexes = None
+        self._last_ids = {}
+        self._generation = None
+        self._version = None
+
+    def get(self):
+        """ {campo: AliasIndex} al dia con las versiones de la cache."""
+        generation, version = current(GENERATION_KEY), current(VERSION_KEY)
+        if self._indexes is None or generation != self._generation or version != self._version:
+            with self._lock:
+                if self._indexes is None or generation != self._generation:
+                    self.load()
+                elif version != self._version:
+                    self.load_new()
+                self._generation, self._version = generation, version
+        return self._indexes
+
+    def load(self):
+        indexes = {}
+        for field, (model, name, user) in FIELDS.items():
+            rows = list(model.objects.values_list('id', name, user))
+            indexes[field] = AliasIndex((value, user_id) for _, value, user_id in rows)
+            self._last_ids[field] = max((row_id for row_id, _, _ in rows), default=0)
+        self._indexes = indexes
+
+    def load_new(self):
+        """ Anyade las filas creadas desde la ultima carga."""
+        for field, (model, name, user) in FIELDS.items():
+            rows = model.objects.filter(id__gt=self._last_ids[field]).values_list('id', name, user)
+            for row_id, value, user_id in rows:
+                self._indexes[field].add(value, user_id)
+                self._last_ids[field] = max(self._last_ids[field], row_id)
+
+    def is_available(self, field, value):
+        """ Si el valor del campo de FIELDS esta libre."""
+        if self.get()[field].lookup(value) is None and settings.SHARED_CACHE:
+            return True
+        # Puede estar ocupado, o el indice no estar al dia: la BD decide.
+        model, name, _ = FIELDS[field]
+        return not model.objects.filter(**{name: value}).exists()
+
+
+taken_names = TakenNames()
+
+
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=UserData)
+def update_taken_names(sender, instance, created, update_fields=None, **kwargs):
+    """ Las altas se cargan de forma incremental. Si se edita una fila ya existente
+    (salvo el last_login de cada inicio de sesion) se recarga todo."""
+    if created:
+        key = VERSION_KEY
+    elif update_fields is None or set(update_fields) & {'username', 'alias'}:
+        key = GENERATION_KEY
+    else:
+        return
+    # Cuando la fila ya sea visible para los demas procesos.
+    transaction.on_commit(lambda: cache.set(key, uuid4().hex, None))
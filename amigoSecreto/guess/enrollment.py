@@ -0,0 +1,50 @@
+"""
+Inscripcion de los jugadores en el proximo juego.
+
+Los usuarios se inscriben (o un superusuario los inscribe en bloque desde el admin)
+antes de crear el juego. Al crearlo, GameForm asigna las inscripciones pendientes al
+juego nuevo con un solo UPDATE y reparte los equipos leyendo solo los IDs de los
+inscritos, asi que el coste depende de los participantes y no del total de cuentas.
+"""
+
+from .models import Enrollment
+
+# Minimo de inscritos para poder crear un juego (un lobo y un aldeano).
+MIN_PLAYERS = 2
+
+
+def enroll(user_ids):
+    """ Inscribe a los usuarios en el proximo juego. Los que ya estaban inscritos se
+    ignoran. Devuelve cuantos se inscribieron."""
+    user_ids = set(user_ids)
+    already = set(pending().filter(user_id__in=user_ids).values_list('user_id', flat=True))
+    Enrollment.objects.bulk_create(
+        [Enrollment(user_id=user_id) for user_id in user_ids - already],
+        batch_size=1000, ignore_conflicts=True,
+    )
+    return len(user_ids - already)
+
+
+def unenroll(user_id):
+    """ Quita la inscripcion del usuario en el proximo juego."""
+    return pending().filter(user_id=user_id).delete()[0]
+
+
+def pending():
+    """ Inscripciones en el proximo juego."""
+    return Enrollment.objects.filter(game__isnull=True)
+
+
+def is_enrolled(user_id):
+    return pending().filter(user_id=user_id).exists()
+
+
+def assign_pending(game):
+    """ Asigna las inscripciones pendientes al juego. Devuelve cuantas asigno."""
+    return pending().update(game=game)
+
+
+def enrolled_ids(game):
+    """ Itera los IDs de los usuarios inscritos en el juego."""
+    return Enrollment.objects.filter(game=game).values_list(
+        'user_id', flat=True).iterator(chunk_size=2000)
@@ -1,12 +1,21 @@
 from django import forms
+from django.conf import settings
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.models import User, Group
-from django.core.exceptions import ValidationError
+from django.core.exceptions import PermissionDenied, ValidationError
+from django.db import transaction
 from django.utils.timezone import make_aware
+from django.urls import reverse_lazy
 from .models import *
-from apscheduler.schedulers.background import BackgroundScheduler
-from apscheduler.triggers.date import DateTrigger
-from random import shuffle, choices
+from .game_logic import *
+from .scheduler import schedule_reveal, schedule_selection, pack_options
+from .plans import save_plan
+from .player_state import create_states, get_state, mark_guessed
+from .enrollment import MIN_PLAYERS, assign_pending, enrolled_ids, pending
+from .aliases import player_aliases
+from .analytics import record_guess
+from .writebehind import submit_guess
+from array import array
 
 class SignUpForm(UserCreationForm):
     """ 
@@ -15,6 +24,7 @@ class SignUpForm(UserCreationForm):
         - username: Nombre del usuario.
         - alias: Nombre que aparecera en la interfaz y tendra entre 2 y 4 caracteres.
         - gift: Regalo deseado.
+        - email: Correo para los avisos del juego (opcional).
         - password1: Contrasenya.
         - password2: Confirmacion de la contrasenya.
     """
@@ -23,6 +33,7 @@ class SignUpForm(UserCreationForm):
     username = forms.CharField(min_length=4, max_length=100)
     alias = forms.CharField(min_length=2, max_length=4)
     gift = forms.CharField()
+    email = forms.EmailField(required=False)
     password1 = forms.CharField(widget=forms.PasswordInput)
     password2 = forms.CharField(widget=forms.PasswordInput)
     
@@ -36,6 +47,7 @@ class SignUpForm(UserCreationForm):
             'username',
             'alias',
             'gift',
+            'email',
             'password1',
             'password2',
         )
@@ -77,11 +89,20 @@ class SignUpForm(UserCreationForm):
             raise ValidationError("Password don't match")
         return password2
 
+    def _post_clean(self):
+        """ Si el nombre de usuario o el alias estan ocupados hay que volver a enviar el
+        formulario de todos modos, asi que aun no se pasan los validadores de la
+        contrasenya."""
+        if self.has_error('username') or self.has_error('alias'):
+            forms.ModelForm._post_clean(self)
+        else:
+            super()._post_clean()
+
     def save(self, commit: bool = True):
         """ Guarda los datos del usuario en la BD."""
         user = User.objects.create_user(
             username=self.cleaned_data['username'],
-            email='',
+            email=self.cleaned_data['email'],
             password=self.cleaned_data['password1'],
             first_name=self.cleaned_data['first_name'],
             last_name=self.cleaned_data['last_name']
@@ -124,173 +145,107 @@ class GameForm(forms.ModelForm):
         days = self.cleaned_data['days']
         return days
 
+    def clean(self):
+        """ Verifica que haya suficientes usuarios inscritos en el proximo juego."""
+        cleaned_data = super().clean()
+        if pending().count() < MIN_PLAYERS:
+            raise forms.ValidationError(
+                f'At least {MIN_PLAYERS} users must be enrolled in the game.')
+        return cleaned_data
+
     def gen_round(self, startDate, days):
         """ Genera las fechas de las selecciones de una ronda segun su fecha de inicio
         y el tiempo que durara."""
-        # Las selecciones duran en horas 4 veces el numero de dias que dura la ronda.
-        # Ronda de 2, 3, 6 dias -> selecciones de 8, 12, 24 horas respectivamente.
-        select_duration = days*4
+        select_duration = selection_hours(days)
         selections = [None]*6
         for i in range(6):
             # Usamos make_aware para agregar la zona horaria
             selections[i] = make_aware(startDate + timedelta(hours = i*select_duration))
         return selections
 
-    def create_teams(self):
-        """ Separa todos los usuarios en User en dos equipos: Lobos y aldeanos, 
-        creando las instancias de Team y UserTeam correspondientes."""
-        # Almacenamos la instancia de todos los jugadores
-        # TODO hay que definir aquí si van a ser todos los usuarios o si el superusuario los 
-        # va agregando
-        users = list(User.objects.all())
-
-        # Creamos unos indices con el numero de participantes y los ordenamos aleatoriamente.
-        N = len(users)
-        indexes = [i for i in range(N)]
-        shuffle(indexes)
+    def create_teams(self, game, progress=None):
+        """ Separa a los usuarios inscritos en el juego en dos equipos: Lobos y aldeanos, 
+        creando las instancias de Team y UserTeam correspondientes. Devuelve los IDs
+        de los lobos y de los aldeanos.
+        progress, si se indica, se llama con el nombre de cada fase que comienza."""
+        # Asignamos al juego las inscripciones pendientes y leemos solo los IDs de
+        # los inscritos.
+        assign_pending(game)
 
-        # Separamos en lobos y aldeanos.
-        wolfs = [users[i] for i in indexes[:N//2]]
-        villagers = [users[i] for i in indexes[N//2:]]
-
-        # El último juego creado es el activo
-        game = Game.objects.latest('startDate')
+        # Separamos aleatoriamente en lobos y aldeanos.
+        wolfs, villagers = split_teams(enrolled_ids(game))
 
         # Creamos el equipo lobo para el juego actual
-        wolfs_team = Teams.objects.get_or_create(game=game, name='Wolfs')[0]#, score=0)
-        for wolf in wolfs:
-            UserTeam.objects.create(team=wolfs_team, user=wolf)
+        wolfs_team = Teams.objects.get_or_create(game=game, name=WOLFS)[0]#, score=0)
+        UserTeam.objects.bulk_create(
+            [UserTeam(team=wolfs_team, user_id=wolf) for wolf in wolfs], batch_size=1000)
 
         # Creamos el equipo aldeano para el juego actual
-        villagers_team = Teams.objects.get_or_create(game=game, name='Villagers')[0]#, score=0)
-        for villager in villagers:
-            UserTeam.objects.create(team=villagers_team, user=villager)
+        villagers_team = Teams.objects.get_or_create(game=game, name=VILLAGERS)[0]#, score=0)
+        UserTeam.objects.bulk_create(
+            [UserTeam(team=villagers_team, user_id=villager) for villager in villagers],
+            batch_size=1000)
+        # bulk_create no envia post_save, asi que renovamos el indice de alias a mano.
+        player_aliases.invalidate()
 
         ##### ------------ REPRESENTACION DEL POTE DE EAS ------------ #####
-        shuffle(wolfs)
-        shuffle(villagers)
-        for i in range(len(wolfs)):
-            GivesTo.objects.create(game=game, gifter=wolfs[i], gifted=villagers[i])
-        shuffle(wolfs)
-        shuffle(villagers)
-        for i in range(len(wolfs)):
-            GivesTo.objects.create(game=game, gifted=wolfs[i], gifter=villagers[i])
-
-    def get_set_options(self, group, round, options, first_selection):
+        if progress: progress('pairing')
+        GivesTo.objects.bulk_create([
+            GivesTo(game=game, gifter_id=gifter, gifted_id=gifted)
+            for gifter, gifted in pair_gifts(wolfs, villagers)
+        ], batch_size=1000)
+        return wolfs, villagers
+
+    def plan_selections(self, players, wolfs, villagers):
         """ 
-        Genera una funcion que actualiza la BD dada la seleccion actual. Dicha
-        funcion sera la que ejecutara un job en la fecha indicada.
+        Calcula los grupos por selección de una ronda y las opciones de adivinanza de
+        los usuarios. Devuelve, por cada seleccion, el array con los IDs del grupo y
+        el array plano con las 3 opciones de cada uno (ver scheduler.set_options).
         INPUTS:
-            - group: Lista de instancias UserTeam, los cuales son los usuarios que
-                        van a intentar adivinar en esta ronda.
-            - round: Instancia de Round que representa la ronda actual.
-            - options: Conjunto de opciones que tiene cada usuario de group para hacer
-                        la adivinanza. options[i] corresponde a las opciones de group[i].
-            - first_selection: Indica si es la primera seleccion de la ronda.
+            - players: Pares (user_id, nombre del equipo) de los jugadores del juego.
+            - wolfs, villagers: IDs de los lobos y de los aldeanos.
         """
-        def set_options(
-            group=group,
-            round=round, 
-            options=options, 
-            first_selection=first_selection
-        ):
-            # Obtenemos los 3 grupos
-            guessing = Group.objects.get(name='Guessing')
-            guessed = Group.objects.get(name='Guessed')
-            next_to_guess = Group.objects.get(name='NextToGuess')
-
-            # Obtenemos el juego y el ID de los teams
-            game = round.game
-            team_ids = game.teams_set.values_list('id', flat=True)
-
-            if first_selection:
-                # Si es la primera seleccion, sacamos a todos los usuarios de Guessed y Guessing
-                # y agregamos a todos los usuarios a NextToGuess
-                guessing.user_set.clear()
-                guessed.user_set.clear()
-                # Solo para los usuarios que pertenecen al juego actual
-                for user_team_pair in UserTeam.objects.filter(team__id__in=team_ids):
-                    next_to_guess.user_set.add(user_team_pair.user)
-            else:
-                # En caso contrario, movemos los usuarios de Guessing a Guessed
-                for user in guessing.user_set.all():
-                    guessing.user_set.remove(user)
-                    guessed.user_set.add(user)
-
-            # Eliminamos las opciones de la seleccion anterior
-            Options.objects.all().delete()
-
-            # Movemos los usuarios de group de NextToGuess a Guessing y agregamos
-            # sus opciones correspondientes
-            for i, user in enumerate(group):
-                next_to_guess.user_set.remove(user.user)
-                guessing.user_set.add(user.user)
-                Options.objects.create(
-                    round=round,
-                    user=user.user,
-                    option1 = options[i][0].user,
-                    option2 = options[i][1].user,
-                    option3 = options[i][2].user,
-                )
-        return set_options
-    
+        # Repartimos aleatoriamente a los usuarios en los grupos de cada seleccion.
+        groups = split_groups(players)
+
+        # Creamos las opciones de cada jugador de cada seleccion.
+        round_options = []
+        for i in range(SELECTIONS_PER_ROUND):
+            i_options = []
+            for user_id, team_name in groups[i]:
+                # Si el usuario es lobo, tomamos 3 aldeanos al azar como sus opciones
+                if team_name == WOLFS: i_options.append(pick_options(villagers))
+                # En caso contrario, tomamos 3 lobos al azar como sus opciones.
+                else: i_options.append(pick_options(wolfs))
+            round_options.append(pack_options(i_options))
+        return [
+            (array('l', [user_id for user_id, _ in group]), round_options[i])
+            for i, group in enumerate(groups)
+        ]
+
     def create_selections(self, round, dates, k):
         """ 
-        Calcula los grupos por selección y las opciones de adivinanza de los usuarios.
+        Guarda en la BD un job por seleccion de la ronda, que ejecutara el nodo lider
+        del scheduler. Los jobs solo guardan una referencia a la seleccion dentro del
+        GamePlan del juego (ver scheduler.run_selection).
         INPUTS:
             - round: Instancia de Round que indica la ronda actual.
             - dates: Conjunto de fechas en las que se ejecutara cada job.
-            * k: Variable que se usa para hacer pruebas.
+            - k: Indice de la ronda en el juego. Tambien se usa para hacer pruebas.
         """
-        ###### EL ARGUMENTO k SOLO SE USA PARA LAS PRUEBAS
-        userteam_instances, wolfs, villagers = [], [], []
-        # Obtenemos el juego y el ID de los teams
-        game = round.game
-        team_ids = game.teams_set.values_list('id', flat=True)
-        # Obtener los del juego actual
-        for user_team_pair in UserTeam.objects.filter(team__id__in=team_ids):
-            userteam_instances.append(user_team_pair)
-            if user_team_pair.team.name == "Wolfs": wolfs.append(user_team_pair)
-            else: villagers.append(user_team_pair)
-
-        # Creamos unos indices con el numero de participantes y los ordenamos aleatoriamente.
-        N = len(userteam_instances)
-        shuffle(userteam_instances)
-
-        # Calculamos el numero de usuarios que intentaran adivinar por cada seleccion.
-        S = [N//6+1 for _ in range(N%6)] + [N//6 for _ in range(6-N%6)]
-        groups = []
-        for i in range(6):
-            groups.append(userteam_instances[sum(S[:i]) : sum(S[:i+1])])
-        
-        # Creamos las opciones de cada jugador de cada seleccion.
-        round_options = []
-        for i in range(6):
-            i_options = []
-            for user_team_pair in groups[i]:
-                # Reorganizamos aleatoriamente los lobos y los aldeanos.
-                shuffle(wolfs)
-                shuffle(villagers)
-                # Si el usuario es lobo, tomamos los primeros 3 aldeanos como sus opciones
-                if user_team_pair.team.name == "Wolfs": i_options.append(villagers[:3])
-                # En caso contrario, tomamos los primeros 3 lobos como sus opciones.
-                else: i_options.append(wolfs[:3])
-            round_options.append(i_options.copy())
-
         # Descomentar las siguientes 2 lineas para hacer pruebas
         dates = [datetime.now() + timedelta(hours=k*6) + \
-            timedelta(hours=i) for i in range(len(groups))]
-        scheduler = BackgroundScheduler()
-        for i, group in enumerate(groups):
+            timedelta(hours=i) for i in range(SELECTIONS_PER_ROUND)]
+        for i in range(SELECTIONS_PER_ROUND):
             # Creamos un job por cada seleccion.
-            scheduler.add_job(
-                self.get_set_options(group, round, round_options[i], not bool(i)), 
-                DateTrigger(dates[i])
-            )
-        scheduler.start()
+            schedule_selection(f"selection-{round.id}-{i}", dates[i], round.game_id, k, i)
 
-    def save(self, commit: bool = True):
-        """ Guarda los datos del juego y las rondas en la BD."""
+    def save(self, commit: bool = True, progress=None):
+        """ Guarda los datos del juego y las rondas en la BD.
+        progress, si se indica, se llama con el nombre de cada fase que comienza
+        (ver GameJob.PHASES)."""
+        if progress is None:
+            progress = lambda phase: None
 
         # CREAMOS LA INSTANCIA DEL JUEGO.
         # Fecha de inicil del juego
@@ -316,29 +271,16 @@ class GameForm(forms.ModelForm):
         # Aqui almacenaremos las rondas creadas
         rounds = []
 
-        # Ronda 1
-        if days in (9, 12): 
-            rounds.append(self.gen_round(startDate, 3))
-            startDate += timedelta(days=3)
-        else:
-            rounds.append(self.gen_round(startDate, 2))
-            startDate += timedelta(days=2)
-
-        # Ronda 2
-        if days in (8, 9, 11, 12): 
-            rounds.append(self.gen_round(startDate, 3))
-            startDate += timedelta(days=3)
-        else:
-            rounds.append(self.gen_round(startDate, 2))
-            startDate += timedelta(days=2)
-
-        # Ronda 3
-        if days in (7, 8, 9): rounds.append(self.gen_round(startDate, 3))
-        elif days > 9: rounds.append(self.gen_round(startDate, 6))
-        else: rounds.append(self.gen_round(startDate, 2))
+        # La duracion de cada ronda depende de los dias del juego (ver round_lengths).
+        for round_days in round_lengths(days):
+            rounds.append(self.gen_round(startDate, round_days))
+            startDate += timedelta(days=round_days)
 
         # CREAMOS LOS EQUIPOS
-        self.create_teams()
+        progress('teams')
+        wolfs, villagers = self.create_teams(game, progress)
+        players = [(user_id, WOLFS) for user_id in wolfs] + \
+            [(user_id, VILLAGERS) for user_id in villagers]
 
         # SACAMOS A TODOS LOS USUARIOS DE TODOS LOS GRUPOS
         guessing = Group.objects.get(name='Guessing')
@@ -348,14 +290,14 @@ class GameForm(forms.ModelForm):
         guessed.user_set.clear()
         next_to_guess.user_set.clear()
 
-        # COLOCAMOS TODOS LOS USUARIOS EN NextToGuess
-        team_ids = game.teams_set.values_list('id', flat=True)
-        for user_team_pair in UserTeam.objects.filter(team__id__in=team_ids):
-            next_to_guess.user_set.add(user_team_pair.user)
+        # COLOCAMOS TODOS LOS JUGADORES EN NextToGuess
+        next_to_guess.user_set.add(*wolfs, *villagers)
 
         # Almacenamos los datos de cada ronda.
-        for i, dates in enumerate(rounds):
-            round = Round.objects.create(
+        progress('rounds')
+        round_instances = []
+        for dates in rounds:
+            round_instances.append(Round.objects.create(
                 game=game,
                 firstSelection = dates[0],
                 secondSelection = dates[1],
@@ -363,34 +305,48 @@ class GameForm(forms.ModelForm):
                 fourthSelection = dates[3],
                 fifthSelection = dates[4],
                 sixthSelection = dates[5],
-            )
-            # round.save()
+            ))
+
+        # Precalculamos y guardamos el plan del juego: grupos y opciones de cada
+        # seleccion de cada ronda.
+        save_plan(game, round_instances, rounds, [
+            self.plan_selections(players, wolfs, villagers) for _ in round_instances
+        ])
+        # Los PlayerState despues del plan: quien lee un estado encuentra ya su plan.
+        create_states(game, wolfs, villagers)
+
+        # Programamos los jobs de las selecciones de cada ronda.
+        progress('scheduling')
+        for i, (round, dates) in enumerate(zip(round_instances, rounds)):
             self.create_selections(round, dates, i)
+        # Y el de la revelacion final.
+        schedule_reveal(game)
+        return game
 
 class GuessForm(forms.ModelForm):
     def __init__(self, *args, **kwargs):
         self.user = kwargs.pop('user')
         super(GuessForm, self).__init__(*args, **kwargs)
 
-        # Obtenemos las opciones del jugador para elegir a quien adivinar.
-        gifter_options = Options.objects.filter(user=self.user)[0]
-        # Obtenemos los UserData de cada opcion
-        gifter_options = [
-            UserData.objects.filter(user=gifter_options.option1)[0],
-            UserData.objects.filter(user=gifter_options.option2)[0],
-            UserData.objects.filter(user=gifter_options.option3)[0]
-        ]
-        # Colocaremos los aliases en vez de los usernames.
-        gifter_options = [(user_data.alias, user_data.alias) for user_data in gifter_options]
+        # Obtenemos los alias de las opciones del jugador para elegir a quien adivinar
+        # de su PlayerState. Solo las tiene mientras este en Guessing en la seleccion
+        # en curso.
+        self.state = get_state(self.user.id)
+        if self.state is None or self.state.status != PlayerState.GUESSING:
+            raise PermissionDenied("You have no options to guess in this selection")
+        gifter_options = [(alias, alias) for alias in self.state.options]
         self.fields['gifter'] = forms.ChoiceField(choices=gifter_options)
 
-        # Colocamos todos los jugadores como opcion de gifted.
-        gifted_options = list(UserTeam.objects.all())
-        # Obtenemos los UserData de cada jugador.
-        gifted_options = [UserData.objects.filter(user=user_team.user)[0] for user_team in gifted_options]
-        # Colocaremos los aliases en vez de los usernames
-        gifted_options = [(user_data.alias, user_data.alias) for user_data in gifted_options]
-        self.fields['gifted'] = forms.ChoiceField(choices=gifted_options)
+        # El gifted se escribe con autocompletado (ver AliasSearchView) en vez de
+        # listar a todos los jugadores en el HTML.
+        self.fields['gifted'] = forms.CharField(
+            min_length=2, max_length=4,
+            widget=forms.TextInput(attrs={
+                'list': 'gifted-aliases',
+                'autocomplete': 'off',
+                'data-search-url': reverse_lazy('alias_search'),
+            })
+        )
 
     class Meta:
         """ Indicamos el modelo a usar y los campos del form para el registro.
@@ -408,43 +364,51 @@ class GuessForm(forms.ModelForm):
         return gifter.user
 
     def clean_gifted(self):
-        """Dado el alias que el owner indico como gifted, obtenemos el User asociado. """
+        """Dado el alias que el owner indico como gifted, verificamos que sea un jugador
+        del juego activo y obtenemos el User asociado. """
         gifted = self.cleaned_data['gifted']
-        gifted = UserData.objects.filter(alias=gifted)[0]
-        return gifted.user
+        user_id = player_aliases.lookup(gifted)
+        if user_id is None:
+            raise ValidationError("There is no player with that alias")
+        return User.objects.get(id=user_id)
 
     def save(self, commit: bool = True):
-        # El último juego creado es el activo
-        game = Game.objects.latest('startDate')
+        if settings.GUESS_WRITE_BEHIND:
+            # La guarda el worker de writebehind.py en el siguiente lote.
+            submit_guess(self.state, self.cleaned_data['gifter'].id,
+                         self.cleaned_data['gifted'].id, make_aware(datetime.now()))
+            return
+
+        # El juego es el del PlayerState con el que se validaron las opciones, no el
+        # ultimo creado (puede haberse creado otro despues).
+        game_id = self.state.game_id
         # El owner sera el jugaor registrado
         owner = self.user
         # Obtenemos el gifter y el gifted
         gifter = self.cleaned_data['gifter']
         gifted = self.cleaned_data['gifted']
 
-        # Obtenemos la respuesta
-        if GivesTo.objects.filter(gifter=gifter)[0].gifted == gifted: 
-            # Si adivino correctamente, la respuesta sera True
-            answer=True
-        else:
-            # En caso contrario habra una posibilidad de 5/N (siendo N el numero
-            # de jugadores) de que de un falso positivo.
-            N = len(UserTeam.objects.all())
-            answer = choices([True, False], weights=[5/N, 1 - 5/N], k=1)[0]
-
-        # Creamos una instancia de Guess
-        Guess.objects.create(
-            game=game,
-            owner=owner,
-            gifter=gifter,
-            gifted=gifted,
-            date=make_aware(datetime.now()),
-            answer=answer
-        ).save()
-
-        # Movemos al owner del grupo Guessing a Guessed
-        Group.objects.get(name='Guessing').user_set.remove(owner)
-        Group.objects.get(name='Guessed').user_set.add(owner)
+        # Obtenemos la respuesta. Si no adivino correctamente habra una posibilidad
+        # de 5/N (siendo N el numero de jugadores) de que de un falso positivo.
+        correct = GivesTo.objects.filter(game_id=game_id, gifter=gifter).values_list(
+            'gifted_id', flat=True).first() == gifted.id
+        players = UserTeam.objects.filter(team__game_id=game_id).count()
+        answer = adjudicate(correct, players)
+
+        # La adivinanza, los grupos, las estadisticas y el estado se guardan juntos.
+        with transaction.atomic():
+            # Creamos una instancia de Guess
+            guess = Guess.objects.create(
+                game_id=game_id,
+                owner=owner,
+                gifter=gifter,
+                gifted=gifted,
+                date=make_aware(datetime.now()),
+                answer=answer
+            )
 
-        # Eliminamos las opciones del owner
-        Options.objects.filter(user=owner).delete()
\ No newline at end of file
+            # Movemos al owner del grupo Guessing a Guessed
+            Group.objects.get(name='Guessing').user_set.remove(owner)
+            Group.objects.get(name='Guessed').user_set.add(owner)
+            record_guess(self.state, guess, correct, players)
+            mark_guessed(game_id, owner.id)
\ No newline at end of file
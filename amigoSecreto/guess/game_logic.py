@@ -0,0 +1,100 @@
+"""
+Reglas del juego independientes de la BD.
+
+Aqui viven los calculos que hacen los forms al crear un juego (reparto de equipos,
+emparejamiento del amigo secreto, grupos por seleccion, opciones de cada jugador y
+duracion de las rondas) y la regla del falso positivo al adivinar. Trabajan con
+listas de cualquier cosa (instancias de modelos o enteros), de modo que los forms y
+el simulador (simulation.py) usan exactamente la misma logica.
+
+Todas las funciones aleatorias reciben rng, que por defecto es el modulo random.
+"""
+
+import random
+
+WOLFS = 'Wolfs'
+VILLAGERS = 'Villagers'
+
+# Cada ronda tiene 6 selecciones.
+SELECTIONS_PER_ROUND = 6
+
+
+def round_lengths(days):
+    """ Devuelve la duracion en dias de cada una de las 3 rondas de un juego de
+    'days' dias (entre 6 y 12)."""
+    # Ronda 1
+    lengths = [3 if days in (9, 12) else 2]
+    # Ronda 2
+    lengths.append(3 if days in (8, 9, 11, 12) else 2)
+    # Ronda 3
+    if days in (7, 8, 9): lengths.append(3)
+    elif days > 9: lengths.append(6)
+    else: lengths.append(2)
+    return lengths
+
+
+def selection_hours(round_days):
+    """ Las selecciones duran en horas 4 veces el numero de dias que dura la ronda.
+    Ronda de 2, 3, 6 dias -> selecciones de 8, 12, 24 horas respectivamente."""
+    return round_days*4
+
+
+def split_teams(players, rng=random):
+    """ Separa aleatoriamente a los jugadores en lobos y aldeanos. Si el numero de
+    jugadores es impar, los aldeanos tienen uno mas."""
+    players = list(players)
+    rng.shuffle(players)
+    N = len(players)
+    return players[:N//2], players[N//2:]
+
+
+def pair_gifts(wolfs, villagers, rng=random):
+    """ Representacion del pote: cada lobo regala a un aldeano y cada aldeano a un
+    lobo. Devuelve la lista de parejas (gifter, gifted)."""
+    wolfs, villagers = list(wolfs), list(villagers)
+    pairs = []
+    rng.shuffle(wolfs)
+    rng.shuffle(villagers)
+    for i in range(len(wolfs)):
+        pairs.append((wolfs[i], villagers[i]))
+    rng.shuffle(wolfs)
+    rng.shuffle(villagers)
+    for i in range(len(wolfs)):
+        pairs.append((villagers[i], wolfs[i]))
+    return pairs
+
+
+def selection_sizes(N):
+    """ Numero de jugadores que intentaran adivinar en cada seleccion de una ronda."""
+    k = SELECTIONS_PER_ROUND
+    return [N//k+1 for _ in range(N%k)] + [N//k for _ in range(k-N%k)]
+
+
+def split_groups(players, rng=random):
+    """ Reparte aleatoriamente a los jugadores en los grupos de cada seleccion."""
+    players = list(players)
+    rng.shuffle(players)
+    groups, start = [], 0
+    for size in selection_sizes(len(players)):
+        groups.append(players[start:start+size])
+        start += size
+    return groups
+
+
+def pick_options(rival_team, rng=random):
+    """ Escoge las 3 opciones de gifter de un jugador entre los del equipo rival."""
+    return rng.sample(rival_team, min(3, len(rival_team)))
+
+
+def false_positive_weight(N):
+    """ Probabilidad de que una adivinanza incorrecta se de por buena."""
+    return 5/N
+
+
+def adjudicate(correct, N, rng=random):
+    """ Decide la respuesta de una adivinanza. Si es incorrecta, hay una posibilidad
+    de 5/N (siendo N el numero de jugadores) de que de un falso positivo."""
+    if correct:
+        return True
+    weight = false_positive_weight(N)
+    return rng.choices([True, False], weights=[weight, 1 - weight], k=1)[0]
@@ -0,0 +1,122 @@
+"""
+Busqueda de texto sobre los regalos deseados (UserData.gift).
+
+La busqueda va contra un indice de texto creado por la migracion 0026_gift_search:
+    - Postgres: indice GIN sobre to_tsvector('simple', gift). Las consultas usan la
+      misma expresion para que el planificador use el indice y se ordenan con
+      ts_rank.
+    - SQLite: tabla virtual FTS5 (guess_userdata_gift_fts) con el contenido de
+      guess_userdata, mantenida por triggers, con el tokenizador unicode61 sin
+      acentos. Se ordena con bm25.
+    - Otros motores: gift__icontains sin orden por relevancia.
+Cada palabra de la consulta se busca como prefijo ('libr' encuentra 'libros') y
+tienen que estar todas. A igual relevancia se ordena por ID. Postgres con 'simple' no
+quita los acentos.
+
+gift_of da el regalo de un alias desde la cache de Django. La entrada lleva la
+generacion con la que se guardo y se lee junto a la actual con un solo get_many: al
+cambiar un alias se renueva la generacion y dejan de valer todas.
+"""
+
+import re
+from uuid import uuid4
+from django.core.cache import cache
+from django.db import connections, router, transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .models import *
+
+FTS_TABLE = 'guess_userdata_gift_fts'
+PG_INDEX = 'userdata_gift_search_idx'
+# Palabras de la consulta que se tienen en cuenta.
+MAX_TERMS = 8
+GENERATION_KEY = 'guess:gifts:generation'
+GIFT_TIMEOUT = 24*60*60
+
+
+def search_terms(query):
+    """ Palabras de la consulta en minusculas, sin signos."""
+    return re.findall(r'\w+', query.lower())[:MAX_TERMS]
+
+
+def search_queryset(terms, limit, offset):
+    """ UserData que tienen todas las palabras, con su relevancia en score (mayor es
+    mejor o None si el motor no la calcula)."""
+    db = router.db_for_read(UserData)
+    vendor = connections[db].vendor
+    table = UserData._meta.db_table
+    if vendor == 'postgresql':
+        return UserData.objects.using(db).raw(
+            f"SELECT id, user_id, alias, gift, ts_rank(to_tsvector('simple', gift), q) AS score"
+            f" FROM {table}, to_tsquery('simple', %s) q"
+            f" WHERE to_tsvector('simple', gift) @@ q"
+            f" ORDER BY score DESC, id LIMIT %s OFFSET %s",
+            [' & '.join(f"{term}:*" for term in terms), limit, offset])
+    if vendor == 'sqlite':
+        # Se ordena y pagina solo en la tabla FTS y se cruza con UserData la pagina.
+        # bm25 es menor cuanto mas relevante: se cambia de signo.
+        return UserData.objects.using(db).raw(
+            f"SELECT d.id, d.user_id, d.alias, d.gift, r.score FROM ("
+            f"SELECT rowid, -bm25({FTS_TABLE}) AS score FROM {FTS_TABLE}"
+            f" WHERE {FTS_TABLE} MATCH %s ORDER BY score DESC, rowid LIMIT %s OFFSET %s"
+            f") r JOIN {table} d ON d.id = r.rowid ORDER BY r.score DESC, r.rowid",
+            [' '.join(f'"{term}"*' for term in terms), limit, offset])
+    queryset = UserData.objects.using(db).all()
+    for term in terms:
+        queryset = queryset.filter(gift__icontains=term)
+    return queryset.order_by('id').extra(select={'score': 'NULL'})[offset:offset + limit]
+
+
+def search(query, page=1, page_size=20):
+    """ Devuelve los jugadores cuyo regalo coincide con query en la pagina indicada,
+    de mas a menos relevante, como diccionarios, y si hay una pagina siguiente."""
+    terms = search_terms(query)
+    if not terms:
+        return [], False
+    rows = list(search_queryset(terms, page_size + 1, (page - 1)*page_size))
+    results = [
+        {'alias': row.alias, 'gift': row.gift,
+         'score': round(row.score, 4) if row.score is not None else None}
+        for row in rows[:page_size]
+    ]
+    return results, len(rows) > page_size
+
+
+def gift_key(alias):
+    return f"guess:gift:{alias}"
+
+
+def generation():
+    value = cache.get(GENERATION_KEY)
+    if value is None:
+        cache.add(GENERATION_KEY, uuid4().hex, None)
+        value = cache.get(GENERATION_KEY)
+    return value
+
+
+def gift_of(alias):
+    """ Regalo del jugador con ese alias o None si no existe."""
+    key = gift_key(alias)
+    cached = cache.get_many([GENERATION_KEY, key])
+    current = cached.get(GENERATION_KEY) or generation()
+    entry = cached.get(key)
+    if entry is not None and entry[0] == current:
+        return entry[1]
+    gift = UserData.objects.filter(alias=alias).values_list('gift', flat=True).first()
+    cache.set(key, (current, gift), GIFT_TIMEOUT)
+    return gift
+
+
+@receiver(post_save, sender=UserData)
+def update_gift_cache(sender, instance, created, update_fields=None, **kwargs):
+    """ Un alta o un cambio de regalo solo invalidan su alias. Si puede haber cambiado
+    el alias, el anterior tambien: se renueva la generacion."""
+    if created or (update_fields is not None and 'alias' not in update_fields):
+        transaction.on_commit(lambda: cache.delete(gift_key(instance.alias)))
+    else:
+        transaction.on_commit(lambda: cache.set(GENERATION_KEY, uuid4().hex, None))
+
+
+@receiver(post_delete, sender=UserData)
+def delete_gift_cache(sender, instance, **kwargs):
+    transaction.on_commit(lambda: cache.delete(gift_key(instance.alias)))
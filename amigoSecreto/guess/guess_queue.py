@@ -0,0 +1,143 @@
+"""
+Cola local de las adivinanzas pendientes de la escritura diferida (ver writebehind.py).
+
+Es una BD SQLite en settings.GUESS_QUEUE_PATH, una por nodo, con journal WAL y
+synchronous=FULL: una adivinanza encolada esta en disco antes de responder.
+
+Mientras su adivinanza no se guarda el usuario tiene ademas una marca en la cache
+(pending_key) con el juego y la seleccion. player_state.get_state mira la marca y, si
+no esta (otra cache local o se desalojo), la cola de este nodo: asi cada usuario ve
+su propia adivinanza aunque el worker aun no la haya guardado. Con varios nodos la
+cache tiene que ser compartida.
+"""
+
+import sqlite3
+import threading
+from functools import lru_cache
+from django.conf import settings
+from django.core.cache import cache
+
+# Segundos que dura la marca de una adivinanza pendiente si el worker no la borra.
+PENDING_TIMEOUT = 60*60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS guesses (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    game_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    selection INTEGER NOT NULL,
+    team TEXT NOT NULL,
+    gifter_id INTEGER NOT NULL,
+    gifted_id INTEGER NOT NULL,
+    date TEXT NOT NULL,
+    UNIQUE (game_id, user_id, selection)
+);
+CREATE TABLE IF NOT EXISTS failed (
+    id INTEGER PRIMARY KEY,
+    game_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    selection INTEGER NOT NULL,
+    team TEXT NOT NULL,
+    gifter_id INTEGER NOT NULL,
+    gifted_id INTEGER NOT NULL,
+    date TEXT NOT NULL,
+    error TEXT NOT NULL
+)
+"""
+
+
+class GuessQueue:
+    """ Cola de adivinanzas pendientes en un fichero SQLite, con una conexion por
+    hilo."""
+    COLUMNS = ('id', 'game_id', 'user_id', 'selection', 'team', 'gifter_id', 'gifted_id', 'date')
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def connection(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=FULL')
+            db.executescript(SCHEMA)
+            self._local.db = db
+        return db
+
+    def append(self, game_id, user_id, selection, team, gifter_id, gifted_id, date):
+        """ Anyade una adivinanza. Lanza sqlite3.IntegrityError si el usuario ya tiene
+        una pendiente en la seleccion."""
+        self.connection().execute(
+            "INSERT INTO guesses (game_id, user_id, selection, team, gifter_id, gifted_id, date)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (game_id, user_id, selection, team, gifter_id, gifted_id, date.isoformat()))
+
+    def peek(self, limit):
+        """ Las limit adivinanzas mas antiguas como diccionarios."""
+        rows = self.connection().execute(
+            f"SELECT {', '.join(self.COLUMNS)} FROM guesses ORDER BY id LIMIT ?", (limit,))
+        return [dict(zip(self.COLUMNS, row)) for row in rows]
+
+    def remove(self, ids):
+        db = self.connection()
+        db.execute('BEGIN')
+        db.executemany("DELETE FROM guesses WHERE id = ?", [(row_id,) for row_id in ids])
+        db.execute('COMMIT')
+
+    def fail(self, row_id, error):
+        """ Aparta una adivinanza que no se puede guardar a la tabla failed, para que
+        no bloquee las siguientes."""
+        columns = ', '.join(self.COLUMNS)
+        db = self.connection()
+        db.execute('BEGIN')
+        db.execute(
+            f"INSERT INTO failed ({columns}, error) SELECT {columns}, ? FROM guesses WHERE id = ?",
+            (error, row_id))
+        db.execute("DELETE FROM guesses WHERE id = ?", (row_id,))
+        db.execute('COMMIT')
+
+    def failed(self):
+        """ Adivinanzas apartadas como diccionarios, con su error."""
+        columns = self.COLUMNS + ('error',)
+        rows = self.connection().execute(f"SELECT {', '.join(columns)} FROM failed ORDER BY id")
+        return [dict(zip(columns, row)) for row in rows]
+
+    def retry_failed(self):
+        """ Devuelve las adivinanzas apartadas a la cola. Devuelve cuantas."""
+        columns = ', '.join(self.COLUMNS)
+        db = self.connection()
+        db.execute('BEGIN')
+        moved = db.execute(
+            f"INSERT OR IGNORE INTO guesses ({columns}) SELECT {columns} FROM failed").rowcount
+        db.execute("DELETE FROM failed")
+        db.execute('COMMIT')
+        return moved
+
+    def contains(self, game_id, user_id, selection):
+        return self.connection().execute(
+            "SELECT 1 FROM guesses WHERE game_id = ? AND user_id = ? AND selection = ?",
+            (game_id, user_id, selection)).fetchone() is not None
+
+    def __len__(self):
+        return self.connection().execute("SELECT COUNT(*) FROM guesses").fetchone()[0]
+
+
+@lru_cache(maxsize=None)
+def queue_at(path):
+    return GuessQueue(path)
+
+
+def get_queue():
+    return queue_at(settings.GUESS_QUEUE_PATH)
+
+
+def pending_key(user_id):
+    return f"guess:pending:{user_id}"
+
+
+def is_pending(state):
+    """ Si el jugador de state (en Guessing) ya adivino en su seleccion y la adivinanza
+    sigue en la cola."""
+    return (cache.get(pending_key(state.user_id)) == (state.game_id, state.selection)
+            or get_queue().contains(state.game_id, state.user_id, state.selection))
@@ -0,0 +1,84 @@
+"""
+Ejecucion de tareas en segundo plano dentro del propio proceso.
+
+Las tareas se ejecutan en un pool de hilos local (sin broker externo) y su estado se
+guarda en la BD, de modo que cualquier nodo puede consultarlo.
+
+La creacion de un juego se hace en una sola transaccion: si falla no quedan el juego,
+sus rondas ni sus jobs a medias. Como la fase escrita dentro de la transaccion no se ve
+hasta el final, se publica en la cache mientras el GameJob esta en marcha. Los hilos del
+pool mueren con el proceso, asi que al arrancar se dan por fallidos los GameJob que
+llevan STALE_AFTER sin terminar (fail_stale_jobs).
+"""
+
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections, connections, transaction
+from django.utils.timezone import now
+from .models import GameJob
+
+# Un GameJob en cola o en marcha desde hace este tiempo ya no va a terminar.
+STALE_AFTER = timedelta(minutes=30)
+PHASE_KEY = 'guess:job:{}:phase'
+
+executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, 'BACKGROUND_JOB_WORKERS', 2),
+    thread_name_prefix='guess-jobs',
+)
+
+
+def submit(func, *args, **kwargs):
+    """ Ejecuta func en el pool cerrando las conexiones a la BD del hilo al terminar."""
+    def run():
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            connections.close_all()
+    return executor.submit(run)
+
+
+def create_game(job_id, form):
+    """ Ejecuta form.save() en una transaccion actualizando la fase del GameJob indicado."""
+    key = PHASE_KEY.format(job_id)
+
+    def progress(phase):
+        cache.set(key, phase, STALE_AFTER.total_seconds())
+
+    GameJob.objects.filter(id=job_id).update(status=GameJob.RUNNING, updated=now())
+    try:
+        with transaction.atomic():
+            game = form.save(progress=progress)
+    except Exception:
+        GameJob.objects.filter(id=job_id).update(
+            status=GameJob.FAILED, phase=cache.get(key, ''), error=traceback.format_exc(),
+            updated=now())
+        raise
+    GameJob.objects.filter(id=job_id).update(
+        status=GameJob.DONE, phase=cache.get(key, ''), game=game, updated=now())
+    cache.delete(key)
+
+
+def job_phase(job):
+    """ Fase del GameJob: la de la cache mientras esta en marcha."""
+    if job.status == GameJob.RUNNING:
+        return cache.get(PHASE_KEY.format(job.id), job.phase)
+    return job.phase
+
+
+def fail_stale_jobs():
+    """ Marca como fallidos los GameJob en cola o en marcha desde hace STALE_AFTER: su
+    hilo murio con el proceso que los lanzo. Devuelve cuantos."""
+    return GameJob.objects.filter(
+        status__in=[GameJob.QUEUED, GameJob.RUNNING], updated__lt=now() - STALE_AFTER,
+    ).update(status=GameJob.FAILED, error="The process running this job stopped", updated=now())
+
+
+def enqueue_game_creation(form):
+    """ Encola la creacion del juego de un GameForm ya validado y devuelve su GameJob."""
+    job = GameJob.objects.create()
+    submit(create_game, job.id, form)
+    return job
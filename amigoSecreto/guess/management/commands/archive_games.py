@@ -0,0 +1,124 @@
+import base64
+import gzip
+import json
+import os
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.timezone import now
+from guess.models import *
+from guess.plans import read_plan
+from guess.reveal import read_reveal
+
+# Version 2: anyade las lineas guess.gameplan y guess.gamereveal y las filas de
+# SelectionTick.
+ARCHIVE_VERSION = 2
+
+# Tablas de un juego en el orden en que se borran (primero las que dependen de otras)
+# junto con el filtro que las relaciona con el juego.
+GAME_TABLES = [
+    (Guess, 'game'),
+    (PlayerState, 'game'),
+    (Enrollment, 'game'),
+    (GivesTo, 'game'),
+    (SelectionOptions, 'round__game'),
+    (NotificationBatch, 'round__game'),
+    (SelectionStats, 'round__game'),
+    (SelectionTick, 'round__game'),
+    (TeamStats, 'game'),
+    (UserTeam, 'team__game'),
+    (Teams, 'game'),
+    (Round, 'game'),
+]
+
+
+class ArchiveEncoder(DjangoJSONEncoder):
+    """ Codifica ademas los campos binarios en base64."""
+
+    def default(self, o):
+        if isinstance(o, (bytes, memoryview)):
+            return base64.b64encode(o).decode()
+        return super().default(o)
+
+
+class Command(BaseCommand):
+    """ Archiva los juegos terminados (endDate ya pasada) en un fichero comprimido y
+    luego borra sus filas por lotes pequenyos con pausas entre ellos, para no bloquear
+    las tablas mientras hay juegos en curso.
+
+    Cada archivo es un JSON por linea comprimido con gzip: una cabecera con la
+    version del formato (ARCHIVE_VERSION) y el juego, el plan y el resultado
+    decodificados y una linea por fila con su modelo y campos.
+    """
+    help = 'Archiva y purga por lotes los juegos terminados.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--game', type=int, nargs='*',
+            help='IDs de los juegos a archivar. Por defecto, todos los terminados.')
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--pause', type=float, default=0.05,
+            help='Segundos de espera entre lotes.')
+        parser.add_argument('--archive-dir', default=settings.ARCHIVE_DIR)
+        parser.add_argument('--no-delete', action='store_true',
+            help='Solo escribe el archivo.')
+
+    def handle(self, *args, **options):
+        games = Game.objects.filter(endDate__lt=now())
+        if options['game']:
+            games = games.filter(id__in=options['game'])
+            missing = set(options['game']) - set(games.values_list('id', flat=True))
+            if missing:
+                raise CommandError(f"Games not finished or not found: {sorted(missing)}")
+        os.makedirs(options['archive_dir'], exist_ok=True)
+
+        for game in games:
+            path = self.archive(game, options['archive_dir'])
+            self.stdout.write(f"Game {game.id} archived in {path}")
+            if options['no_delete']:
+                continue
+            rows, elapsed = self.purge(game, options['batch_size'], options['pause'])
+            self.stdout.write(
+                f"Game {game.id} purged: {rows} rows in {elapsed:.2f}s "
+                f"({rows/elapsed if elapsed else 0:.0f} rows/s)"
+            )
+
+    def archive(self, game, archive_dir):
+        """ Escribe todas las filas del juego en un archivo comprimido."""
+        path = os.path.join(archive_dir, f"game-{game.id}-{game.endDate:%Y%m%d}.jsonl.gz")
+        with gzip.open(path, 'wt', encoding='utf-8') as archive:
+            def write(line):
+                archive.write(json.dumps(line, cls=ArchiveEncoder, separators=(',', ':')))
+                archive.write('\n')
+            write({'version': ARCHIVE_VERSION, 'game': game.id, 'archived': now()})
+            write({'model': 'guess.game', 'fields': Game.objects.filter(id=game.id).values()[0]})
+            plan = GamePlan.objects.filter(game=game).values_list('data', flat=True).first()
+            if plan is not None:
+                write({'model': 'guess.gameplan', 'plan': read_plan(plan)})
+            reveal = GameReveal.objects.filter(game=game).values_list('data', flat=True).first()
+            if reveal is not None:
+                write({'model': 'guess.gamereveal', 'reveal': read_reveal(reveal)})
+            for model, lookup in reversed(GAME_TABLES):
+                label = model._meta.label_lower
+                for fields in model.objects.filter(**{lookup: game}).values().iterator(chunk_size=2000):
+                    write({'model': label, 'fields': fields})
+        return path
+
+    def purge(self, game, batch_size, pause):
+        """ Borra las filas del juego por lotes y devuelve (filas, segundos de trabajo)."""
+        rows, elapsed = 0, 0.0
+        for model, lookup in GAME_TABLES:
+            queryset = model.objects.filter(**{lookup: game})
+            while True:
+                start = time.perf_counter()
+                ids = list(queryset.values_list('id', flat=True)[:batch_size])
+                if not ids:
+                    break
+                deleted, _ = model.objects.filter(id__in=ids).delete()
+                elapsed += time.perf_counter() - start
+                rows += deleted
+                time.sleep(pause)
+        start = time.perf_counter()
+        deleted, _ = Game.objects.filter(id=game.id).delete()
+        elapsed += time.perf_counter() - start
+        return rows + deleted, elapsed
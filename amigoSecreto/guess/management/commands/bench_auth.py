@@ -0,0 +1,72 @@
+import statistics
+import time
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+
+# (nombre, SESSION_ENGINE, backend de autenticacion)
+CONFIGS = [
+    ('db', 'django.contrib.sessions.backends.db', 'django.contrib.auth.backends.ModelBackend'),
+    ('cached_db', 'django.contrib.sessions.backends.cached_db', 'django.contrib.auth.backends.ModelBackend'),
+    ('cached_db+user', 'django.contrib.sessions.backends.cached_db', 'guess.auth_cache.CachedModelBackend'),
+    ('cookie+user', 'django.contrib.sessions.backends.signed_cookies', 'guess.auth_cache.CachedModelBackend'),
+]
+
+# Paginas que se piden con sesion: el autocompletado (se consulta mientras se escribe)
+# y la principal.
+PAGES = [
+    ('aliases', '/aliases/?q=a'),
+    ('home', '/'),
+]
+
+
+class Command(BaseCommand):
+    """ Cuenta las consultas a la BD de una peticion autenticada en regimen estable
+    (despues de unas peticiones de calentamiento) con cada combinacion de backend de
+    sesiones y de carga del usuario, y mide su tiempo de respuesta con el cliente de
+    pruebas de Django."""
+    help = 'Consultas por peticion autenticada segun la sesion y la cache de usuarios.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--warmup', type=int, default=5)
+        parser.add_argument('--host', default='localhost')
+
+    def handle(self, *args, **options):
+        user = User.objects.filter(is_superuser=False).first()
+        if user is None:
+            self.stderr.write("There are no users")
+            return
+        self.stdout.write(f"{'config':>15} {'page':>8} {'queries/req':>11} {'p50 ms':>7} {'p95 ms':>7}")
+        for name, engine, backend in CONFIGS:
+            with override_settings(SESSION_ENGINE=engine, AUTHENTICATION_BACKENDS=[backend]):
+                client = Client(HTTP_HOST=options['host'])
+                client.force_login(user, backend=backend)
+                for page, path in PAGES:
+                    queries, times = self.measure(client, path, options)
+                    self.stdout.write(
+                        f"{name:>15} {page:>8} {queries/options['requests']:>11.2f}"
+                        f" {statistics.median(times)*1000:>7.2f} {times[int(len(times)*.95)]*1000:>7.2f}"
+                    )
+
+    def measure(self, client, path, options):
+        """ Consultas totales (en todas las BD) y tiempos de options['requests'] GET."""
+        for _ in range(options['warmup']):
+            client.get(path)
+        contexts = [CaptureQueriesContext(connections[alias]) for alias in settings.DATABASES]
+        times = []
+        for context in contexts:
+            context.__enter__()
+        try:
+            for _ in range(options['requests']):
+                start = time.perf_counter()
+                client.get(path)
+                times.append(time.perf_counter() - start)
+        finally:
+            for context in contexts:
+                context.__exit__(None, None, None)
+        times.sort()
+        return sum(len(context) for context in contexts), times
@@ -0,0 +1,74 @@
+import os
+import signal
+import subprocess
+import sys
+import time
+from django.core.management.base import BaseCommand
+from guess.models import SchedulerLease
+from guess.scheduler import LEASE_NAME
+
+
+class Command(BaseCommand):
+    """ Mide la latencia de failover del scheduler: lanza varios procesos
+    run_scheduler, mata al lider con SIGKILL y cronometra cuanto tarda otro en
+    tomar el lease. Necesita una BD compartida entre procesos (p. ej. un fichero
+    SQLite o Postgres)."""
+    help = 'Benchmark local de failover del lider del scheduler.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--nodes', type=int, default=3)
+        parser.add_argument('--ttl', type=float, default=3)
+        parser.add_argument('--rounds', type=int, default=3)
+
+    def holder(self):
+        lease = SchedulerLease.objects.filter(name=LEASE_NAME).first()
+        return lease.holder if lease else None
+
+    def wait_for_leader(self, nodes, exclude=None, timeout=60):
+        deadline = time.perf_counter() + timeout
+        while time.perf_counter() < deadline:
+            holder = self.holder()
+            if holder in nodes and holder != exclude:
+                return holder
+            time.sleep(0.02)
+        return None
+
+    def handle(self, *args, **options):
+        SchedulerLease.objects.filter(name=LEASE_NAME).delete()
+        manage = os.path.join(os.getcwd(), 'manage.py')
+        nodes = {}
+
+        def spawn(name):
+            nodes[name] = subprocess.Popen(
+                [sys.executable, manage, 'run_scheduler', '--node', name, '--ttl', str(options['ttl'])],
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            )
+
+        for i in range(options['nodes']):
+            spawn(f"bench-node-{i}")
+        latencies = []
+        try:
+            leader = self.wait_for_leader(nodes)
+            for r in range(options['rounds']):
+                if leader is None:
+                    self.stderr.write("No leader elected")
+                    break
+                nodes.pop(leader).send_signal(signal.SIGKILL)
+                killed_at = time.perf_counter()
+                new_leader = self.wait_for_leader(nodes, exclude=leader)
+                latency = time.perf_counter() - killed_at
+                latencies.append(latency)
+                self.stdout.write(f"Round {r + 1}: {leader} killed, {new_leader} took over in {latency:.2f}s")
+                # Reponemos el nodo caido para mantener el numero de nodos.
+                spawn(f"bench-node-{options['nodes'] + r}")
+                leader = new_leader
+        finally:
+            for process in nodes.values():
+                process.terminate()
+            for process in nodes.values():
+                process.wait()
+        if latencies:
+            self.stdout.write(
+                f"Failover latency with ttl={options['ttl']}s: min {min(latencies):.2f}s, "
+                f"avg {sum(latencies)/len(latencies):.2f}s, max {max(latencies):.2f}s"
+            )
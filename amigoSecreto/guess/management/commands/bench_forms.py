@@ -0,0 +1,223 @@
+import gc
+import itertools
+import json
+import os
+import platform
+import statistics
+import string
+import subprocess
+import time
+import tracemalloc
+from datetime import date, datetime, timedelta
+from django.conf import settings
+from django.contrib.auth.models import Group, User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, setup_databases, teardown_databases
+from django.utils.timezone import make_aware, now
+from guess.aliases import player_aliases
+from guess.enrollment import enroll
+from guess.forms import GameForm, GuessForm, SignUpForm
+from guess.models import *
+from guess.plans import get_plan
+from guess.reveal import get_reveal
+from guess.scheduler import set_options
+
+
+def aliases():
+    """ Alias distintos de 4 letras minusculas (los del registro llevan digitos)."""
+    return (''.join(letters) for letters in itertools.product(string.ascii_lowercase, repeat=4))
+
+
+class Command(BaseCommand):
+    """ Benchmark de los caminos criticos de forms.py con N jugadores inscritos:
+    GameForm.create_teams, GameForm.create_selections, el job de una seleccion
+    (scheduler.set_options), GuessForm.__init__ y save y SignUpForm.save.
+
+    Trabaja en una BD de pruebas que crea y borra al terminar (con
+    settings_bench, SQLite en memoria) y deshace con un savepoint lo que escribe
+    cada repeticion, asi que todas parten del mismo estado. Mide el tiempo de cada
+    repeticion y sus consultas, y la memoria maxima (tracemalloc) en una repeticion
+    aparte, para que el trazado no altere los tiempos. Los resultados se anyaden a
+    settings.BENCH_HISTORY y se comparan con los de la ejecucion anterior.
+    """
+    help = 'Benchmark de GameForm, GuessForm y SignUpForm con un historico en JSON.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--players', type=int, nargs='+', default=[100, 1000, 10000])
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--history', default=settings.BENCH_HISTORY,
+            help='Fichero JSON con los resultados anteriores.')
+        parser.add_argument('--no-history', action='store_true',
+            help='No guarda los resultados.')
+        parser.add_argument('--label', default='', help='Nota que se guarda con los resultados.')
+
+    def handle(self, *args, **options):
+        history = self.load_history(options['history'])
+        previous = {
+            (result['case'], result['players']): result
+            for result in (history[-1]['results'] if history else [])
+        }
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            self.stdout.write(
+                f"{'case':>18} {'players':>8} {'median ms':>10} {'min ms':>9}"
+                f" {'queries':>8} {'peak KB':>9} {'vs prev':>8}"
+            )
+            results = []
+            for N in options['players']:
+                for result in self.run_cases(N, options['repeat']):
+                    results.append(result)
+                    self.report(result, previous.get((result['case'], N)))
+        finally:
+            teardown_databases(old_config, verbosity=0)
+
+        if not options['no_history']:
+            history.append({
+                'date': now().isoformat(),
+                'label': options['label'],
+                'commit': self.commit(),
+                'python': platform.python_version(),
+                'database': connection.vendor,
+                'repeat': options['repeat'],
+                'results': results,
+            })
+            with open(options['history'], 'w') as history_file:
+                json.dump(history, history_file, indent=1)
+            self.stdout.write(f"Results saved in {options['history']}")
+
+    def report(self, result, previous):
+        change = ''
+        if previous:
+            change = f"{(result['median_ms']/previous['median_ms'] - 1)*100:+.0f}%"
+        self.stdout.write(
+            f"{result['case']:>18} {result['players']:>8} {result['median_ms']:>10.2f}"
+            f" {result['min_ms']:>9.2f} {result['queries']:>8} {result['peak_kb']:>9.0f} {change:>8}"
+        )
+
+    def load_history(self, path):
+        if not os.path.exists(path):
+            return []
+        with open(path) as history_file:
+            return json.load(history_file)
+
+    def commit(self):
+        """ Commit de git del codigo medido, si se puede saber."""
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+                capture_output=True, text=True, timeout=5,
+            ).stdout.strip()
+        except OSError:
+            return ''
+
+    def measure(self, case, N, repeat, run, setup=None):
+        """ Ejecuta run(*setup()) repeat veces mas una con tracemalloc, cada una en un
+        savepoint que se deshace. Devuelve el resultado del caso."""
+        times, queries, peak = [], 0, 0
+        for i in range(repeat + 1):
+            with transaction.atomic():
+                args = setup() if setup else ()
+                gc.collect()
+                if i < repeat:
+                    with CaptureQueriesContext(connection) as captured:
+                        start = time.perf_counter()
+                        run(*args)
+                        times.append(time.perf_counter() - start)
+                    queries = len(captured)
+                else:
+                    tracemalloc.start()
+                    run(*args)
+                    peak = tracemalloc.get_traced_memory()[1]
+                    tracemalloc.stop()
+                transaction.set_rollback(True)
+        return {
+            'case': case,
+            'players': N,
+            'median_ms': statistics.median(times)*1000,
+            'min_ms': min(times)*1000,
+            'queries': queries,
+            'peak_kb': peak/1024,
+        }
+
+    def seed(self, N):
+        """ N usuarios con su UserData inscritos en el proximo juego."""
+        for name in ('Guessing', 'Guessed', 'NextToGuess'):
+            Group.objects.get_or_create(name=name)
+        # Sin contrasenya usable: hashearlas tardaria mas que el propio benchmark.
+        User.objects.bulk_create(
+            [User(username=f"bench{i}", password='!') for i in range(N)], batch_size=1000)
+        ids = list(User.objects.values_list('id', flat=True))
+        UserData.objects.bulk_create([
+            UserData(user_id=user_id, alias=alias, gift='bench')
+            for user_id, alias in zip(ids, aliases())
+        ], batch_size=1000)
+        enroll(ids)
+
+    def guesser(self, plan):
+        """ (usuario, alias de la opcion, alias al que regala) de un jugador del primer
+        grupo cuya opcion tiene pareja, para que la adivinanza sea correcta."""
+        group, options = plan.rounds[0].groups[0], plan.rounds[0].options[0]
+        gives_to = dict(GivesTo.objects.filter(
+            gifter_id__in=list(options)).values_list('gifter_id', 'gifted_id'))
+        aliases = dict(UserData.objects.values_list('user_id', 'alias'))
+        for i, user_id in enumerate(group):
+            for option in options[3*i:3*i + 3]:
+                if option in gives_to:
+                    return User.objects.get(id=user_id), aliases[option], aliases[gives_to[option]]
+        return None
+
+    def run_cases(self, N, repeat):
+        """ Resultados de todos los casos con N jugadores. Todo lo que escribe se
+        deshace al terminar."""
+        # Los IDs se reutilizan al deshacer: nada de otra N puede quedar en cache.
+        for clear in (get_plan.cache_clear, get_reveal.cache_clear, player_aliases.invalidate,
+                      cache.clear):
+            clear()
+        results = []
+        with transaction.atomic():
+            self.seed(N)
+            form = GameForm()
+            start = datetime.combine(date.today() + timedelta(days=1), datetime.min.time())
+            new_game = lambda: (Game.objects.create(
+                startDate=make_aware(start), days=6, endDate=make_aware(start + timedelta(days=6))),)
+            results.append(self.measure(
+                'create_teams', N, repeat, lambda game: form.create_teams(game), new_game))
+            new_round = lambda: (Round.objects.create(
+                game=new_game()[0], **{field: make_aware(start) for field in (
+                    'firstSelection', 'secondSelection', 'thirdSelection',
+                    'fourthSelection', 'fifthSelection', 'sixthSelection')}),)
+            results.append(self.measure(
+                'create_selections', N, repeat,
+                lambda round: form.create_selections(round, form.gen_round(start, 2), 0), new_round))
+
+            # El resto de casos parte de un juego creado.
+            form = GameForm(data={'startDate': start.date().isoformat(), 'days': 6})
+            form.is_valid()
+            game = form.save()
+            plan = get_plan(game.id)
+            first = plan.rounds[0]
+            select = lambda: set_options(
+                first.id, first.groups[0], first.options[0], True, 0, players=first.players())
+            results.append(self.measure('set_options', N, repeat, select))
+
+            # Adivinanzas de un jugador del grupo de la primera seleccion.
+            select()
+            guesser = self.guesser(plan)
+            if guesser is not None:
+                user, gifter, gifted = guesser
+                results.append(self.measure('GuessForm.__init__', N, repeat, lambda: GuessForm(user=user)))
+                guess = GuessForm({'gifter': gifter, 'gifted': gifted}, user=user)
+                guess.is_valid()
+                results.append(self.measure('GuessForm.save', N, repeat, guess.save))
+
+            signup = SignUpForm({
+                'first_name': 'Bench', 'last_name': 'Mark', 'username': 'benchsignup',
+                'alias': 'b00', 'gift': 'bench', 'email': 'bench@example.com',
+                'password1': 'Bench-pass-2024', 'password2': 'Bench-pass-2024',
+            })
+            signup.is_valid()
+            results.append(self.measure('SignUpForm.save', N, repeat, signup.save))
+            transaction.set_rollback(True)
+        return results
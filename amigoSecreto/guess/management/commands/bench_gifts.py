@@ -0,0 +1,112 @@
+import random
+import statistics
+import time
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import setup_databases, teardown_databases
+from guess.gift_search import gift_of, search, search_terms
+from guess.models import *
+from .bench_forms import aliases
+
+WORDS = [
+    'libro', 'libros', 'novela', 'comic', 'cocina', 'recetas', 'auriculares', 'altavoz',
+    'camiseta', 'sudadera', 'bufanda', 'guantes', 'calcetines', 'taza', 'termo', 'mochila',
+    'cartera', 'reloj', 'pulsera', 'perfume', 'vela', 'planta', 'cactus', 'puzzle',
+    'juego', 'mesa', 'cartas', 'lego', 'pelota', 'zapatillas', 'gorro', 'lampara',
+    'cuaderno', 'boligrafos', 'acuarelas', 'vinilo', 'disco', 'entradas', 'concierto',
+    'cafe', 'chocolate', 'vino', 'queso', 'te', 'canción', 'montaña', 'viaje',
+]
+MODIFIERS = ['de', 'con', 'para', 'grande', 'pequeño', 'rojo', 'azul', 'negro', 'bonito', 'antiguo']
+QUERIES = ['libro', 'libr', 'juego mesa', 'cancion', 'acuarelas azul', 'xyz']
+
+
+class Command(BaseCommand):
+    """ Benchmark de la busqueda de regalos (gift_search.search) con el indice de texto
+    frente a recorrer UserData con gift__icontains, y de gift_of con la cache fria,
+    caliente y leyendo siempre de la BD.
+
+    Trabaja en una BD de pruebas con N deseos generados al azar (ver bench_forms).
+    """
+    help = 'Benchmark de la busqueda de regalos y de gift_of.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--wishes', type=int, default=100000)
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            with transaction.atomic():
+                rng = random.Random(options['seed'])
+                start = time.perf_counter()
+                self.seed(options['wishes'], rng)
+                self.stdout.write(
+                    f"{options['wishes']} wishes seeded in {time.perf_counter() - start:.1f} s"
+                    f" ({connection.vendor})")
+                self.stdout.write(
+                    f"{'case':>28} {'median ms':>10} {'min ms':>9} {'queries':>8} {'results':>8}")
+                self.run_cases(options['repeat'], rng)
+                transaction.set_rollback(True)
+        finally:
+            teardown_databases(old_config, verbosity=0)
+
+    def seed(self, N, rng):
+        User.objects.bulk_create(
+            [User(username=f"bench{i}", password='!') for i in range(N)], batch_size=1000)
+        ids = list(User.objects.values_list('id', flat=True))
+        UserData.objects.bulk_create([
+            UserData(user_id=user_id, alias=alias, gift=self.wish(rng))
+            for user_id, alias in zip(ids, aliases())
+        ], batch_size=1000)
+
+    def wish(self, rng):
+        words = rng.sample(WORDS, rng.randint(1, 3)) + rng.sample(MODIFIERS, rng.randint(0, 2))
+        rng.shuffle(words)
+        return ' '.join(words)[:50]
+
+    def measure(self, case, repeat, run, setup=None):
+        times, queries, result = [], 0, None
+
+        def count(execute, *args):
+            nonlocal queries
+            queries += 1
+            return execute(*args)
+
+        for _ in range(repeat):
+            if setup:
+                setup()
+            queries = 0
+            # CaptureQueriesContext solo guarda las ultimas 9000 consultas.
+            with connection.execute_wrapper(count):
+                start = time.perf_counter()
+                result = run()
+                times.append(time.perf_counter() - start)
+        self.stdout.write(
+            f"{case:>28} {statistics.median(times)*1000:>10.3f} {min(times)*1000:>9.3f}"
+            f" {queries:>8} {result:>8}")
+
+    def scan(self, query, page=1, page_size=20):
+        """ La misma busqueda sin indice: gift__icontains de cada palabra."""
+        queryset = UserData.objects.all()
+        for term in search_terms(query):
+            queryset = queryset.filter(gift__icontains=term)
+        offset = (page - 1)*page_size
+        return list(queryset.order_by('id').values_list('alias', 'gift')[offset:offset + page_size + 1])
+
+    def run_cases(self, repeat, rng):
+        for query in QUERIES:
+            self.measure(f"search '{query}'", repeat, lambda: len(search(query)[0]))
+            self.measure(f"scan '{query}'", repeat, lambda: len(self.scan(query)))
+        self.measure("search 'libro' page 50", repeat, lambda: len(search('libro', 50)[0]))
+        self.measure("scan 'libro' page 50", repeat, lambda: len(self.scan('libro', 50)))
+
+        sample = rng.sample(list(UserData.objects.values_list('alias', flat=True)), 1000)
+        lookup = lambda: sum(gift_of(alias) is not None for alias in sample)
+        self.measure('gift_of x1000 cold', repeat, lookup, cache.clear)
+        self.measure('gift_of x1000 cached', repeat, lookup)
+        self.measure('query x1000', repeat, lambda: sum(
+            UserData.objects.filter(alias=alias).values_list('gift', flat=True).first() is not None
+            for alias in sample))
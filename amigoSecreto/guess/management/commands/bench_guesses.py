@@ -0,0 +1,142 @@
+import os
+import statistics
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import override_settings, setup_databases, teardown_databases
+from guess.aliases import player_aliases
+from guess.forms import GameForm, GuessForm
+from guess.models import *
+from guess.plans import get_plan
+from guess.player_state import get_state
+from guess.reveal import get_reveal
+from guess.scheduler import set_options
+from guess.writebehind import get_queue, process_pending
+from .bench_forms import Command as BenchForms
+
+
+class Command(BaseCommand):
+    """ Benchmark de la avalancha de adivinanzas al abrir una seleccion: todo el grupo
+    de la primera seleccion adivina una vez (GuessForm, is_valid y save, como en
+    GuessView) con GuessForm.save sincrono y con GUESS_WRITE_BEHIND.
+
+    Muestra las adivinanzas aceptadas por segundo, la latencia de cada una y sus
+    consultas. Con escritura diferida mide aparte el vaciado de la cola por el worker
+    y comprueba que cada jugador ve su adivinanza antes de que se guarde y que al
+    final hay las mismas Guess que en modo sincrono. Trabaja en una BD de pruebas
+    (ver bench_forms) y cada modo se deshace al terminar.
+    """
+    help = 'Benchmark de GuessForm.save sincrono frente a la escritura diferida.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--players', type=int, nargs='+', default=[1000, 10000])
+        parser.add_argument('--batch-size', type=int, default=None,
+            help='Adivinanzas por lote del worker (por defecto GUESS_BATCH_SIZE).')
+
+    def handle(self, *args, **options):
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            self.stdout.write(
+                f"{'mode':>12} {'players':>8} {'guesses':>8} {'accepted/s':>11} {'p50 ms':>7}"
+                f" {'p99 ms':>7} {'queries':>8} {'saved/s':>8} {'saved':>6}"
+            )
+            for N in options['players']:
+                self.run(N, options['batch_size'])
+        finally:
+            teardown_databases(old_config, verbosity=0)
+
+    def submissions(self, plan):
+        """ (usuario, datos del GuessForm) de los jugadores del grupo de la primera
+        seleccion con alguna opcion que regala, la mitad acertando."""
+        group, options = plan.rounds[0].groups[0], plan.rounds[0].options[0]
+        gives_to = dict(GivesTo.objects.filter(
+            gifter_id__in=list(options)).values_list('gifter_id', 'gifted_id'))
+        aliases = dict(UserData.objects.values_list('user_id', 'alias'))
+        users = User.objects.in_bulk(group)
+        result = []
+        for i, user_id in enumerate(group):
+            gifter = next((option for option in options[3*i:3*i + 3] if option in gives_to), None)
+            if gifter is None:
+                continue
+            gifted = gives_to[gifter] if i % 2 else gifter
+            result.append((users[user_id], {'gifter': aliases[gifter], 'gifted': aliases[gifted]}))
+        return result
+
+    def submit_all(self, submissions):
+        """ Envia todas las adivinanzas. Devuelve (duraciones, consultas)."""
+        times, queries = [], 0
+
+        def count(execute, *args):
+            nonlocal queries
+            queries += 1
+            return execute(*args)
+
+        # CaptureQueriesContext solo guarda las ultimas 9000 consultas.
+        with connection.execute_wrapper(count):
+            for user, data in submissions:
+                start = time.perf_counter()
+                form = GuessForm(data, user=user)
+                if form.is_valid():
+                    form.save()
+                times.append(time.perf_counter() - start)
+        return times, queries
+
+    def report(self, mode, N, times, queries, saved, drain=None):
+        total = sum(times)
+        p99 = sorted(times)[min(len(times) - 1, int(len(times)*0.99))]
+        saved_rate = f"{saved/drain:.0f}" if drain else '-'
+        self.stdout.write(
+            f"{mode:>12} {N:>8} {len(times):>8} {len(times)/total:>11.0f}"
+            f" {statistics.median(times)*1000:>7.2f} {p99*1000:>7.2f}"
+            f" {queries/len(times):>8.1f} {saved_rate:>8} {saved:>6}"
+        )
+
+    def run(self, N, batch_size):
+        for clear in (get_plan.cache_clear, get_reveal.cache_clear, player_aliases.invalidate,
+                      cache.clear):
+            clear()
+        with transaction.atomic():
+            BenchForms().seed(N)
+            start = datetime.combine(date.today() + timedelta(days=1), datetime.min.time())
+            form = GameForm(data={'startDate': start.date().isoformat(), 'days': 6})
+            form.is_valid()
+            game = form.save()
+            plan = get_plan(game.id)
+            first = plan.rounds[0]
+            submissions = self.submissions(plan)
+            if not submissions:
+                self.stdout.write(f"No guesses to submit with {N} players")
+                transaction.set_rollback(True)
+                return
+            select = lambda: set_options(
+                first.id, first.groups[0], first.options[0], True, 0, players=first.players())
+
+            with transaction.atomic():
+                select()
+                times, queries = self.submit_all(submissions)
+                sync_saved = Guess.objects.filter(game=game).count()
+                self.report('sync', N, times, queries, sync_saved)
+                transaction.set_rollback(True)
+
+            with tempfile.TemporaryDirectory() as tmp, override_settings(
+                    GUESS_WRITE_BEHIND=True, GUESS_QUEUE_EMBEDDED=False,
+                    GUESS_QUEUE_PATH=os.path.join(tmp, 'queue.sqlite3')), transaction.atomic():
+                select()
+                times, queries = self.submit_all(submissions)
+                pending = sum(
+                    get_state(user.id).status == PlayerState.GUESSED for user, _ in submissions)
+                queued = len(get_queue())
+                drain_start = time.perf_counter()
+                process_pending(batch_size)
+                drain = time.perf_counter() - drain_start
+                saved = Guess.objects.filter(game=game).count()
+                self.report('write-behind', N, times, queries, saved, drain)
+                if pending != len(submissions) or queued != len(submissions) or saved != sync_saved:
+                    self.stderr.write(
+                        f"Mismatch: {pending} players saw their guess before saving,"
+                        f" {queued} queued, {saved} saved (sync: {sync_saved})")
+                transaction.set_rollback(True)
+            transaction.set_rollback(True)
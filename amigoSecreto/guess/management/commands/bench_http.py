@@ -0,0 +1,227 @@
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from importlib import import_module
+from socketserver import ThreadingMixIn
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.core.servers.basehttp import WSGIRequestHandler, WSGIServer
+from django.db.backends.signals import connection_created
+
+# (nombre, servidor, ruta): la pagina principal sincrona en WSGI contra su version
+# asincrona en ASGI.
+TARGETS = [
+    ('wsgi', 'wsgi', '/'),
+    ('asgi', 'asgi', '/async/'),
+]
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+class PooledWSGIServer(ThreadingMixIn, WSGIServer):
+    """ Servidor WSGI con un numero fijo de hilos, como un despliegue con N workers
+    sincronos: cada peticion ocupa un hilo mientras espera a la BD."""
+    request_queue_size = 1024
+
+    def __init__(self, *args, workers, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self.process_request_thread, request, client_address)
+
+
+async def serve_asgi(app, port):
+    """ Servidor HTTP/1.0 minimo sobre asyncio para la aplicacion ASGI (sin
+    dependencias externas). Una peticion por conexion."""
+    async def handle(reader, writer):
+        try:
+            head = await reader.readuntil(b'\r\n\r\n')
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+            return
+        lines = head.decode('latin-1').split('\r\n')
+        method, target, _ = lines[0].split(' ', 2)
+        path, _, query = target.partition('?')
+        headers = []
+        for line in lines[1:]:
+            if line:
+                name, _, value = line.partition(':')
+                headers.append((name.strip().lower().encode(), value.strip().encode()))
+        length = int(dict(headers).get(b'content-length', 0))
+        body = await reader.readexactly(length) if length else b''
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.0',
+            'method': method, 'scheme': 'http', 'path': path, 'raw_path': path.encode(),
+            'query_string': query.encode(), 'headers': headers,
+            'client': writer.get_extra_info('peername')[:2], 'server': ('127.0.0.1', port),
+        }
+
+        async def receive():
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                writer.write(f"HTTP/1.0 {message['status']} -\r\n".encode())
+                for name, value in message.get('headers', []):
+                    writer.write(name + b': ' + value + b'\r\n')
+                writer.write(b'\r\n')
+            elif message['type'] == 'http.response.body':
+                writer.write(message.get('body', b''))
+
+        await app(scope, receive, send)
+        await writer.drain()
+        writer.close()
+
+    server = await asyncio.start_server(handle, '127.0.0.1', port, backlog=1024)
+    async with server:
+        await server.serve_forever()
+
+
+async def load(port, path, cookie, concurrency, requests):
+    """ Lanza requests GET con concurrency clientes a la vez. Devuelve las latencias
+    en segundos, los errores y el tiempo total."""
+    latencies, errors = [], 0
+    queue = iter(range(requests))
+    request = (f"GET {path} HTTP/1.0\r\nHost: 127.0.0.1\r\nCookie: {cookie}\r\n\r\n").encode()
+
+    async def client():
+        nonlocal errors
+        for _ in queue:
+            start = time.perf_counter()
+            try:
+                reader, writer = await asyncio.open_connection('127.0.0.1', port)
+                writer.write(request)
+                await writer.drain()
+                response = await reader.read()
+                writer.close()
+                if response.split(b' ', 2)[1:2] != [b'200']:
+                    errors += 1
+            except OSError:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return latencies, errors, time.perf_counter() - start
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values)*p))]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class Command(BaseCommand):
+    """ Compara la pagina principal servida por WSGI (vista sincrona, N hilos) con su
+    version asincrona servida por ASGI (event loop y un pool de ASYNC_DB_WORKERS
+    hilos para la BD). Cada servidor corre en su propio proceso y el cliente de carga
+    en este, y se mide peticiones/s y latencia p50/p95/p99 para cada concurrencia.
+
+    --db-latency anyade una espera a cada consulta para simular una BD remota, que es
+    donde un worker sincrono se queda bloqueado. Necesita una BD compartida entre
+    procesos (p. ej. un fichero SQLite o Postgres).
+    """
+    help = 'Benchmark HTTP de las vistas sincronas (WSGI) contra las asincronas (ASGI).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 16, 64, 256])
+        parser.add_argument('--requests', type=int, default=1000)
+        parser.add_argument('--workers', type=int, default=settings.ASYNC_DB_WORKERS,
+            help='Hilos del servidor WSGI y del pool de BD de ASGI.')
+        parser.add_argument('--db-latency', type=float, default=0,
+            help='Milisegundos de espera anyadidos a cada consulta.')
+        parser.add_argument('--serve', choices=['wsgi', 'asgi'], help=argparse.SUPPRESS)
+        parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+
+    def handle(self, *args, **options):
+        if options['serve']:
+            return self.serve(options)
+
+        cookie = self.session_cookie()
+        self.stdout.write(
+            f"{'server':>6} {'conc':>5} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8}"
+            f" {'p99 ms':>8} {'max ms':>8} {'errors':>6}"
+        )
+        for name, server, path in TARGETS:
+            port = free_port()
+            process = subprocess.Popen(
+                [sys.executable, sys.argv[0], 'bench_http', '--serve', server,
+                 '--port', str(port), '--workers', str(options['workers']),
+                 '--db-latency', str(options['db_latency'])],
+                env={**os.environ, 'SCHEDULER_EMBEDDED': '0', 'ASYNC_DB_WORKERS': str(options['workers'])},
+            )
+            try:
+                self.wait_for(port)
+                # Calentamos conexiones y caches.
+                asyncio.run(load(port, path, cookie, options['workers'], options['workers']*2))
+                for concurrency in options['concurrency']:
+                    latencies, errors, elapsed = asyncio.run(
+                        load(port, path, cookie, concurrency, options['requests']))
+                    self.stdout.write(
+                        f"{name:>6} {concurrency:>5} {len(latencies)/elapsed:>8.0f}"
+                        f" {percentile(latencies, .5)*1000:>8.1f} {percentile(latencies, .95)*1000:>8.1f}"
+                        f" {percentile(latencies, .99)*1000:>8.1f} {max(latencies)*1000:>8.1f} {errors:>6}"
+                    )
+            finally:
+                process.terminate()
+                process.wait()
+
+    def session_cookie(self):
+        """ Sesion de un usuario de prueba para las paginas que requieren login."""
+        user, _ = User.objects.get_or_create(username='bench-http')
+        session = import_module(settings.SESSION_ENGINE).SessionStore()
+        session[SESSION_KEY] = str(user.pk)
+        session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+        session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+        session.create()
+        return f"{settings.SESSION_COOKIE_NAME}={session.session_key}"
+
+    def wait_for(self, port, timeout=30):
+        deadline = time.perf_counter() + timeout
+        while time.perf_counter() < deadline:
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                return
+            except OSError:
+                time.sleep(0.1)
+        raise RuntimeError(f"The server on port {port} did not start")
+
+    def serve(self, options):
+        if options['db_latency']:
+            delay = options['db_latency']/1000
+
+            def slow(execute, sql, params, many, context):
+                time.sleep(delay)
+                return execute(sql, params, many, context)
+
+            def add_latency(sender, connection, **kwargs):
+                # Se llama en cada reconexion del mismo DatabaseWrapper.
+                if slow not in connection.execute_wrappers:
+                    connection.execute_wrappers.append(slow)
+            connection_created.connect(add_latency, weak=False)
+
+        if options['serve'] == 'wsgi':
+            from amigoSecreto.wsgi import application
+            httpd = PooledWSGIServer(('127.0.0.1', options['port']), QuietHandler,
+                                     workers=options['workers'])
+            httpd.set_app(application)
+            httpd.serve_forever()
+        else:
+            from amigoSecreto.asgi import application
+            asyncio.run(serve_asgi(application, options['port']))
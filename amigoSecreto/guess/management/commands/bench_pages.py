@@ -0,0 +1,110 @@
+import re
+import statistics
+import time
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.test import Client
+from guess.models import PlayerState
+
+# (nombre, ruta, quien la pide): anonimo, un jugador que esta adivinando o un superusuario.
+PAGES = [
+    ('signin', '/signin/', None),
+    ('signup', '/signup/', None),
+    ('home', '/', 'player'),
+    ('guess', '/guess/', 'player'),
+    ('aliases', '/aliases/?q=a', 'player'),
+    ('scheduler', '/scheduler/', 'superuser'),
+]
+
+ASSET_RE = re.compile(rb'<(?:link[^>]+href|script[^>]+src)="([^"]+)"')
+
+
+class Command(BaseCommand):
+    """ Mide el peso y el tiempo hasta el primer byte de las paginas principales con
+    el cliente de pruebas de Django (en el propio proceso, sin red), con la
+    configuracion actual (DEBUG, middleware y almacenamiento de estaticos).
+
+    Para cada pagina muestra los bytes del HTML sin comprimir y tal como viajan si
+    el navegador acepta gzip, los de los estaticos que enlaza en la primera visita,
+    los que se transfieren al volver (revalidando el HTML con su ETag y con los
+    estaticos ya en la cache del navegador) y la mediana y el p95 del tiempo de
+    respuesta. Con DEBUG=0 hay que ejecutar antes collectstatic y poner el host en
+    ALLOWED_HOSTS.
+    """
+    help = 'Peso y tiempo de respuesta de las paginas principales.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--host', default='localhost')
+
+    def handle(self, *args, **options):
+        clients = {
+            None: Client(HTTP_HOST=options['host']),
+            'player': self.client_for(self.player(), options['host']),
+            'superuser': self.client_for(User.objects.filter(is_superuser=True).first(), options['host']),
+        }
+        self.stdout.write(
+            f"{'page':>10} {'status':>6} {'html B':>8} {'gzip B':>8} {'assets B':>9}"
+            f" {'revisit B':>9} {'p50 ms':>7} {'p95 ms':>7}"
+        )
+        for name, path, who in PAGES:
+            client = clients[who]
+            if client is None:
+                self.stdout.write(f"{name:>10} skipped (no {who})")
+                continue
+            plain = client.get(path)
+            compressed = client.get(path, HTTP_ACCEPT_ENCODING='gzip')
+            assets = self.assets(client, plain)
+            revisit = self.revisit(client, path, compressed, assets)
+            times = []
+            for _ in range(options['requests']):
+                start = time.perf_counter()
+                client.get(path, HTTP_ACCEPT_ENCODING='gzip')
+                times.append(time.perf_counter() - start)
+            times.sort()
+            self.stdout.write(
+                f"{name:>10} {plain.status_code:>6} {self.size(plain):>8} {self.size(compressed):>8}"
+                f" {sum(size for size, _ in assets.values()):>9} {revisit:>9}"
+                f" {statistics.median(times)*1000:>7.2f} {times[int(len(times)*.95)]*1000:>7.2f}"
+            )
+
+    def player(self):
+        state = PlayerState.objects.filter(status=PlayerState.GUESSING).order_by('-game_id').first()
+        return state.user if state else User.objects.filter(is_superuser=False).first()
+
+    def client_for(self, user, host):
+        if user is None:
+            return None
+        client = Client(HTTP_HOST=host)
+        client.force_login(user)
+        return client
+
+    def size(self, response):
+        if response.streaming:
+            return sum(len(chunk) for chunk in response.streaming_content)
+        return len(response.content)
+
+    def assets(self, client, page):
+        """ {url: (bytes transferidos con gzip, respuesta)} de los estaticos del HTML."""
+        content = b'' if page.streaming else page.content
+        assets = {}
+        for url in dict.fromkeys(ASSET_RE.findall(content)):
+            url = url.decode()
+            if not url.startswith(settings.STATIC_URL):
+                continue
+            response = client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+            assets[url] = (self.size(response) if response.status_code == 200 else 0, response)
+        return assets
+
+    def revisit(self, client, path, page, assets):
+        """ Bytes de una segunda visita: el HTML se revalida con su ETag y los
+        estaticos solo se vuelven a pedir si no se pueden guardar en la cache."""
+        headers = {'HTTP_ACCEPT_ENCODING': 'gzip'}
+        if page.has_header('ETag'):
+            headers['HTTP_IF_NONE_MATCH'] = page['ETag']
+        total = self.size(client.get(path, **headers))
+        for url, (size, response) in assets.items():
+            if 'max-age' not in response.get('Cache-Control', ''):
+                total += size
+        return total
@@ -0,0 +1,67 @@
+import tracemalloc
+from array import array
+from django.core.management.base import BaseCommand
+from guess.models import Teams, UserTeam
+from guess.game_logic import *
+from guess.scheduler import pack_options
+
+
+def closure_state(N):
+    """ Estado que retenian los jobs antes: por cada ronda, los grupos de instancias
+    de UserTeam (cada una con su Teams cacheado al consultar team.name) y las listas
+    de opciones con esas mismas instancias."""
+    state = []
+    for _ in range(3):
+        players = [
+            UserTeam(id=i, team=Teams(id=1 + i % 2, name=WOLFS if i % 2 else VILLAGERS), user_id=i)
+            for i in range(N)
+        ]
+        wolfs = [p for p in players if p.team.name == WOLFS]
+        villagers = [p for p in players if p.team.name == VILLAGERS]
+        for group in split_groups(players):
+            options = [pick_options(villagers if p.team.name == WOLFS else wolfs) for p in group]
+            state.append((group, options))
+    return state
+
+
+def compact_state(N):
+    """ Estado que retienen ahora los jobs: arrays de IDs."""
+    state = []
+    for _ in range(3):
+        players = list(range(N))
+        wolfs, villagers = players[1::2], players[::2]
+        is_wolf = set(wolfs)
+        for group in split_groups(players):
+            options = pack_options(pick_options(villagers if p in is_wolf else wolfs) for p in group)
+            state.append((array('l', group), options))
+    return state
+
+
+def measure(build, N):
+    """ Bytes que siguen reservados tras construir el estado de los jobs."""
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    state = build(N)
+    resident = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+    del state
+    return resident
+
+
+class Command(BaseCommand):
+    """ Mide con tracemalloc la memoria que retienen los jobs de las selecciones de
+    un juego (3 rondas de 6 selecciones) antes y despues de usar arrays de IDs."""
+    help = 'Benchmark de memoria de los jobs de las selecciones.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--players', type=int, nargs='+', default=[1000, 10000, 50000])
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'players':>8} {'antes (MB)':>11} {'ahora (MB)':>11} {'x10k antes':>11} {'x10k ahora':>11} {'ratio':>6}")
+        for N in options['players']:
+            before = measure(closure_state, N)
+            after = measure(compact_state, N)
+            self.stdout.write(
+                f"{N:>8} {before/2**20:>11.2f} {after/2**20:>11.2f}"
+                f" {before/N*10000/2**20:>11.2f} {after/N*10000/2**20:>11.2f} {before/after:>6.1f}"
+            )
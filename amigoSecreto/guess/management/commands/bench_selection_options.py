@@ -0,0 +1,165 @@
+import random
+import time
+from array import array
+from django.apps.registry import Apps
+from django.core.management.base import BaseCommand
+from django.db import connection, models, transaction
+from guess.game_logic import SELECTIONS_PER_ROUND
+from guess.options import decode_selection, encode_ids
+from guess.scheduler import pack_options
+
+# Registro propio para que los modelos del benchmark no formen parte de la app.
+bench_apps = Apps()
+
+
+class LegacyOptions(models.Model):
+    """ Esquema del antiguo modelo Options (una fila por jugador)."""
+    round_id = models.IntegerField(db_index=True)
+    user_id = models.IntegerField(db_index=True)
+    option1_id = models.IntegerField(db_index=True)
+    option2_id = models.IntegerField(db_index=True)
+    option3_id = models.IntegerField(db_index=True)
+
+    class Meta:
+        apps = bench_apps
+        app_label = 'guess'
+        db_table = 'bench_legacy_options'
+
+
+class CompactOptions(models.Model):
+    """ Esquema de SelectionOptions (una fila por seleccion)."""
+    round_id = models.IntegerField()
+    selection = models.IntegerField()
+    group = models.BinaryField()
+    options = models.BinaryField()
+
+    class Meta:
+        apps = bench_apps
+        app_label = 'guess'
+        db_table = 'bench_selection_options'
+        unique_together = [('round_id', 'selection')]
+
+
+class Command(BaseCommand):
+    """ Compara el almacenamiento de las opciones de las selecciones de una ronda:
+    una fila por jugador con 3 FKs (el antiguo Options, que se borraba y se volvia
+    a insertar en cada seleccion) contra una fila empaquetada por seleccion
+    (SelectionOptions). Usa tablas propias con los mismos indices que borra al
+    terminar, asi que no toca los datos del juego.
+
+    Mide las filas y los bytes escritos por seleccion, lo que tarda cada escritura
+    y la latencia de leer las opciones de un jugador. Las paginas ya no leen
+    SelectionOptions (usan PlayerState); la lectura compacta es la de
+    player_state.rebuild: una consulta de la ultima fila y decode_selection.
+    Las tablas se crean con el schema_editor, asi que funciona con cualquier BD.
+    """
+    help = 'Benchmark de escritura y lectura de las opciones de las selecciones.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--players', type=int, nargs='+', default=[1000, 10000, 50000])
+        parser.add_argument('--reads', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            f"{'players':>8} {'storage':>8} {'rows/sel':>9} {'KB/sel':>8}"
+            f" {'write ms':>9} {'read us':>8}"
+        )
+        for N in options['players']:
+            groups = self.selections(N)
+            # Las lecturas son de jugadores de la seleccion en curso (la ultima).
+            readers = [random.choice(groups[-1][0]) for _ in range(options['reads'])]
+            self.create_tables()
+            try:
+                with connection.cursor() as cursor:
+                    legacy = self.legacy(cursor, groups, readers)
+                    compact = self.compact(cursor, groups, readers)
+            finally:
+                self.drop_tables()
+            for name, (rows, written, write_s, read_s) in (('legacy', legacy), ('compact', compact)):
+                self.stdout.write(
+                    f"{N:>8} {name:>8} {rows/len(groups):>9.0f} {written/len(groups)/1024:>8.1f}"
+                    f" {write_s/len(groups)*1000:>9.2f} {read_s/len(readers)*10**6:>8.1f}"
+                )
+
+    def selections(self, N):
+        """ Grupos de una ronda con sus opciones (3 IDs al azar por jugador)."""
+        players = list(range(1, N + 1))
+        random.shuffle(players)
+        size = -(-N // SELECTIONS_PER_ROUND)
+        return [
+            (array('l', group), pack_options(random.sample(players, 3) for _ in group))
+            for group in (players[i:i + size] for i in range(0, N, size))
+        ]
+
+    def create_tables(self):
+        # Las de una ejecucion anterior que no llego a borrarlas.
+        self.drop_tables()
+        with connection.schema_editor() as editor:
+            editor.create_model(LegacyOptions)
+            editor.create_model(CompactOptions)
+
+    def drop_tables(self):
+        existing = connection.introspection.table_names()
+        with connection.schema_editor() as editor:
+            for model in (LegacyOptions, CompactOptions):
+                if model._meta.db_table in existing:
+                    editor.delete_model(model)
+
+    def table(self, model):
+        return connection.ops.quote_name(model._meta.db_table)
+
+    def column(self, name):
+        return connection.ops.quote_name(name)
+
+    def legacy(self, cursor, groups, readers):
+        """ Cada seleccion borra todas las filas e inserta una por jugador. Cada fila
+        escribe 6 enteros mas una entrada en cada uno de los 5 indices."""
+        table = self.table(LegacyOptions)
+        rows = written = 0
+        write_s = 0.0
+        for group, options in groups:
+            start = time.perf_counter()
+            with transaction.atomic():
+                cursor.execute(f"DELETE FROM {table}")
+                deleted = cursor.rowcount
+                cursor.executemany(
+                    f"INSERT INTO {table} (round_id, user_id, option1_id, option2_id, option3_id)"
+                    " VALUES (1, %s, %s, %s, %s)",
+                    [(user_id, *options[3*i:3*i+3]) for i, user_id in enumerate(group)])
+            write_s += time.perf_counter() - start
+            rows += deleted + len(group)
+            written += (deleted + len(group)) * (6 + 5*2) * 8
+        start = time.perf_counter()
+        for user_id in readers:
+            cursor.execute(
+                f"SELECT option1_id, option2_id, option3_id FROM {table} WHERE user_id = %s",
+                [user_id])
+            cursor.fetchone()
+        return rows, written, write_s, time.perf_counter() - start
+
+    def compact(self, cursor, groups, readers):
+        """ Cada seleccion inserta una fila con los arrays empaquetados. La lectura es
+        la de player_state.rebuild: una consulta de la ultima fila y decode_selection,
+        y luego las opciones de cada jugador del diccionario."""
+        table, group_column = self.table(CompactOptions), self.column('group')
+        rows = written = 0
+        write_s = 0.0
+        for selection, (group, options) in enumerate(groups):
+            start = time.perf_counter()
+            with transaction.atomic():
+                group_bytes, options_bytes = encode_ids(group), encode_ids(options)
+                cursor.execute(
+                    f"INSERT INTO {table} (round_id, selection, {group_column}, options)"
+                    " VALUES (1, %s, %s, %s)", [selection, group_bytes, options_bytes])
+            write_s += time.perf_counter() - start
+            rows += 1
+            written += 4*8 + len(group_bytes) + len(options_bytes) + 3*8
+
+        start = time.perf_counter()
+        cursor.execute(
+            f"SELECT {group_column}, options FROM {table} ORDER BY id DESC"
+            f" {connection.ops.limit_offset_sql(None, 1)}")
+        selection = decode_selection(*cursor.fetchone())
+        for user_id in readers:
+            selection.get(user_id)
+        return rows, written, write_s, time.perf_counter() - start
@@ -0,0 +1,57 @@
+import signal
+import threading
+import time
+from django.core.management.base import BaseCommand
+from django.db import InterfaceError, OperationalError, close_old_connections
+from guess.guess_queue import get_queue
+from guess.writebehind import process_batch
+
+
+class Command(BaseCommand):
+    """ Worker de las adivinanzas encoladas (GUESS_WRITE_BEHIND) para cuando no se
+    guardan desde el proceso web (GUESS_QUEUE_EMBEDDED=0). Tiene que usar la misma
+    cola (GUESS_QUEUE_PATH) que el proceso web. Sin --loop vacia la cola una vez y
+    termina. Muestra el informe de cada lote. Las adivinanzas que no se pudieron guardar
+quedan apartadas; --retry-failed las devuelve a la cola antes de empezar."""
+    help = 'Guarda las adivinanzas pendientes de la cola de escritura diferida.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', type=float, default=None, metavar='SECONDS',
+            help='Sigue buscando adivinanzas pendientes cada SECONDS segundos.')
+        parser.add_argument('--batch-size', type=int, default=None,
+            help='Adivinanzas por lote (por defecto GUESS_BATCH_SIZE).')
+        parser.add_argument('--retry-failed', action='store_true',
+            help='Vuelve a encolar las adivinanzas apartadas por errores.')
+
+    def handle(self, *args, **options):
+        queue = get_queue()
+        if options['retry_failed']:
+            self.stdout.write(f"{queue.retry_failed()} failed guesses queued again")
+        stop = threading.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(sig, lambda *_: stop.set())
+        reported = 0
+        while not stop.is_set():
+            close_old_connections()
+            while not stop.is_set():
+                start = time.perf_counter()
+                try:
+                    processed = process_batch(options['batch_size'])
+                except (OperationalError, InterfaceError) as error:
+                    if options['loop'] is None:
+                        raise
+                    # La BD no responde: se reintenta en la siguiente vuelta.
+                    self.stderr.write(f"Could not save the queued guesses: {error}")
+                    break
+                if not processed:
+                    break
+                duration = time.perf_counter() - start
+                self.stdout.write(
+                    f"{processed} guesses saved in {duration*1000:.0f} ms ({processed/duration:.0f}/s)")
+            failed = len(queue.failed())
+            if failed != reported:
+                self.stderr.write(f"{failed} guesses could not be saved (see --retry-failed)")
+                reported = failed
+            if options['loop'] is None:
+                break
+            stop.wait(options['loop'])
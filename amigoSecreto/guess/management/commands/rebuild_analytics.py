@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+from guess.models import Game
+from guess.analytics import rebuild
+
+
+class Command(BaseCommand):
+    """ Recalcula SelectionStats y TeamStats desde las Guess, para los juegos creados
+    antes de mantenerlas o si se desincronizan. Por defecto solo el juego activo (el
+    ultimo creado)."""
+    help = 'Reconstruye las estadisticas de las adivinanzas de un juego.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--game', type=int, nargs='*',
+            help='IDs de los juegos. Por defecto, el ultimo creado.')
+
+    def handle(self, *args, **options):
+        if options['game']:
+            games = Game.objects.filter(id__in=options['game'])
+            missing = set(options['game']) - set(games.values_list('id', flat=True))
+            if missing:
+                raise CommandError(f"Games not found: {sorted(missing)}")
+        else:
+            games = Game.objects.order_by('-startDate')[:1]
+        for game in games:
+            self.stdout.write(f"Game {game.id}: {rebuild(game)} guesses counted")
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+from guess.models import Game
+from guess.player_state import rebuild
+
+
+class Command(BaseCommand):
+    """ Recalcula la proyeccion PlayerState desde las tablas normalizadas para reparar
+    inconsistencias. Por defecto solo el juego activo (el ultimo creado), que es el
+    unico cuyo estado reflejan los grupos."""
+    help = 'Reconstruye los PlayerState de un juego.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--game', type=int, nargs='*',
+            help='IDs de los juegos. Por defecto, el ultimo creado.')
+
+    def handle(self, *args, **options):
+        if options['game']:
+            games = Game.objects.filter(id__in=options['game'])
+            missing = set(options['game']) - set(games.values_list('id', flat=True))
+            if missing:
+                raise CommandError(f"Games not found: {sorted(missing)}")
+        else:
+            games = Game.objects.order_by('-startDate')[:1]
+        for game in games:
+            self.stdout.write(f"Game {game.id}: {rebuild(game)} player states rebuilt")
@@ -0,0 +1,22 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from guess.snapshots import read_snapshot, restore_snapshot
+
+
+class Command(BaseCommand):
+    """ Crea un juego nuevo a partir de un snapshot de snapshot_game, con IDs nuevos
+    (ver snapshots.py). No programa sus jobs."""
+    help = 'Restaura el snapshot de un juego como un juego nuevo.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Fichero de snapshot_game.')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        try:
+            game, rows = restore_snapshot(read_snapshot(options['path']))
+        except (OSError, ValueError) as error:
+            raise CommandError(error)
+        self.stdout.write(
+            f"Game {game.id} restored: {rows} rows in {time.perf_counter() - start:.2f}s"
+        )
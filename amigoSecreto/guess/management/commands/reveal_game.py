@@ -0,0 +1,32 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.timezone import now
+from guess.models import Game
+from guess.reveal import reveal_game
+
+
+class Command(BaseCommand):
+    """ Calcula los resultados de los juegos terminados y deja sus paginas en la cache.
+    Lo hace el job de cada juego al pasar su endDate; el comando sirve para repetirlo
+    o para los juegos que terminaron sin scheduler."""
+    help = 'Ejecuta la revelacion final de los juegos terminados.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--game', type=int, nargs='*',
+            help='IDs de los juegos. Por defecto, los terminados sin revelar.')
+
+    def handle(self, *args, **options):
+        if options['game']:
+            games = Game.objects.filter(id__in=options['game'])
+            missing = set(options['game']) - set(games.values_list('id', flat=True))
+            if missing:
+                raise CommandError(f"Games not found: {sorted(missing)}")
+        else:
+            games = Game.objects.filter(endDate__lt=now(), reveal__isnull=True)
+        for game in games:
+            start = time.perf_counter()
+            reveal = reveal_game(game)
+            self.stdout.write(
+                f"Game {game.id} revealed: {len(reveal.players)} players,"
+                f" teams {reveal.teams} in {time.perf_counter() - start:.2f}s"
+            )
@@ -0,0 +1,24 @@
+import signal
+import threading
+from django.core.management.base import BaseCommand
+from guess.scheduler import LeaderElection
+
+
+class Command(BaseCommand):
+    """ Proceso dedicado al scheduler de las selecciones. Se puede lanzar uno en cada
+    nodo: solo el que tenga el lease ejecuta los jobs y, si cae, otro lo sustituye."""
+    help = 'Participa en la eleccion del lider del scheduler y ejecuta sus jobs.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--node', default=None, help='Identificador del nodo.')
+        parser.add_argument('--ttl', type=float, default=None,
+            help='Segundos que dura el lease sin renovarse.')
+
+    def handle(self, *args, **options):
+        stop = threading.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(sig, lambda *_: stop.set())
+        election = LeaderElection(node=options['node'], ttl=options['ttl'])
+        self.stdout.write(f"Scheduler node {election.node} started")
+        election.run(stop)
+        self.stdout.write(f"Scheduler node {election.node} stopped")
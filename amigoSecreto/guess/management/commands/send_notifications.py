@@ -0,0 +1,34 @@
+import signal
+import threading
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from guess.notifications import deliver_pending
+
+
+class Command(BaseCommand):
+    """ Worker de los avisos de las selecciones para cuando no se envian desde el
+    proceso del scheduler (NOTIFICATIONS_EMBEDDED=0). Sin --loop envia los lotes
+    pendientes una vez y termina. Muestra el informe de cada lote."""
+    help = 'Envia los avisos pendientes de las selecciones.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', type=float, default=None, metavar='SECONDS',
+            help='Sigue buscando lotes pendientes cada SECONDS segundos.')
+        parser.add_argument('--batch-size', type=int, default=None,
+            help='Mensajes por envio (por defecto NOTIFICATION_BATCH_SIZE).')
+
+    def handle(self, *args, **options):
+        stop = threading.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(sig, lambda *_: stop.set())
+        while not stop.is_set():
+            close_old_connections()
+            for batch in deliver_pending(options['batch_size']):
+                self.stdout.write(
+                    f"Round {batch.round_id} selection {batch.selection}: {batch.sent} sent,"
+                    f" {batch.failed} failed, {batch.skipped} skipped of {batch.queued}"
+                    f" in {batch.duration_ms} ms ({batch.rate:.0f}/s)"
+                )
+            if options['loop'] is None:
+                break
+            stop.wait(options['loop'])
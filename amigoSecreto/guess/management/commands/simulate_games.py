@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand
+from guess.simulation import run
+from guess.game_logic import WOLFS, VILLAGERS
+
+
+class Command(BaseCommand):
+    """ Simula partidas en memoria para ver como se comportan las reglas del juego
+    (falso positivo de 5/N, grupos por seleccion y duracion de las rondas) segun el
+    numero de jugadores y los dias del juego.
+
+    Ejemplo: python manage.py simulate_games --players 40 --games 1000000
+    """
+    help = 'Simulador Monte Carlo del balance del juego.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--players', type=int, nargs='+', default=[20, 40, 80])
+        parser.add_argument('--days', type=int, nargs='+', default=list(range(6, 13)))
+        parser.add_argument('--games', type=int, default=100000)
+        parser.add_argument('--workers', type=int, default=None)
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--knowledge', type=float, default=0.3,
+            help='Probabilidad de que un jugador sepa a quien regala el gifter que escoge.')
+        parser.add_argument('--tau', type=float, default=8.0,
+            help='Horas caracteristicas de respuesta de los jugadores.')
+        parser.add_argument('--seed', type=int, default=None)
+
+    def handle(self, *args, **options):
+        for N in options['players']:
+            report = run(
+                N, options['days'], options['games'],
+                workers=options['workers'],
+                batch_size=options['batch_size'],
+                knowledge=options['knowledge'],
+                tau=options['tau'],
+                seed=options['seed'],
+            )
+            self.stdout.write(f"\n{N} jugadores")
+            self.stdout.write(
+                f"{'days':>4} {'games/s':>10} {'P(lobos)':>9} {'P(aldeanos)':>11} {'P(empate)':>9}"
+                f" {'lobos media/std/p5-p95':>24} {'aldeanos media/std/p5-p95':>27}"
+            )
+            for days, row in report.items():
+                wolfs, villagers = row[WOLFS], row[VILLAGERS]
+                self.stdout.write(
+                    f"{days:>4} {row['games_per_second']:>10.0f}"
+                    f" {row['win_rate'][WOLFS]:>9.3f} {row['win_rate'][VILLAGERS]:>11.3f}"
+                    f" {row['win_rate']['Tie']:>9.3f}"
+                    f" {wolfs['mean']:>9.2f}/{wolfs['std']:.2f}/{wolfs['p5']}-{wolfs['p95']:<6}"
+                    f" {villagers['mean']:>12.2f}/{villagers['std']:.2f}/{villagers['p5']}-{villagers['p95']}"
+                )
@@ -0,0 +1,32 @@
+import os
+import time
+from django.core.management.base import BaseCommand, CommandError
+from guess.models import Game
+from guess.snapshots import write_snapshot
+
+
+class Command(BaseCommand):
+    """ Guarda un juego con sus jugadores en un fichero de snapshot (ver snapshots.py)
+    para restaurarlo en otra BD con restore_game."""
+    help = 'Guarda el snapshot comprimido de un juego.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--game', type=int, help='ID del juego. Por defecto, el ultimo creado.')
+        parser.add_argument('--output', help='Fichero de salida. Por defecto, game-<id>.snapshot.')
+
+    def handle(self, *args, **options):
+        if options['game']:
+            game = Game.objects.filter(id=options['game']).first()
+            if game is None:
+                raise CommandError(f"Game not found: {options['game']}")
+        else:
+            game = Game.objects.order_by('-startDate').first()
+            if game is None:
+                raise CommandError("There are no games")
+        path = options['output'] or f"game-{game.id}.snapshot"
+        start = time.perf_counter()
+        size = write_snapshot(game, path)
+        self.stdout.write(
+            f"Game {game.id} saved in {os.path.abspath(path)}: {size} bytes "
+            f"in {time.perf_counter() - start:.2f}s"
+        )
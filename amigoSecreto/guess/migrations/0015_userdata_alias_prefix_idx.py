@@ -0,0 +1,17 @@
+# Generated by Django 3.1.4 on 2026-10-19 18:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('guess', '0014_options'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='userdata',
+            index=models.Index(fields=['alias'], name='userdata_alias_prefix_idx', opclasses=['varchar_pattern_ops']),
+        ),
+    ]
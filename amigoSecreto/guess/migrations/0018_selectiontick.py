@@ -0,0 +1,28 @@
+# Generated by Django 3.1.4 on 2026-10-19 18:34
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('guess', '0017_schedulerlease'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SelectionTick',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('selection', models.PositiveSmallIntegerField()),
+                ('scheduled', models.DateTimeField()),
+                ('started', models.DateTimeField(db_index=True)),
+                ('lag_ms', models.IntegerField()),
+                ('duration_ms', models.PositiveIntegerField()),
+                ('rows', models.PositiveIntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('round', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='guess.round')),
+            ],
+        ),
+    ]
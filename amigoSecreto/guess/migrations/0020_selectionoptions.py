@@ -0,0 +1,71 @@
+# Generated by Django 3.1.4 on 2026-10-19 18:38
+
+from django.db import migrations, models
+import django.db.models.deletion
+import sys
+from array import array
+from django.utils.timezone import now
+
+SELECTION_FIELDS = [
+    'firstSelection', 'secondSelection', 'thirdSelection',
+    'fourthSelection', 'fifthSelection', 'sixthSelection',
+]
+
+
+def encode_ids(ids):
+    """ IDs como int64 little-endian, el formato de SelectionOptions al crear la tabla
+    (copiado aqui para que la migracion no dependa de guess/options.py)."""
+    packed = array('q', ids)
+    if sys.byteorder == 'big':
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def pack_options(apps, schema_editor):
+    """ Empaqueta las filas de Options de cada ronda en una fila de SelectionOptions.
+    Options solo tiene las de la seleccion en curso: la ultima que ya empezo."""
+    Options = apps.get_model('guess', 'Options')
+    Round = apps.get_model('guess', 'Round')
+    SelectionOptions = apps.get_model('guess', 'SelectionOptions')
+    current = now()
+    round_ids = Options.objects.values_list('round_id', flat=True).distinct()
+    for round in Round.objects.filter(id__in=list(round_ids)):
+        started = [getattr(round, field) <= current for field in SELECTION_FIELDS]
+        group, options = [], []
+        for row in Options.objects.filter(round=round).order_by('id').values_list(
+                'user_id', 'option1_id', 'option2_id', 'option3_id'):
+            group.append(row[0])
+            options.extend(row[1:])
+        SelectionOptions.objects.create(
+            round=round,
+            selection=max(sum(started) - 1, 0),
+            group=encode_ids(group),
+            options=encode_ids(options),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('guess', '0019_gameplan'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SelectionOptions',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('selection', models.PositiveSmallIntegerField()),
+                ('group', models.BinaryField()),
+                ('options', models.BinaryField()),
+                ('round', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='guess.round')),
+            ],
+            options={
+                'unique_together': {('round', 'selection')},
+            },
+        ),
+        migrations.RunPython(pack_options, migrations.RunPython.noop),
+        migrations.DeleteModel(
+            name='Options',
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 3.1.4 on 2026-10-19 18:43
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('guess', '0021_enrollment'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlayerState',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('alias', models.CharField(max_length=4)),
+                ('team', models.CharField(max_length=10)),
+                ('status', models.CharField(choices=[('next', 'Next to guess'), ('guessing', 'Guessing'), ('guessed', 'Guessed')], default='next', max_length=10)),
+                ('selection', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('option1', models.CharField(blank=True, max_length=4)),
+                ('option2', models.CharField(blank=True, max_length=4)),
+                ('option3', models.CharField(blank=True, max_length=4)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('game', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='guess.game')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='playerstate',
+            constraint=models.UniqueConstraint(fields=('user', 'game'), name='playerstate_user_game_unique'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 3.1.4 on 2026-10-19 19:01
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('guess', '0022_playerstate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationBatch',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('selection', models.PositiveSmallIntegerField()),
+                ('recipients', models.BinaryField()),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('sending', 'Sending'), ('done', 'Done')], default='pending', max_length=10)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('heartbeat', models.DateTimeField(blank=True, null=True)),
+                ('started', models.DateTimeField(blank=True, null=True)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+                ('queued', models.PositiveIntegerField(default=0)),
+                ('processed', models.PositiveIntegerField(default=0)),
+                ('sent', models.PositiveIntegerField(default=0)),
+                ('failed', models.PositiveIntegerField(default=0)),
+                ('skipped', models.PositiveIntegerField(default=0)),
+                ('duration_ms', models.PositiveIntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('round', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='guess.round')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='notificationbatch',
+            index=models.Index(fields=['status', 'created'], name='notificationbatch_status_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='notificationbatch',
+            unique_together={('round', 'selection')},
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 3.1.4 on 2026-10-19 19:11
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('guess', '0023_notificationbatch'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GameReveal',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveSmallIntegerField()),
+                ('data', models.BinaryField()),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('game', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='reveal', to='guess.game')),
+            ],
+        ),
+    ]
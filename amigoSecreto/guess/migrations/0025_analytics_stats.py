@@ -0,0 +1,47 @@
+# Generated by Django 3.1.4 on 2026-10-19 19:21
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('guess', '0024_gamereveal'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TeamStats',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('team', models.CharField(max_length=10)),
+                ('guesses', models.PositiveIntegerField(default=0)),
+                ('correct', models.PositiveIntegerField(default=0)),
+                ('false_positives', models.PositiveIntegerField(default=0)),
+                ('expected_false_positives', models.FloatField(default=0)),
+                ('game', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='guess.game')),
+            ],
+            options={
+                'unique_together': {('game', 'team')},
+            },
+        ),
+        migrations.CreateModel(
+            name='SelectionStats',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('selection', models.PositiveSmallIntegerField()),
+                ('opened', models.DateTimeField()),
+                ('group', models.PositiveIntegerField(default=0)),
+                ('guesses', models.PositiveIntegerField(default=0)),
+                ('correct', models.PositiveIntegerField(default=0)),
+                ('false_positives', models.PositiveIntegerField(default=0)),
+                ('expected_false_positives', models.FloatField(default=0)),
+                ('time_to_guess_ms', models.BigIntegerField(default=0)),
+                ('round', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='guess.round')),
+            ],
+            options={
+                'unique_together': {('round', 'selection')},
+            },
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 3.1.4 on 2026-10-19 23:10
+
+from django.db import migrations
+
+# Los mismos nombres que guess/gift_search.py, fijos aqui para la migracion.
+FTS_TABLE = 'guess_userdata_gift_fts'
+PG_INDEX = 'userdata_gift_search_idx'
+
+
+def create_index(apps, schema_editor):
+    """ Indice de texto de UserData.gift (ver guess/gift_search.py)."""
+    table = apps.get_model('guess', 'UserData')._meta.db_table
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute(
+            f"CREATE INDEX {PG_INDEX} ON {table} USING GIN (to_tsvector('simple', gift))")
+    elif vendor == 'sqlite':
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(gift, content='{table}',"
+            f" content_rowid='id', tokenize='unicode61 remove_diacritics 2')")
+        # Triggers de la documentacion de FTS5 para tablas con contenido externo. Si
+        # una migracion rehace la tabla en SQLite (AlterField) hay que volver a crearlos.
+        schema_editor.execute(
+            f"CREATE TRIGGER {FTS_TABLE}_ai AFTER INSERT ON {table} BEGIN"
+            f" INSERT INTO {FTS_TABLE}(rowid, gift) VALUES (new.id, new.gift); END")
+        schema_editor.execute(
+            f"CREATE TRIGGER {FTS_TABLE}_ad AFTER DELETE ON {table} BEGIN"
+            f" INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, gift) VALUES ('delete', old.id, old.gift); END")
+        schema_editor.execute(
+            f"CREATE TRIGGER {FTS_TABLE}_au AFTER UPDATE OF gift ON {table} BEGIN"
+            f" INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, gift) VALUES ('delete', old.id, old.gift);"
+            f" INSERT INTO {FTS_TABLE}(rowid, gift) VALUES (new.id, new.gift); END")
+        schema_editor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+
+
+def drop_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute(f"DROP INDEX IF EXISTS {PG_INDEX}")
+    elif vendor == 'sqlite':
+        for trigger in ('ai', 'ad', 'au'):
+            schema_editor.execute(f"DROP TRIGGER IF EXISTS {FTS_TABLE}_{trigger}")
+        schema_editor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('guess', '0025_analytics_stats'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -1,6 +1,7 @@
 from django.db import models
 from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator, MaxValueValidator
+from django.db.models import Q
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 from datetime import timedelta, date, datetime
@@ -20,6 +21,13 @@ class UserData(models.Model):
     guessed = models.BooleanField(default=False)    #For the final event
     alias = models.CharField(max_length=4, unique=True)
 
+    class Meta:
+        # Indice para las busquedas por prefijo del alias (LIKE 'ab%') en Postgres.
+        indexes = [
+            models.Index(fields=['alias'], name='userdata_alias_prefix_idx',
+                         opclasses=['varchar_pattern_ops']),
+        ]
+
     def __str__(self):
         return self.alias
 
@@ -63,12 +71,216 @@ class Round(models.Model):
     fifthSelection = models.DateTimeField()
     sixthSelection = models.DateTimeField()
 
-class Options(models.Model):
+class SelectionOptions(models.Model):
+    """ Opciones de adivinanza de una seleccion: una sola fila con los IDs del grupo
+    y las 3 opciones de cada uno empaquetados como enteros de 64 bits (ver options.py)."""
     round = models.ForeignKey(Round, on_delete=models.CASCADE)
+    selection = models.PositiveSmallIntegerField()
+    group = models.BinaryField()
+    options = models.BinaryField()
+
+    class Meta:
+        unique_together = [('round', 'selection')]
+
+    def __str__(self):
+        return f"Options of selection {self.selection} of round {self.round_id}"
+
+class Enrollment(models.Model):
+    """ Inscripcion de un usuario en un juego. Las inscripciones sin juego son las del
+    proximo juego, que se las asigna al crearse (ver GameForm.create_teams)."""
+    game = models.ForeignKey(Game, on_delete=models.CASCADE, null=True, blank=True)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
-    option1 = models.ForeignKey(User, on_delete=models.CASCADE, related_name='option1')
-    option2 = models.ForeignKey(User, on_delete=models.CASCADE, related_name='option2')
-    option3 = models.ForeignKey(User, on_delete=models.CASCADE, related_name='option3')
+    joined_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['game', 'user'], name='enrollment_game_user_unique'),
+            models.UniqueConstraint(fields=['user'], condition=Q(game__isnull=True),
+                                    name='enrollment_pending_user_unique'),
+        ]
+        # Para listar por paginas los inscritos de un juego (o los pendientes).
+        indexes = [
+            models.Index(fields=['game', 'joined_at'], name='enrollment_game_joined_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user} enrolled in {self.game or 'the next game'}"
+
+class PlayerState(models.Model):
+    """ Proyeccion desnormalizada del estado de un jugador en un juego: alias, equipo,
+    estado en la seleccion en curso y alias de sus opciones. La mantienen al dia la
+    creacion del juego, los jobs de las selecciones y GuessForm (ver player_state.py)
+    para que las paginas del jugador se generen con una sola consulta."""
+    NEXT_TO_GUESS, GUESSING, GUESSED = 'next', 'guessing', 'guessed'
+    STATUSES = [(NEXT_TO_GUESS, 'Next to guess'), (GUESSING, 'Guessing'), (GUESSED, 'Guessed')]
+
+    game = models.ForeignKey(Game, on_delete=models.CASCADE)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    alias = models.CharField(max_length=4)
+    team = models.CharField(max_length=10)
+    status = models.CharField(max_length=10, choices=STATUSES, default=NEXT_TO_GUESS)
+    # Seleccion en la que adivina, solo mientras esta en Guessing.
+    selection = models.PositiveSmallIntegerField(null=True, blank=True)
+    option1 = models.CharField(max_length=4, blank=True)
+    option2 = models.CharField(max_length=4, blank=True)
+    option3 = models.CharField(max_length=4, blank=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'game'], name='playerstate_user_game_unique'),
+        ]
+
+    @property
+    def options(self):
+        return [option for option in (self.option1, self.option2, self.option3) if option]
+
+    def __str__(self):
+        return f"{self.user} is {self.status} in {self.game}"
+
+class GameJob(models.Model):
+    """ Creacion de un juego en segundo plano (ver jobs.py)."""
+    QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+    STATUSES = [(QUEUED, 'Queued'), (RUNNING, 'Running'), (DONE, 'Done'), (FAILED, 'Failed')]
+    # Fases de GameForm.save, en orden.
+    PHASES = ['teams', 'pairing', 'rounds', 'scheduling']
+
+    game = models.ForeignKey(Game, on_delete=models.SET_NULL, null=True, blank=True)
+    status = models.CharField(max_length=10, choices=STATUSES, default=QUEUED)
+    phase = models.CharField(max_length=10, blank=True)
+    error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    def progress(self):
+        """ Fraccion de fases terminadas."""
+        if self.status == self.DONE:
+            return 1.0
+        if self.phase not in self.PHASES:
+            return 0.0
+        return self.PHASES.index(self.phase)/len(self.PHASES)
+
+    def __str__(self):
+        return f"Game job {self.id} ({self.status})"
+
+class GamePlan(models.Model):
+    """ Plan precalculado del juego: rondas, selecciones, grupos y opciones,
+    serializado y comprimido (ver plans.py)."""
+    game = models.OneToOneField(Game, on_delete=models.CASCADE, related_name='plan')
+    version = models.PositiveSmallIntegerField()
+    data = models.BinaryField()
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Plan of {self.game}"
+
+class GameReveal(models.Model):
+    """ Resultado final de un juego: puntos de los equipos y resultado de cada jugador,
+    calculados al terminar el juego, serializados y comprimidos (ver reveal.py)."""
+    game = models.OneToOneField(Game, on_delete=models.CASCADE, related_name='reveal')
+    version = models.PositiveSmallIntegerField()
+    data = models.BinaryField()
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Reveal of {self.game}"
+
+class SelectionStats(models.Model):
+    """ Contadores de las adivinanzas de una seleccion, mantenidos al abrirse la
+    seleccion y con cada adivinanza (ver analytics.py)."""
+    round = models.ForeignKey(Round, on_delete=models.CASCADE)
+    selection = models.PositiveSmallIntegerField()
+    # Inicio de la ventana de la seleccion y jugadores que adivinan en ella.
+    opened = models.DateTimeField()
+    group = models.PositiveIntegerField(default=0)
+    guesses = models.PositiveIntegerField(default=0)
+    correct = models.PositiveIntegerField(default=0)
+    false_positives = models.PositiveIntegerField(default=0)
+    # Suma de 5/N de cada adivinanza incorrecta: los falsos positivos esperados.
+    expected_false_positives = models.FloatField(default=0)
+    # Suma de lo que tardo cada adivinanza desde que se abrio la seleccion.
+    time_to_guess_ms = models.BigIntegerField(default=0)
+
+    class Meta:
+        unique_together = [('round', 'selection')]
+
+    def __str__(self):
+        return f"Stats of selection {self.selection} of round {self.round_id}"
+
+class TeamStats(models.Model):
+    """ Contadores de las adivinanzas de los jugadores de un equipo (ver analytics.py)."""
+    game = models.ForeignKey(Game, on_delete=models.CASCADE)
+    team = models.CharField(max_length=10)
+    guesses = models.PositiveIntegerField(default=0)
+    correct = models.PositiveIntegerField(default=0)
+    false_positives = models.PositiveIntegerField(default=0)
+    expected_false_positives = models.FloatField(default=0)
+
+    class Meta:
+        unique_together = [('game', 'team')]
+
+    def __str__(self):
+        return f"Stats of team {self.team} in {self.game}"
+
+class SchedulerLease(models.Model):
+    """ Lease que decide que nodo es el lider del scheduler (ver scheduler.py).
+    El lider renueva 'expires' periodicamente; si deja de hacerlo, otro nodo lo toma."""
+    name = models.CharField(max_length=50, unique=True)
+    holder = models.CharField(max_length=100)
+    expires = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.name} held by {self.holder} until {self.expires}"
+
+class SelectionTick(models.Model):
+    """ Telemetria de cada ejecucion del job de una seleccion (ver telemetry.py)."""
+    round = models.ForeignKey(Round, on_delete=models.CASCADE)
+    selection = models.PositiveSmallIntegerField()
+    scheduled = models.DateTimeField()
+    started = models.DateTimeField(db_index=True)
+    lag_ms = models.IntegerField()
+    duration_ms = models.PositiveIntegerField()
+    rows = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+
+    def __str__(self):
+        return f"Selection {self.selection} of round {self.round_id} at {self.started}"
+
+class NotificationBatch(models.Model):
+    """ Avisos de "te toca adivinar" de una seleccion y el informe de su envio. Los
+    destinatarios se guardan empaquetados como SelectionOptions.group y se envian por
+    lotes desde un worker (ver notifications.py)."""
+    PENDING, SENDING, DONE = 'pending', 'sending', 'done'
+    STATUSES = [(PENDING, 'Pending'), (SENDING, 'Sending'), (DONE, 'Done')]
+
+    round = models.ForeignKey(Round, on_delete=models.CASCADE)
+    selection = models.PositiveSmallIntegerField()
+    recipients = models.BinaryField()
+    status = models.CharField(max_length=10, choices=STATUSES, default=PENDING)
+    created = models.DateTimeField(auto_now_add=True)
+    # Lo renueva el worker en cada lote; si se queda viejo otro worker puede retomarlo.
+    heartbeat = models.DateTimeField(null=True, blank=True)
+    started = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+    queued = models.PositiveIntegerField(default=0)
+    # Destinatarios procesados, para retomar el envio donde se quedo.
+    processed = models.PositiveIntegerField(default=0)
+    sent = models.PositiveIntegerField(default=0)
+    failed = models.PositiveIntegerField(default=0)
+    skipped = models.PositiveIntegerField(default=0)
+    duration_ms = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+
+    class Meta:
+        unique_together = [('round', 'selection')]
+        indexes = [
+            models.Index(fields=['status', 'created'], name='notificationbatch_status_idx'),
+        ]
+
+    @property
+    def rate(self):
+        """ Mensajes enviados por segundo."""
+        return self.sent/(self.duration_ms/1000) if self.duration_ms else 0
 
     def __str__(self):
-        return f"{self.user} have options {self.option1}, {self.option2} and {self.option3}"
\ No newline at end of file
+        return f"Notifications of selection {self.selection} of round {self.round_id}"
@@ -0,0 +1,153 @@
+"""
+Avisos de "te toca adivinar" a los jugadores de cada seleccion.
+
+El job de la seleccion solo encola un NotificationBatch con los IDs del grupo (una
+fila por seleccion). El envio lo hace un worker aparte: el pool de tareas del proceso
+(jobs.submit) si NOTIFICATIONS_EMBEDDED, o manage.py send_notifications. El worker
+reclama el lote, lo envia en bloques de NOTIFICATION_BATCH_SIZE mensajes por una sola
+conexion de correo reutilizada y guarda el informe (enviados, fallidos, omitidos,
+duracion) en el propio lote.
+
+Se omiten los jugadores sin correo y los que ya no estan adivinando en esa seleccion
+(p. ej. si el lote se envia despues de la seleccion siguiente).
+"""
+
+import logging
+import time
+import traceback
+from datetime import timedelta
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db.models import F, Q
+from django.utils.timezone import now
+from .jobs import submit
+from .models import NotificationBatch, PlayerState
+from .options import decode_ids, encode_ids
+
+logger = logging.getLogger(__name__)
+
+# Un lote en 'sending' sin heartbeat durante este tiempo se da por abandonado.
+STALE_AFTER = timedelta(minutes=5)
+
+SUBJECT = "It's your turn to guess"
+BODY = (
+    "Hi {alias},\n\n"
+    "It's your turn to guess who is giving you your gift. Your options are "
+    "{option1}, {option2} and {option3}.\n"
+)
+
+
+def queue_turn_notifications(round_id, selection, group):
+    """ Encola los avisos de los jugadores de group. Si el job de la seleccion se
+    vuelve a ejecutar no se duplican. Devuelve el numero de filas escritas."""
+    _, created = NotificationBatch.objects.get_or_create(
+        round_id=round_id, selection=selection,
+        defaults={'recipients': encode_ids(group), 'queued': len(group)},
+    )
+    return int(created)
+
+
+def dispatch():
+    """ Lanza el envio de los lotes pendientes en el pool de tareas, fuera del job."""
+    if settings.NOTIFICATIONS_EMBEDDED:
+        submit(deliver_pending)
+
+
+def claimable():
+    """ Lotes pendientes o abandonados por otro worker."""
+    return NotificationBatch.objects.filter(
+        Q(status=NotificationBatch.PENDING) |
+        Q(status=NotificationBatch.SENDING, heartbeat__lt=now() - STALE_AFTER)
+    )
+
+
+def claim(batch_id):
+    """ Marca el lote como nuestro. Devuelve False si otro worker se adelanto."""
+    current = now()
+    if not claimable().filter(id=batch_id).update(
+            status=NotificationBatch.SENDING, heartbeat=current):
+        return False
+    NotificationBatch.objects.filter(id=batch_id, started__isnull=True).update(started=current)
+    return True
+
+
+def turn_messages(game_id, selection, user_ids):
+    """ Mensajes de los jugadores de user_ids que siguen adivinando en la seleccion
+    y tienen correo."""
+    states = PlayerState.objects.filter(
+        game_id=game_id, user_id__in=list(user_ids),
+        status=PlayerState.GUESSING, selection=selection,
+    ).exclude(user__email='').values_list('alias', 'option1', 'option2', 'option3', 'user__email')
+    return [
+        EmailMessage(
+            SUBJECT,
+            BODY.format(alias=alias, option1=option1, option2=option2, option3=option3),
+            to=[email],
+        )
+        for alias, option1, option2, option3, email in states
+    ]
+
+
+def send(connection, messages):
+    """ Envia messages por connection, abriendola si hace falta. Si falla cuenta el
+    bloque entero como fallido y cierra la conexion para abrir otra en el siguiente.
+    Devuelve (enviados, error)."""
+    if not messages:
+        return 0, ''
+    try:
+        connection.open()
+        return connection.send_messages(messages) or 0, ''
+    except Exception:
+        logger.exception("Could not send %s notifications", len(messages))
+        try:
+            connection.close()
+        except Exception:
+            pass
+        return 0, traceback.format_exc()
+
+
+def deliver(batch_id, batch_size=None):
+    """ Envia los avisos de un lote, retomandolo donde se quedara. Devuelve el lote con
+    su informe o None si lo tiene otro worker."""
+    if not claim(batch_id):
+        return None
+    batch = NotificationBatch.objects.select_related('round').get(id=batch_id)
+    size = batch_size or settings.NOTIFICATION_BATCH_SIZE
+    recipients = decode_ids(batch.recipients)
+    batches = NotificationBatch.objects.filter(id=batch_id)
+
+    start = time.perf_counter()
+    connection = get_connection()
+    try:
+        for offset in range(batch.processed, len(recipients), size):
+            chunk = recipients[offset:offset + size]
+            messages = turn_messages(batch.round.game_id, batch.selection, chunk)
+            sent, error = send(connection, messages)
+            batches.update(
+                processed=offset + len(chunk),
+                heartbeat=now(),
+                sent=F('sent') + sent,
+                failed=F('failed') + len(messages) - sent,
+                skipped=F('skipped') + len(chunk) - len(messages),
+                **({'error': error} if error else {}),
+            )
+    finally:
+        connection.close()
+    batches.update(
+        status=NotificationBatch.DONE, finished=now(),
+        duration_ms=F('duration_ms') + int((time.perf_counter() - start)*1000),
+    )
+
+    batch.refresh_from_db()
+    logger.info(
+        "Notifications of selection %s of round %s: %s sent, %s failed, %s skipped"
+        " in %s ms (%.0f/s)", batch.selection, batch.round_id, batch.sent, batch.failed,
+        batch.skipped, batch.duration_ms, batch.rate)
+    return batch
+
+
+def deliver_pending(batch_size=None):
+    """ Envia todos los lotes que se puedan reclamar, del mas antiguo al mas nuevo.
+    Devuelve los lotes enviados."""
+    ids = list(claimable().order_by('created').values_list('id', flat=True))
+    return [batch for batch in (deliver(batch_id, batch_size) for batch_id in ids) if batch]
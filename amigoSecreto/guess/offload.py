@@ -0,0 +1,29 @@
+"""
+Pool acotado de hilos para el acceso a la BD desde las vistas asincronas.
+
+Las vistas asincronas (servidas por asgi.py) no pueden usar el ORM en el event loop,
+asi que delegan cada bloque de trabajo sincrono con run_db. Es equivalente a
+sync_to_async(thread_sensitive=False) pero con un executor propio de
+settings.ASYNC_DB_WORKERS hilos (asgiref 3.3 no deja elegirlo): como cada hilo
+mantiene su propia conexion, el pool acota tambien las conexiones a la BD del
+proceso. El contexto se copia al hilo, de modo que el enrutado al primario de la
+peticion (amigoSecreto/routers.py) se mantiene.
+"""
+
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+
+executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, 'ASYNC_DB_WORKERS', 8),
+    thread_name_prefix='guess-db',
+)
+
+
+async def run_db(func, *args, **kwargs):
+    """ Ejecuta func(*args, **kwargs) en el pool sin bloquear el event loop."""
+    context = contextvars.copy_context()
+    call = functools.partial(context.run, func, *args, **kwargs)
+    return await asyncio.get_running_loop().run_in_executor(executor, call)
@@ -0,0 +1,50 @@
+"""
+Opciones de adivinanza de la seleccion en curso.
+
+Cada seleccion guarda una sola fila de SelectionOptions con dos arrays empaquetados:
+los IDs del grupo que adivina y, por cada uno, sus 3 opciones (options[3*i:3*i+3] son
+las de group[i]). Los IDs se guardan como enteros de 64 bits little-endian.
+
+Las paginas no leen esta tabla: las opciones de cada jugador estan en su PlayerState
+(ver player_state.py). Solo la lee player_state.rebuild (comando
+rebuild_player_states) para reconstruir los estados, con decode_selection.
+"""
+
+import sys
+from array import array
+from .models import SelectionOptions
+
+
+def encode_ids(ids):
+    packed = array('q', ids)
+    if sys.byteorder == 'big':
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def decode_ids(data):
+    packed = array('q')
+    packed.frombytes(bytes(data))
+    if sys.byteorder == 'big':
+        packed.byteswap()
+    return packed
+
+
+def save_selection_options(round_id, selection, group, options):
+    """ Guarda las opciones de una seleccion (reemplaza las que hubiera si el job se
+    vuelve a ejecutar). Devuelve el numero de filas escritas."""
+    deleted, _ = SelectionOptions.objects.filter(round_id=round_id, selection=selection).delete()
+    SelectionOptions.objects.create(
+        round_id=round_id,
+        selection=selection,
+        group=encode_ids(group),
+        options=encode_ids(options),
+    )
+    return deleted + 1
+
+
+def decode_selection(group, options):
+    """ Diccionario {user_id: (opcion1, opcion2, opcion3)} de los arrays de una fila de
+    SelectionOptions."""
+    group, options = decode_ids(group), decode_ids(options)
+    return {user_id: tuple(options[3*i:3*i+3]) for i, user_id in enumerate(group)}
@@ -0,0 +1,135 @@
+"""
+Plan precalculado de un juego.
+
+Al crear un juego se calcula todo su plan (rondas, ventanas de cada seleccion, grupo
+de jugadores que adivina en cada una y sus opciones) y se guarda en un unico
+GamePlan: un JSON compacto comprimido con zlib. Los lectores (vistas, scheduler y
+exportaciones) lo obtienen con get_plan, que hace una sola consulta y lo mantiene en
+memoria; el plan no cambia una vez creado. GamePlan se lee siempre del primario
+(settings.DB_PRIMARY_ONLY) para no tomar por ausente un plan que aun no ha llegado a
+una replica.
+
+Formato (version 1):
+    {"version": 1, "game": id, "days": 9,
+     "rounds": [{"id": round_id,
+                 "windows": [inicio de cada seleccion en ISO 8601, ...],
+                 "groups": [[user_id, ...] por seleccion],
+                 "options": [[o1, o2, o3, o1, o2, o3, ...] por seleccion]}, ...]}
+"""
+
+import json
+import zlib
+from array import array
+from functools import lru_cache
+from django.utils.dateparse import parse_datetime
+from .models import GamePlan
+
+PLAN_VERSION = 1
+
+
+class RoundPlan:
+    """ Plan de una ronda con los grupos y opciones como arrays de IDs."""
+
+    def __init__(self, data):
+        self.id = data['id']
+        self.windows = [parse_datetime(window) for window in data['windows']]
+        self.groups = [array('l', group) for group in data['groups']]
+        self.options = [array('l', options) for options in data['options']]
+
+    def players(self):
+        """ IDs de todos los jugadores de la ronda."""
+        return [user_id for group in self.groups for user_id in group]
+
+
+class Plan:
+    """ Plan decodificado de un juego."""
+
+    def __init__(self, data):
+        self.version = data['version']
+        self.game_id = data['game']
+        self.days = data['days']
+        self.rounds = [RoundPlan(round) for round in data['rounds']]
+        self._turns = None
+
+    def turns(self, user_id):
+        """ Lista de (ronda, seleccion, inicio de la ventana) en las que user_id adivina."""
+        if self._turns is None:
+            turns = {}
+            for r, round in enumerate(self.rounds):
+                for s, group in enumerate(round.groups):
+                    for player in group:
+                        turns.setdefault(player, []).append((r, s, round.windows[s]))
+            self._turns = turns
+        return self._turns.get(user_id, [])
+
+
+def encode_plan(game, rounds, windows, selections):
+    """ Serializa el plan de un juego.
+    INPUTS:
+        - game: Instancia de Game.
+        - rounds: Instancias de Round en orden.
+        - windows: Fechas de inicio de las selecciones de cada ronda.
+        - selections: Por cada ronda, lista de (grupo, opciones) de cada seleccion
+                      como arrays de IDs (ver GameForm.plan_selections).
+    """
+    data = {
+        'version': PLAN_VERSION,
+        'game': game.id,
+        'days': game.days,
+        'rounds': [
+            {
+                'id': round.id,
+                'windows': [window.isoformat() for window in round_windows],
+                'groups': [list(group) for group, _ in round_selections],
+                'options': [list(options) for _, options in round_selections],
+            }
+            for round, round_windows, round_selections in zip(rounds, windows, selections)
+        ],
+    }
+    return write_plan(data)
+
+
+def write_plan(data):
+    """ Serializa el diccionario de un plan (ver el formato arriba)."""
+    return zlib.compress(json.dumps(data, separators=(',', ':')).encode())
+
+
+def read_plan(data):
+    """ Datos del plan serializado como diccionario (ver el formato arriba)."""
+    return json.loads(zlib.decompress(bytes(data)))
+
+
+def decode_plan(data):
+    return Plan(read_plan(data))
+
+
+def save_plan(game, rounds, windows, selections):
+    """ Guarda el plan del juego y lo deja en la cache del proceso."""
+    data = encode_plan(game, rounds, windows, selections)
+    GamePlan.objects.update_or_create(
+        game=game, defaults={'version': PLAN_VERSION, 'data': data})
+    load_plan.cache_clear()
+    return decode_plan(data)
+
+
+@lru_cache(maxsize=8)
+def load_plan(game_id):
+    """ Plan del juego leido del primario. Lanza GamePlan.DoesNotExist si aun no tiene,
+    para que lru_cache no guarde la ausencia."""
+    data = GamePlan.objects.filter(game_id=game_id).values_list('data', flat=True).first()
+    if data is None:
+        raise GamePlan.DoesNotExist(game_id)
+    return decode_plan(data)
+
+
+def get_plan(game_id):
+    """ Plan del juego (una consulta la primera vez) o None si no tiene. Solo se
+    guardan en memoria los planes encontrados: un juego que se esta creando o una
+    lectura sin el plan se vuelven a consultar la siguiente vez."""
+    try:
+        return load_plan(game_id)
+    except GamePlan.DoesNotExist:
+        return None
+
+
+get_plan.cache_clear = load_plan.cache_clear
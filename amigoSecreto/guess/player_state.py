@@ -0,0 +1,135 @@
+"""
+Mantenimiento de la proyeccion PlayerState.
+
+Cada jugador tiene una fila por juego con todo lo que necesitan sus paginas. Se crea
+al crear el juego y la actualizan:
+    - start_selection: el job de cada seleccion (scheduler._set_options).
+    - mark_guessed: GuessForm.save al adivinar (mark_all_guessed, el worker de
+      writebehind.py por lotes).
+    - el receiver de UserData si cambia un alias.
+rebuild la recalcula desde las tablas normalizadas (comando rebuild_player_states)
+por si alguna vez se desincroniza.
+
+Con settings.GUESS_WRITE_BEHIND la adivinanza se guarda despues de responder. Mientras
+tanto get_state devuelve al usuario ya en Guessed (ver guess_queue.is_pending), para
+que vea su propia adivinanza y no pueda repetirla.
+"""
+
+from django.conf import settings
+from django.contrib.auth.models import Group
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from .game_logic import WOLFS, VILLAGERS
+from .guess_queue import is_pending
+from .models import *
+from .options import decode_selection
+
+BATCH_SIZE = 1000
+
+
+def get_state(user_id):
+    """ Estado del usuario en el ultimo juego en el que juega, o None."""
+    state = PlayerState.objects.filter(user_id=user_id).order_by('-game_id').first()
+    if (settings.GUESS_WRITE_BEHIND and state is not None and state.status == PlayerState.GUESSING
+            and is_pending(state)):
+        # Ya adivino en esta seleccion, pero aun no se ha guardado.
+        state.status, state.selection = PlayerState.GUESSED, None
+        state.option1 = state.option2 = state.option3 = ''
+    return state
+
+
+def create_states(game, wolfs, villagers):
+    """ Crea los PlayerState de los jugadores de un juego nuevo."""
+    aliases = dict(UserData.objects.filter(
+        user_id__in=[*wolfs, *villagers]).values_list('user_id', 'alias'))
+    PlayerState.objects.bulk_create([
+        PlayerState(game=game, user_id=user_id, alias=aliases.get(user_id, ''), team=team)
+        for team, players in ((WOLFS, wolfs), (VILLAGERS, villagers))
+        for user_id in players
+    ], batch_size=BATCH_SIZE)
+
+
+def start_selection(game_id, selection, group, options, first_selection):
+    """ Actualiza los estados al comenzar una seleccion (ver scheduler.set_options).
+    Devuelve el numero de filas que toco."""
+    states = PlayerState.objects.filter(game_id=game_id)
+    if first_selection:
+        rows = states.update(
+            status=PlayerState.NEXT_TO_GUESS, selection=None,
+            option1='', option2='', option3='')
+    else:
+        rows = states.filter(status=PlayerState.GUESSING).update(
+            status=PlayerState.GUESSED, selection=None, option1='', option2='', option3='')
+
+    aliases = dict(states.values_list('user_id', 'alias'))
+    by_user = {state.user_id: state for state in states.filter(user_id__in=list(group))}
+    changed = []
+    for i, user_id in enumerate(group):
+        state = by_user.get(user_id)
+        if state is None:
+            continue
+        state.status = PlayerState.GUESSING
+        state.selection = selection
+        state.option1, state.option2, state.option3 = (
+            aliases.get(option, '') for option in options[3*i:3*i+3])
+        changed.append(state)
+    PlayerState.objects.bulk_update(
+        changed, ['status', 'selection', 'option1', 'option2', 'option3'],
+        batch_size=BATCH_SIZE)
+    return rows + len(changed)
+
+
+def mark_guessed(game_id, user_id):
+    """ El jugador ya adivino en la seleccion en curso."""
+    PlayerState.objects.filter(game_id=game_id, user_id=user_id).update(
+        status=PlayerState.GUESSED, selection=None, option1='', option2='', option3='')
+
+
+def mark_all_guessed(game_id, selection, user_ids):
+    """ Los jugadores ya adivinaron en la seleccion. No toca a los que ya estan en
+    otra seleccion. Devuelve el numero de filas que toco."""
+    return PlayerState.objects.filter(
+        game_id=game_id, user_id__in=user_ids, status=PlayerState.GUESSING, selection=selection,
+    ).update(status=PlayerState.GUESSED, selection=None, option1='', option2='', option3='')
+
+
+@transaction.atomic
+def rebuild(game):
+    """ Recalcula los PlayerState de un juego desde UserData, UserTeam, los grupos y
+    las opciones de la ultima seleccion. Los grupos solo reflejan el juego activo.
+    Devuelve el numero de estados creados."""
+    PlayerState.objects.filter(game=game).delete()
+    teams = UserTeam.objects.filter(team__game=game).values_list('user_id', 'team__name')
+    wolfs = [user_id for user_id, team in teams if team == WOLFS]
+    villagers = [user_id for user_id, team in teams if team != WOLFS]
+    create_states(game, wolfs, villagers)
+
+    states = PlayerState.objects.filter(game=game)
+    for name, status in (('Guessed', PlayerState.GUESSED), ('Guessing', PlayerState.GUESSING)):
+        user_ids = Group.objects.get(name=name).user_set.values('id')
+        states.filter(user_id__in=user_ids).update(status=status)
+
+    current = SelectionOptions.objects.filter(round__game=game).order_by('-id').first()
+    if current is not None:
+        selection = decode_selection(current.group, current.options)
+        guessing = set(states.filter(status=PlayerState.GUESSING).values_list('user_id', flat=True))
+        aliases = dict(states.values_list('user_id', 'alias'))
+        by_user = {state.user_id: state for state in states.filter(user_id__in=guessing)}
+        for user_id, options in selection.items():
+            state = by_user.get(user_id)
+            if state is not None:
+                state.selection = current.selection
+                state.option1, state.option2, state.option3 = (
+                    aliases.get(option, '') for option in options)
+        PlayerState.objects.bulk_update(
+            by_user.values(), ['selection', 'option1', 'option2', 'option3'],
+            batch_size=BATCH_SIZE)
+    return states.count()
+
+
+@receiver(post_save, sender=UserData)
+def update_player_alias(sender, instance, **kwargs):
+    """ Propaga el cambio de alias a los estados del usuario."""
+    PlayerState.objects.filter(user_id=instance.user_id).exclude(
+        alias=instance.alias).update(alias=instance.alias)
@@ -0,0 +1,144 @@
+"""
+Profiling de peticiones bajo demanda para superusuarios.
+
+Un superusuario activa el profiler en una peticion con ?profile=1 o con la cabecera
+X-Profile. La peticion se ejecuta bajo cProfile registrando tambien el SQL, y el
+resultado se guarda en settings.PROFILES_DIR: un .prof (para pstats/snakeviz) y un
+.json con el resumen que muestran ProfileListView y ProfileDetailView.
+
+Si no se pide el profiler, el middleware solo comprueba el parametro y la cabecera.
+Bajo ASGI la peticion perfilada se ejecuta en un hilo del pool de offload.py; el SQL
+que las vistas asincronas delegan a otros hilos del pool no queda registrado.
+"""
+
+import asyncio
+import cProfile
+import json
+import os
+import pstats
+import time
+from contextlib import ExitStack
+from django.conf import settings
+from asgiref.sync import async_to_sync
+from django.db import connections
+from django.utils.decorators import sync_and_async_middleware
+from django.utils.text import slugify
+from django.utils.timezone import now
+from .offload import run_db
+
+TOP_FUNCTIONS = 30
+
+
+def profiling_requested(request):
+    return request.GET.get('profile') == '1' or 'HTTP_X_PROFILE' in request.META
+
+
+class QueryRecorder:
+    """ execute_wrapper que guarda el SQL ejecutado y lo que tarda cada consulta."""
+
+    def __init__(self, alias):
+        self.alias = alias
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append({
+                'db': self.alias,
+                'sql': sql,
+                'ms': (time.perf_counter() - start)*1000,
+            })
+
+
+def top_functions(profiler, limit=TOP_FUNCTIONS):
+    """ Funciones con mas tiempo acumulado."""
+    stats = pstats.Stats(profiler)
+    rows = []
+    for (filename, line, name), (cc, nc, tottime, cumtime, _) in stats.stats.items():
+        rows.append({
+            'function': f"{os.path.basename(filename)}:{line}({name})",
+            'calls': nc,
+            'tottime_ms': tottime*1000,
+            'cumtime_ms': cumtime*1000,
+        })
+    rows.sort(key=lambda row: row['cumtime_ms'], reverse=True)
+    return rows[:limit]
+
+
+def profile(request, get_response):
+    """ Ejecuta get_response(request) bajo el profiler y guarda el resultado."""
+    recorders = [QueryRecorder(connection.alias) for connection in connections.all()]
+    profiler = cProfile.Profile()
+    start = time.perf_counter()
+    with ExitStack() as stack:
+        for connection, recorder in zip(connections.all(), recorders):
+            stack.enter_context(connection.execute_wrapper(recorder))
+        profiler.enable()
+        try:
+            response = get_response(request)
+        finally:
+            profiler.disable()
+    elapsed = time.perf_counter() - start
+    save_profile(request, response, profiler, elapsed, recorders)
+    return response
+
+
+def save_profile(request, response, profiler, elapsed, recorders):
+    os.makedirs(settings.PROFILES_DIR, exist_ok=True)
+    name = f"{now():%Y%m%d-%H%M%S-%f}-{request.method.lower()}-{slugify(request.path) or 'root'}"
+    base = os.path.join(settings.PROFILES_DIR, name)
+    profiler.dump_stats(base + '.prof')
+    queries = [query for recorder in recorders for query in recorder.queries]
+    with open(base + '.json', 'w') as summary:
+        json.dump({
+            'name': name,
+            'method': request.method,
+            'path': request.get_full_path(),
+            'status': response.status_code,
+            'ms': elapsed*1000,
+            'sql_ms': sum(query['ms'] for query in queries),
+            'functions': top_functions(profiler),
+            'queries': queries,
+        }, summary)
+
+
+@sync_and_async_middleware
+def profiler_middleware(get_response):
+    """ Middleware que perfila la peticion si un superusuario lo pide. Debe ir
+    despues de AuthenticationMiddleware."""
+    if asyncio.iscoroutinefunction(get_response):
+        async def middleware(request):
+            if not profiling_requested(request) or not await run_db(lambda: request.user.is_superuser):
+                return await get_response(request)
+            return await run_db(profile, request, async_to_sync(get_response))
+    else:
+        def middleware(request):
+            if not profiling_requested(request) or not request.user.is_superuser:
+                return get_response(request)
+            return profile(request, get_response)
+    return middleware
+
+
+def list_profiles():
+    """ Resumenes de los perfiles guardados, del mas reciente al mas antiguo."""
+    if not os.path.isdir(settings.PROFILES_DIR):
+        return []
+    profiles = []
+    for filename in sorted(os.listdir(settings.PROFILES_DIR), reverse=True):
+        if filename.endswith('.json'):
+            profile = load_profile(filename[:-len('.json')])
+            profile['query_count'] = len(profile.pop('queries'))
+            profile.pop('functions')
+            profiles.append(profile)
+    return profiles
+
+
+def load_profile(name):
+    """ Resumen de un perfil por su nombre o None si no existe."""
+    path = os.path.join(settings.PROFILES_DIR, os.path.basename(name) + '.json')
+    if not os.path.isfile(path):
+        return None
+    with open(path) as summary:
+        return json.load(summary)
@@ -0,0 +1,124 @@
+"""
+Limite de peticiones con token buckets guardados en la cache de Django.
+
+Cada ambito (settings.RATE_LIMITS, p. ej. 'guess' o 'signup') tiene un bucket por IP
+y otro por usuario con 'capacidad' tokens que se rellenan a razon de capacidad/segundos.
+Cada POST (o cada peticion con los metodos indicados a rate_limit) gasta un token de
+cada bucket; si alguno esta vacio se responde 429 sin tocar la BD ni ejecutar la
+vista.
+
+Con la cache por defecto (memoria local) los limites son por proceso. La lectura y
+escritura del bucket no es atomica, asi que con peticiones simultaneas del mismo
+cliente puede dejar pasar alguna de mas; es un limite de carga, no de seguridad.
+"""
+
+import asyncio
+import time
+from functools import wraps
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY
+from django.core.cache import cache
+from django.http import HttpResponse
+from .offload import run_db
+
+ALLOWED, LIMITED = 'allowed', 'limited'
+
+
+def parse_rate(rate):
+    """ 'capacidad/segundos' -> (capacidad, segundos) o None si esta vacio."""
+    if not rate:
+        return None
+    capacity, period = rate.split('/')
+    return int(capacity), float(period)
+
+
+class TokenBucket:
+    """ Token bucket de un ambito guardado en la cache como (tokens, instante)."""
+
+    def __init__(self, scope, capacity, period):
+        self.scope = scope
+        self.capacity = capacity
+        self.refill = capacity/period
+        self.timeout = int(period) + 1
+
+    def take(self, keys):
+        """ Gasta un token de los buckets de keys si todos tienen alguno. Devuelve los
+        segundos que faltan para poder hacerlo (0 si se gastaron)."""
+        cache_keys = [f"ratelimit:{self.scope}:{key}" for key in keys]
+        current = time.time()
+        stored = cache.get_many(cache_keys)
+        tokens = {}
+        for cache_key in cache_keys:
+            available, last = stored.get(cache_key, (self.capacity, current))
+            tokens[cache_key] = min(self.capacity, available + (current - last)*self.refill)
+        missing = 1 - min(tokens.values())
+        if missing > 0:
+            return missing/self.refill
+        cache.set_many({key: (value - 1, current) for key, value in tokens.items()}, self.timeout)
+        return 0
+
+
+def count(scope, result):
+    """ Suma uno al contador de peticiones del ambito con ese resultado."""
+    key = f"ratelimit:count:{scope}:{result}"
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # La clave expiro o se desalojo entre add e incr.
+        cache.set(key, 1, None)
+
+
+def counters():
+    """ {(ambito, resultado): peticiones} de los ambitos configurados."""
+    keys = {
+        f"ratelimit:count:{scope}:{result}": (scope, result)
+        for scope in settings.RATE_LIMITS for result in (ALLOWED, LIMITED)
+    }
+    values = cache.get_many(keys)
+    return {keys[key]: values.get(key, 0) for key in keys}
+
+
+def client_keys(request):
+    """ Claves de los buckets del cliente: su IP y, si tiene sesion, su usuario. El
+    usuario se lee de la sesion para no consultar la tabla de usuarios."""
+    keys = [f"ip:{request.META.get('REMOTE_ADDR', '')}"]
+    user_id = request.session.get(SESSION_KEY) if hasattr(request, 'session') else None
+    if user_id:
+        keys.append(f"user:{user_id}")
+    return keys
+
+
+def check(scope, request, methods=('POST',)):
+    """ Gasta un token de los buckets del cliente si la peticion usa uno de methods.
+    Devuelve la respuesta 429 si no quedan o None si la peticion puede seguir."""
+    rate = parse_rate(settings.RATE_LIMITS.get(scope))
+    if rate is None or request.method not in methods:
+        return None
+    wait = TokenBucket(scope, *rate).take(client_keys(request))
+    if wait:
+        count(scope, LIMITED)
+        response = HttpResponse('Too many requests', status=429, content_type='text/plain')
+        response['Retry-After'] = str(int(wait) + 1)
+        return response
+    count(scope, ALLOWED)
+    return None
+
+
+def rate_limit(scope, methods=('POST',)):
+    """ Decorador de vistas (sincronas o asincronas) que limita sus peticiones con
+    methods (por defecto los POST) con los buckets del ambito."""
+    def decorator(view):
+        if asyncio.iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                # La sesion puede estar en la BD, asi que se lee en el pool.
+                limited = await run_db(check, scope, request, methods)
+                return limited or await view(request, *args, **kwargs)
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            return check(scope, request, methods) or view(request, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,227 @@
+"""
+Revelacion final de un juego.
+
+Cuando pasa el endDate de un juego su job (scheduler.run_reveal) ejecuta reveal_game:
+    1. Calcula el resultado de todos los jugadores con unas pocas consultas agregadas
+       sobre Guess y GivesTo, no una por jugador.
+    2. Actualiza UserData.guessed de los jugadores con un solo UPDATE: True si alguien
+       descubrio a quien regala (su pareja de GivesTo aparece en algun Guess).
+    3. Guarda los aciertos de cada equipo en Teams.score.
+    4. Guarda el resultado en un GameReveal (JSON compacto comprimido con zlib).
+    5. Renderiza la clasificacion y la pagina de cada jugador y las deja en la cache,
+       para que las visitas del final no recalculen nada.
+Las claves de las paginas llevan el GameReveal.created, asi que al volver a revelar un
+juego las anteriores dejan de servirse. El ultimo juego revelado se lee de la base de
+datos en cada visita (una consulta por indice) y no de la cache, que en una cache local
+de otro proceso podria quedarse con el anterior.
+Si una pagina no esta en la cache (otro proceso con cache local o se desalojo) se
+renderiza desde el GameReveal, que get_reveal mantiene en memoria mientras no se
+vuelva a revelar el juego. GameReveal se lee siempre del primario
+(settings.DB_PRIMARY_ONLY): la pagina se pide justo despues de guardarlo.
+
+Formato (version 1):
+    {"version": 1, "game": id,
+     "teams": [[nombre, puntos], ...] de mas a menos puntos,
+     "players": {user_id: [alias, equipo, alias al que regala, alias de quien le
+                           regala, descubierto, adivinanzas, aciertos]}}
+"""
+
+import json
+import zlib
+from functools import lru_cache
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Exists, OuterRef, Q
+from django.template.loader import render_to_string
+from django.utils.timezone import now
+from .models import *
+
+REVEAL_VERSION = 1
+TEMPLATE = 'templates/reveal.html'
+# Jugadores con mas aciertos que aparecen en la clasificacion.
+TOP_PLAYERS = 10
+# Paginas por cache.set_many al renderizarlas.
+RENDER_BATCH = 500
+PAGE_TIMEOUT = 7*24*60*60
+
+
+class Reveal:
+    """ Resultado decodificado de un juego."""
+    FIELDS = ('alias', 'team', 'gives_to', 'gifter', 'discovered', 'guesses', 'points')
+
+    def __init__(self, data):
+        self.version = data['version']
+        self.game_id = data['game']
+        self.teams = data['teams']
+        self.players = {int(user_id): row for user_id, row in data['players'].items()}
+        self.top = [
+            dict(zip(self.FIELDS, row))
+            for row in sorted(self.players.values(), key=lambda row: (-row[6], row[0]))[:TOP_PLAYERS]
+        ]
+
+    def player(self, user_id):
+        """ Resultado del jugador como diccionario o None si no jugo."""
+        row = self.players.get(user_id)
+        return dict(zip(self.FIELDS, row)) if row is not None else None
+
+
+def correct_guesses(game):
+    """ Adivinanzas del juego con la misma pareja que la GivesTo de fuera."""
+    return Guess.objects.filter(game=game, gifter=OuterRef('gifter'), gifted=OuterRef('gifted'))
+
+
+def compute(game):
+    """ Datos del GameReveal del juego (ver el formato arriba)."""
+    states = list(PlayerState.objects.filter(game=game).values_list('user_id', 'alias', 'team'))
+    aliases = {user_id: alias for user_id, alias, _ in states}
+    gives_to = dict(GivesTo.objects.filter(game=game).values_list('gifter_id', 'gifted_id'))
+    gifters = {gifted: gifter for gifter, gifted in gives_to.items()}
+    discovered = set(GivesTo.objects.filter(game=game).filter(
+        Exists(correct_guesses(game))).values_list('gifter_id', flat=True))
+    stats = {
+        owner: (guesses, points)
+        for owner, guesses, points in Guess.objects.filter(game=game).values('owner').annotate(
+            guesses=Count('id'), points=Count('id', filter=Q(answer=True)),
+        ).values_list('owner', 'guesses', 'points')
+    }
+
+    teams = dict.fromkeys(Teams.objects.filter(game=game).values_list('name', flat=True), 0)
+    players = {}
+    for user_id, alias, team in states:
+        guesses, points = stats.get(user_id, (0, 0))
+        teams[team] = teams.get(team, 0) + points
+        players[user_id] = [
+            alias, team,
+            aliases.get(gives_to.get(user_id), ''), aliases.get(gifters.get(user_id), ''),
+            user_id in discovered, guesses, points,
+        ]
+    return {
+        'version': REVEAL_VERSION,
+        'game': game.id,
+        'teams': sorted(([name, points] for name, points in teams.items()), key=lambda team: -team[1]),
+        'players': players,
+    }
+
+
+def write_reveal(data):
+    """ Serializa el diccionario de un GameReveal (ver el formato arriba)."""
+    return zlib.compress(json.dumps(data, separators=(',', ':')).encode())
+
+
+def read_reveal(data):
+    """ Datos del GameReveal serializado como diccionario (ver el formato arriba)."""
+    return json.loads(zlib.decompress(bytes(data)))
+
+
+@transaction.atomic
+def save_results(game, data):
+    """ Guarda UserData.guessed, Teams.score y el GameReveal del juego. Devuelve su
+    created."""
+    discovered = GivesTo.objects.filter(game=game, gifter=OuterRef('user_id')).filter(
+        Exists(correct_guesses(game)))
+    UserData.objects.filter(
+        user_id__in=PlayerState.objects.filter(game=game).values('user_id')
+    ).update(guessed=Exists(discovered))
+    for name, points in data['teams']:
+        Teams.objects.filter(game=game, name=name).update(score=points)
+    # created cambia al volver a revelar: invalida el Reveal en memoria de cada proceso.
+    created = now()
+    GameReveal.objects.update_or_create(game=game, defaults={
+        'version': REVEAL_VERSION,
+        'data': write_reveal(data),
+        'created': created,
+    })
+    return created
+
+
+def reveal_game(game):
+    """ Calcula y guarda el resultado del juego y deja sus paginas en la cache.
+    Devuelve el Reveal."""
+    data = compute(game)
+    created = save_results(game, data)
+    load_reveal.cache_clear()
+    reveal = Reveal(data)
+    prerender(reveal, created)
+    return reveal
+
+
+@lru_cache(maxsize=4)
+def load_reveal(game_id, created):
+    """ Reveal del juego guardado en created. Lanza GameReveal.DoesNotExist si ya no
+    esta, para que lru_cache no guarde la ausencia."""
+    data = GameReveal.objects.filter(game_id=game_id, created=created).values_list(
+        'data', flat=True).first()
+    if data is None:
+        raise GameReveal.DoesNotExist(game_id)
+    return Reveal(read_reveal(data))
+
+
+def get_reveal(game_id, created=None):
+    """ Reveal del juego o None si no tiene. Se guarda en memoria por la fecha del
+    GameReveal (created, que se consulta si no se pasa), asi que si se vuelve a revelar
+    el juego cada proceso decodifica el nuevo."""
+    if created is None:
+        created = GameReveal.objects.filter(game_id=game_id).values_list('created', flat=True).first()
+    if created is None:
+        return None
+    try:
+        return load_reveal(game_id, created)
+    except GameReveal.DoesNotExist:
+        # Se volvio a revelar entre las dos consultas.
+        return None
+
+
+get_reveal.cache_clear = load_reveal.cache_clear
+
+
+def latest_reveal():
+    """ (ID del juego, created) del ultimo GameReveal o None."""
+    return GameReveal.objects.order_by('-game__endDate').values_list('game_id', 'created').first()
+
+
+def latest_game_id():
+    """ ID del ultimo juego revelado o None."""
+    latest = latest_reveal()
+    return latest[0] if latest is not None else None
+
+
+def page_key(game_id, created, user_id):
+    return f"guess:reveal:{game_id}:{created.timestamp()}:{user_id or 'standings'}"
+
+
+def render_page(reveal, user_id=None):
+    return render_to_string(TEMPLATE, {'reveal': reveal, 'player': reveal.player(user_id)})
+
+
+def prerender(reveal, created):
+    """ Deja en la cache la clasificacion y la pagina de cada jugador."""
+    pages = {page_key(reveal.game_id, created, None): render_page(reveal)}
+    for user_id in reveal.players:
+        pages[page_key(reveal.game_id, created, user_id)] = render_page(reveal, user_id)
+        if len(pages) >= RENDER_BATCH:
+            cache.set_many(pages, PAGE_TIMEOUT)
+            pages = {}
+    cache.set_many(pages, PAGE_TIMEOUT)
+
+
+def reveal_page(user_id):
+    """ HTML de la revelacion del ultimo juego para user_id (la clasificacion si no
+    jugo) o None si aun no se ha revelado ningun juego."""
+    latest = latest_reveal()
+    if latest is None:
+        return None
+    game_id, created = latest
+    html = cache.get(page_key(game_id, created, user_id))
+    if html is not None:
+        return html
+    reveal = get_reveal(game_id, created)
+    if reveal is None:
+        return None
+    if user_id not in reveal.players:
+        # No jugo: le toca la clasificacion, que puede estar en la cache.
+        user_id = None
+        html = cache.get(page_key(game_id, created, None))
+    if html is None:
+        html = render_page(reveal, user_id)
+        cache.set(page_key(game_id, created, user_id), html, PAGE_TIMEOUT)
+    return html
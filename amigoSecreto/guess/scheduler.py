@@ -0,0 +1,251 @@
+"""
+Scheduler de las selecciones y jobs que ejecuta.
+
+Los jobs solo guardan arrays compactos de IDs (array('l')) en vez de instancias de
+UserTeam y User, ya que viven durante todo el juego (hasta 12 dias). Al ejecutarse,
+las filas necesarias se obtienen en bloque.
+
+Los jobs se guardan en la BD (DjangoJobStore), asi que cualquier nodo puede
+programarlos. Cada proceso tiene un scheduler que arranca en pausa y solo el nodo que
+tiene el lease de SchedulerLease (el lider) lo reanuda y ejecuta los jobs. Si el
+lider deja de renovar el lease, otro nodo lo toma en como mucho SCHEDULER_LEASE_TTL
+segundos.
+"""
+
+import logging
+import os
+import socket
+import threading
+from array import array
+from datetime import timedelta
+from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.triggers.date import DateTrigger
+from django.conf import settings
+from django.contrib.auth.models import Group
+from django.db import DatabaseError, IntegrityError, close_old_connections, transaction
+from django.db.models import Q
+from django.utils.timezone import now
+from django_apscheduler.jobstores import DjangoJobStore
+from .models import *
+from .telemetry import record_tick
+from .plans import get_plan
+from .options import save_selection_options
+from .player_state import start_selection
+from .notifications import dispatch, queue_turn_notifications
+from .analytics import open_selection
+from .reveal import reveal_game
+from amigoSecreto.routers import use_primary
+
+logger = logging.getLogger(__name__)
+
+LEASE_NAME = 'selections'
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def pack_options(options):
+    """ Convierte una lista de ternas de IDs en un array plano de 3 IDs por jugador."""
+    packed = array('l')
+    for option in options:
+        packed.extend(option)
+    return packed
+
+
+def run_selection(game_id, round_index, selection, scheduled=None):
+    """ Job de una seleccion: obtiene su grupo y sus opciones del GamePlan del juego
+    (cacheado en memoria) y ejecuta set_options."""
+    round = get_plan(game_id).rounds[round_index]
+    set_options(
+        round.id, round.groups[selection], round.options[selection],
+        selection == 0, selection, scheduled,
+        players=round.players() if selection == 0 else None,
+    )
+
+
+def set_options(round_id, group, options, first_selection, selection=None, scheduled=None,
+                players=None):
+    """
+    Actualiza la BD al comenzar una seleccion, guarda su telemetria y encola los
+    avisos a los jugadores que adivinan en ella (ver notifications.py).
+    INPUTS:
+        - round_id: ID de la ronda actual.
+        - group: array con los IDs de los usuarios que van a intentar adivinar en
+                 esta seleccion.
+        - options: array plano con las 3 opciones de cada usuario de group, de modo
+                   que options[3*i:3*i+3] son las opciones de group[i].
+        - first_selection: Indica si es la primera seleccion de la ronda.
+        - selection: Numero de la seleccion dentro de la ronda (0 a 5).
+        - scheduled: Fecha a la que estaba programado el job.
+        - players: IDs de todos los jugadores del juego, si ya se conocen. Solo se
+                   usan en la primera seleccion.
+    """
+    # El job lee lo que escribe, asi que trabajamos solo con el primario.
+    with use_primary(), record_tick(round_id, selection, scheduled) as tick:
+        tick.rows = _set_options(
+            round_id, group, options, first_selection, selection, players, scheduled)
+    # Los avisos a los jugadores se envian fuera del job.
+    dispatch()
+
+
+def _set_options(round_id, group, options, first_selection, selection=None, players=None,
+                 scheduled=None):
+    """ Hace el trabajo de set_options y devuelve el numero de filas que toco."""
+    # Obtenemos los 3 grupos
+    guessing = Group.objects.get(name='Guessing')
+    guessed = Group.objects.get(name='Guessed')
+    next_to_guess = Group.objects.get(name='NextToGuess')
+
+    round = Round.objects.select_related('game').get(id=round_id)
+
+    if first_selection:
+        # Si es la primera seleccion, sacamos a todos los usuarios de Guessed y Guessing
+        # y agregamos a todos los usuarios del juego actual a NextToGuess
+        guessing.user_set.clear()
+        guessed.user_set.clear()
+        if players is None:
+            players = list(UserTeam.objects.filter(
+                team__game=round.game).values_list('user_id', flat=True))
+        next_to_guess.user_set.add(*players)
+        rows = len(players)
+    else:
+        # En caso contrario, movemos los usuarios de Guessing a Guessed
+        moved = list(guessing.user_set.values_list('id', flat=True))
+        guessing.user_set.clear()
+        guessed.user_set.add(*moved)
+        rows = 2*len(moved)
+
+    # Movemos los usuarios de group de NextToGuess a Guessing y guardamos sus
+    # opciones en una sola fila, que reemplaza a las de la seleccion anterior.
+    next_to_guess.user_set.remove(*group)
+    guessing.user_set.add(*group)
+    rows += save_selection_options(round_id, selection or 0, group, options)
+    rows += start_selection(round.game_id, selection or 0, group, options, first_selection)
+    rows += queue_turn_notifications(round_id, selection or 0, group)
+    rows += open_selection(
+        round.game, round_id, selection or 0, scheduled or now(), group, first_selection)
+    return rows + 2*len(group)
+
+
+def get_scheduler():
+    """ Devuelve el scheduler del proceso, arrancado en pausa."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            scheduler = BackgroundScheduler(job_defaults={
+                # Si el lider cae justo antes de una seleccion, el nuevo lider la
+                # ejecuta tarde en vez de saltarsela.
+                'misfire_grace_time': None,
+                'coalesce': True,
+            })
+            scheduler.add_jobstore(DjangoJobStore(), 'default')
+            scheduler.start(paused=True)
+            _scheduler = scheduler
+    return _scheduler
+
+
+def schedule_selection(job_id, run_date, game_id, round_index, selection):
+    """ Guarda en la BD el job de una seleccion del plan del juego (ver run_selection)."""
+    trigger = DateTrigger(run_date)
+    get_scheduler().add_job(
+        run_selection,
+        trigger,
+        args=(game_id, round_index, selection, trigger.run_date),
+        id=job_id,
+        replace_existing=True,
+    )
+
+
+def run_reveal(game_id):
+    """ Job del final del juego: calcula y guarda sus resultados (ver reveal.py)."""
+    with use_primary():
+        reveal_game(Game.objects.get(id=game_id))
+
+
+def schedule_reveal(game):
+    """ Guarda en la BD el job de la revelacion final, al pasar el endDate del juego."""
+    get_scheduler().add_job(
+        run_reveal,
+        DateTrigger(game.endDate),
+        args=(game.id,),
+        id=f"reveal-{game.id}",
+        replace_existing=True,
+    )
+
+
+class LeaderElection:
+    """ Eleccion de lider mediante una fila de SchedulerLease.
+
+    try_acquire toma el lease si esta libre, caducado o ya es nuestro, y lo renueva
+    por 'ttl' segundos. run lo intenta cada ttl/3 segundos reanudando o pausando el
+    scheduler del proceso segun se gane o se pierda el liderazgo.
+    """
+
+    def __init__(self, node=None, ttl=None, name=LEASE_NAME):
+        self.node = node or f"{socket.gethostname()}:{os.getpid()}"
+        self.ttl = ttl or settings.SCHEDULER_LEASE_TTL
+        self.name = name
+        self.is_leader = False
+
+    def try_acquire(self):
+        """ Intenta tomar o renovar el lease. Devuelve si somos el lider."""
+        current = now()
+        expires = current + timedelta(seconds=self.ttl)
+        renewed = SchedulerLease.objects.filter(name=self.name).filter(
+            Q(holder=self.node) | Q(expires__lt=current)
+        ).update(holder=self.node, expires=expires)
+        if renewed:
+            return True
+        try:
+            with transaction.atomic():
+                SchedulerLease.objects.create(name=self.name, holder=self.node, expires=expires)
+            return True
+        except IntegrityError:
+            return False
+
+    def release(self):
+        """ Libera el lease para que otro nodo lo tome sin esperar a que caduque."""
+        SchedulerLease.objects.filter(name=self.name, holder=self.node).update(expires=now())
+
+    def run(self, stop):
+        """ Bucle de eleccion hasta que se active el threading.Event stop."""
+        scheduler = get_scheduler()
+        interval = self.ttl/3
+        while not stop.is_set():
+            close_old_connections()
+            try:
+                leader = self.try_acquire()
+            except DatabaseError:
+                logger.exception("Could not renew the scheduler lease")
+                leader = False
+            if leader and not self.is_leader:
+                logger.info("%s is now the scheduler leader", self.node)
+                scheduler.resume()
+            elif not leader and self.is_leader:
+                logger.info("%s lost the scheduler leadership", self.node)
+                scheduler.pause()
+            self.is_leader = leader
+            if leader:
+                # Recoge los jobs que hayan programado otros nodos.
+                scheduler.wakeup()
+            stop.wait(interval)
+        if self.is_leader:
+            scheduler.pause()
+            self.release()
+            self.is_leader = False
+
+
+_election = None
+
+
+def start_scheduler():
+    """ Arranca la eleccion de lider en un hilo del proceso (una vez por proceso)."""
+    global _election
+    if _election is not None:
+        return _election
+    _election = LeaderElection()
+    threading.Thread(
+        target=_election.run, args=(threading.Event(),),
+        name='scheduler-election', daemon=True,
+    ).start()
+    return _election
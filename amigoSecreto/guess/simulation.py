@@ -0,0 +1,130 @@
+"""
+Simulador Monte Carlo del balance del juego.
+
+Juega partidas completas en memoria usando las mismas reglas que los forms
+(game_logic.py): reparto de equipos, pote, grupos por seleccion, opciones y falso
+positivo. Los jugadores son enteros, asi que no se toca la BD.
+
+Modelo de comportamiento de cada jugador cuando le toca adivinar:
+    - Participa con probabilidad 1 - exp(-horas/tau): cuanto mas dura la seleccion,
+      mas probable es que entre a adivinar.
+    - Escoge un gifter al azar entre sus 3 opciones.
+    - Con probabilidad 'knowledge' sabe a quien le regala ese gifter; si no, escoge
+      al azar a alguien de su propio equipo (los gifted del gifter rival).
+Cada respuesta True suma un punto al equipo del que adivina.
+"""
+
+import math
+import random
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from .game_logic import *
+
+
+def simulate_game(N, days, knowledge=0.3, tau=8.0, rng=random):
+    """ Juega una partida de N jugadores y devuelve (puntos lobos, puntos aldeanos)."""
+    players = range(N)
+    wolfs, villagers = split_teams(players, rng)
+    is_wolf = set(wolfs)
+    gives_to = dict(pair_gifts(wolfs, villagers, rng))
+
+    score = {WOLFS: 0, VILLAGERS: 0}
+    for round_days in round_lengths(days):
+        participation = 1 - math.exp(-selection_hours(round_days)/tau)
+        for group in split_groups(players, rng):
+            for player in group:
+                if rng.random() >= participation:
+                    continue
+                if player in is_wolf:
+                    team, rivals, mates = WOLFS, villagers, wolfs
+                else:
+                    team, rivals, mates = VILLAGERS, wolfs, villagers
+                options = pick_options(rivals, rng)
+                if not options:
+                    continue
+                gifter = rng.choice(options)
+                if rng.random() < knowledge:
+                    gifted = gives_to.get(gifter)
+                else:
+                    gifted = rng.choice(mates)
+                correct = gifted is not None and gives_to.get(gifter) == gifted
+                if adjudicate(correct, N, rng):
+                    score[team] += 1
+    return score[WOLFS], score[VILLAGERS]
+
+
+def simulate_batch(N, days, games, seed, knowledge=0.3, tau=8.0):
+    """ Juega 'games' partidas con una semilla propia y devuelve estadisticas
+    agregadas, para que cada proceso del pool devuelva poco que serializar."""
+    rng = random.Random(seed)
+    wolf_scores, villager_scores = Counter(), Counter()
+    wins = Counter()
+    for _ in range(games):
+        wolf_score, villager_score = simulate_game(N, days, knowledge, tau, rng)
+        wolf_scores[wolf_score] += 1
+        villager_scores[villager_score] += 1
+        if wolf_score > villager_score: wins[WOLFS] += 1
+        elif villager_score > wolf_score: wins[VILLAGERS] += 1
+        else: wins['Tie'] += 1
+    return {
+        'games': games,
+        'wins': wins,
+        WOLFS: wolf_scores,
+        VILLAGERS: villager_scores,
+    }
+
+
+def merge_batches(batches):
+    """ Junta los resultados de varios simulate_batch."""
+    total = {'games': 0, 'wins': Counter(), WOLFS: Counter(), VILLAGERS: Counter()}
+    for batch in batches:
+        total['games'] += batch['games']
+        for key in ('wins', WOLFS, VILLAGERS):
+            total[key].update(batch[key])
+    return total
+
+
+def distribution(histogram):
+    """ Media, desviacion tipica y percentiles 5/50/95 de un histograma de puntos."""
+    n = sum(histogram.values())
+    mean = sum(score*count for score, count in histogram.items())/n
+    var = sum(count*(score - mean)**2 for score, count in histogram.items())/n
+    percentiles, acc = {}, 0
+    targets = [(5, 0.05*n), (50, 0.5*n), (95, 0.95*n)]
+    for score in sorted(histogram):
+        acc += histogram[score]
+        while targets and acc >= targets[0][1]:
+            percentiles['p%d' % targets.pop(0)[0]] = score
+    return {'mean': mean, 'std': math.sqrt(var), **percentiles}
+
+
+def run(N, days_list, games, workers=None, batch_size=2000, knowledge=0.3, tau=8.0, seed=None):
+    """ Simula 'games' partidas por cada valor de days repartidas en un pool de
+    procesos. Devuelve un informe por days con distribucion de puntos, tasas de
+    victoria y partidas por segundo."""
+    seed = random.randrange(2**32) if seed is None else seed
+    report = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for days in days_list:
+            sizes = [batch_size]*(games//batch_size)
+            if games % batch_size:
+                sizes.append(games % batch_size)
+            start = time.perf_counter()
+            futures = [
+                pool.submit(simulate_batch, N, days, size, hash((seed, days, i)), knowledge, tau)
+                for i, size in enumerate(sizes)
+            ]
+            total = merge_batches(future.result() for future in futures)
+            elapsed = time.perf_counter() - start
+            report[days] = {
+                'games': total['games'],
+                'seconds': elapsed,
+                'games_per_second': total['games']/elapsed if elapsed else float('inf'),
+                'win_rate': {
+                    key: total['wins'][key]/total['games'] for key in (WOLFS, VILLAGERS, 'Tie')
+                },
+                WOLFS: distribution(total[WOLFS]),
+                VILLAGERS: distribution(total[VILLAGERS]),
+            }
+    return report
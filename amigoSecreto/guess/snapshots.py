@@ -0,0 +1,287 @@
+"""
+Snapshots de un juego para copiarlo a otra BD (por ejemplo, reproducir en local con
+SQLite un problema de produccion sin copiar toda la BD de Postgres).
+
+write_snapshot guarda todas las filas de un juego y de sus jugadores en un solo
+fichero: un JSON compacto por columnas (una lista de valores por columna de cada
+tabla) comprimido con zlib. Las fechas se guardan como microsegundos desde 1970 y
+los arrays de IDs empaquetados (SelectionOptions) como listas de IDs; el GamePlan y
+el GameReveal, ya decodificados.
+
+restore_snapshot crea el juego como uno nuevo insertando las filas por lotes con
+executemany. Los IDs de usuarios, equipos y rondas se asignan a partir del mayor de
+cada tabla y se remapean en todas las filas que los referencian, incluidos el plan,
+el resultado y las opciones. Los usuarios que ya existen (mismo username) se
+reutilizan, asi que un juego se puede clonar en la misma BD; los nuevos se crean sin
+contrasenya usable. No se restauran los jobs del scheduler ni los avisos: el juego
+restaurado no avanza solo.
+
+Formato (version 1):
+    {"version": 1, "created": ..., "game": {"startDate": ..., "days": ..., "endDate": ...},
+     "tables": {tabla: {columna: [valor, ...]}}, "plan": plan o null,
+     "reveal": resultado o null}
+"""
+
+import json
+import zlib
+from datetime import datetime, timedelta, timezone
+from django.contrib.auth.hashers import UNUSABLE_PASSWORD_PREFIX
+from django.contrib.auth.models import User
+from django.core.management.color import no_style
+from django.db import DEFAULT_DB_ALIAS, connection, connections, models, transaction
+from django.db.models import Max
+from django.utils.timezone import now
+from .models import *
+from .options import decode_ids, encode_ids
+from .plans import read_plan, write_plan
+from .reveal import read_reveal, write_reveal
+
+SNAPSHOT_VERSION = 1
+BATCH_SIZE = 2000
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+ROUND_SELECTIONS = ['firstSelection', 'secondSelection', 'thirdSelection',
+                    'fourthSelection', 'fifthSelection', 'sixthSelection']
+
+# (tabla, modelo, filtro por juego, columnas, {columna: tabla cuyos IDs guarda}).
+# Los usuarios, equipos y rondas guardan su ID porque otras tablas los referencian.
+TABLES = [
+    ('teams', Teams, 'game', ['id', 'name', 'score'], {}),
+    ('rounds', Round, 'game', ['id', *ROUND_SELECTIONS], {}),
+    ('user_teams', UserTeam, 'team__game', ['team_id', 'user_id'],
+     {'team_id': 'teams', 'user_id': 'users'}),
+    ('gives_to', GivesTo, 'game', ['gifter_id', 'gifted_id'],
+     {'gifter_id': 'users', 'gifted_id': 'users'}),
+    ('selection_options', SelectionOptions, 'round__game', ['round_id', 'selection', 'group', 'options'],
+     {'round_id': 'rounds', 'group': 'users', 'options': 'users'}),
+    ('guesses', Guess, 'game', ['owner_id', 'gifter_id', 'gifted_id', 'date', 'answer'],
+     {'owner_id': 'users', 'gifter_id': 'users', 'gifted_id': 'users'}),
+    ('player_states', PlayerState, 'game',
+     ['user_id', 'alias', 'team', 'status', 'selection', 'option1', 'option2', 'option3', 'updated'],
+     {'user_id': 'users'}),
+    ('enrollments', Enrollment, 'game', ['user_id', 'joined_at'], {'user_id': 'users'}),
+    ('selection_stats', SelectionStats, 'round__game',
+     ['round_id', 'selection', 'opened', 'group', 'guesses', 'correct', 'false_positives',
+      'expected_false_positives', 'time_to_guess_ms'],
+     {'round_id': 'rounds'}),
+    ('team_stats', TeamStats, 'game',
+     ['team', 'guesses', 'correct', 'false_positives', 'expected_false_positives'], {}),
+]
+USER_COLUMNS = ['id', 'username', 'first_name', 'last_name', 'email', 'is_active', 'date_joined']
+USER_DATA_COLUMNS = ['user_id', 'alias', 'gift', 'guessed']
+
+
+def encode_value(field, value):
+    """ Valor de la columna tal como se guarda en el snapshot."""
+    if value is None:
+        return None
+    if isinstance(field, models.DateTimeField):
+        return (value - EPOCH)//timedelta(microseconds=1)
+    if isinstance(field, models.BinaryField):
+        return list(decode_ids(value))
+    return value
+
+
+def decode_value(field, value):
+    if value is None:
+        return None
+    if isinstance(field, models.DateTimeField):
+        return EPOCH + timedelta(microseconds=value)
+    if isinstance(field, models.BinaryField):
+        return encode_ids(value)
+    return value
+
+
+def read_columns(queryset, columns):
+    """ {columna: [valor, ...]} de las filas del queryset."""
+    fields = [queryset.model._meta.get_field(column) for column in columns]
+    rows = queryset.order_by('pk').values_list(*columns)
+    values = [[] for _ in columns]
+    for row in rows.iterator(chunk_size=BATCH_SIZE):
+        for i, value in enumerate(row):
+            values[i].append(encode_value(fields[i], value))
+    return dict(zip(columns, values))
+
+
+def dump_snapshot(game):
+    """ Snapshot del juego como diccionario (ver el formato arriba)."""
+    tables = {
+        name: read_columns(model.objects.filter(**{lookup: game}), columns)
+        for name, model, lookup, columns, _ in TABLES
+    }
+    user_ids = set(tables['player_states']['user_id'])
+    for name, _, _, _, remap in TABLES:
+        for column, target in remap.items():
+            if target == 'users':
+                for value in tables[name][column]:
+                    user_ids.update(value if isinstance(value, list) else (value,))
+    user_ids = sorted(user_ids)
+    tables['users'] = read_columns(User.objects.filter(id__in=user_ids), USER_COLUMNS)
+    tables['user_data'] = read_columns(UserData.objects.filter(user_id__in=user_ids), USER_DATA_COLUMNS)
+
+    plan = GamePlan.objects.filter(game=game).values_list('data', flat=True).first()
+    reveal = GameReveal.objects.filter(game=game).values_list('data', flat=True).first()
+    return {
+        'version': SNAPSHOT_VERSION,
+        'created': now().isoformat(),
+        'game': {
+            'startDate': encode_value(Game._meta.get_field('startDate'), game.startDate),
+            'days': game.days,
+            'endDate': encode_value(Game._meta.get_field('endDate'), game.endDate),
+        },
+        'tables': tables,
+        'plan': read_plan(plan) if plan is not None else None,
+        'reveal': read_reveal(reveal) if reveal is not None else None,
+    }
+
+
+def write_snapshot(game, path):
+    """ Guarda el snapshot del juego en path. Devuelve el numero de bytes."""
+    data = zlib.compress(json.dumps(dump_snapshot(game), separators=(',', ':')).encode())
+    with open(path, 'wb') as snapshot:
+        snapshot.write(data)
+    return len(data)
+
+
+def read_snapshot(path):
+    with open(path, 'rb') as snapshot:
+        try:
+            data = json.loads(zlib.decompress(snapshot.read()))
+        except zlib.error:
+            raise ValueError(f"{path} is not a game snapshot")
+    if data.get('version') != SNAPSHOT_VERSION:
+        raise ValueError(f"Unsupported snapshot version: {data.get('version')}")
+    return data
+
+
+def allocate_ids(model, count):
+    """ IDs nuevos para count filas de model, a continuacion del mayor que existe."""
+    start = (model.objects.aggregate(last=Max('id'))['last'] or 0) + 1
+    return range(start, start + count)
+
+
+def insert_rows(model, values, constants=None):
+    """ Inserta las filas de {columna: [valor del snapshot, ...]} con executemany, sin
+    crear instancias del modelo (y sin que auto_now pise las fechas guardadas).
+    constants son columnas con el mismo valor en todas las filas. Devuelve el numero
+    de filas."""
+    constants = constants or {}
+    columns = [*values, *constants]
+    if not values or not len(next(iter(values.values()))):
+        return 0
+    db = connections[DEFAULT_DB_ALIAS]
+    prepared = []
+    for column, column_values in values.items():
+        field = model._meta.get_field(column)
+        if isinstance(field, models.DateTimeField):
+            # Ya son fechas con zona: basta con adaptarlas a la BD.
+            adapt = db.ops.adapt_datetimefield_value
+            prepared.append([adapt(decode_value(field, value)) for value in column_values])
+        elif isinstance(field, models.BinaryField):
+            prepared.append([
+                field.get_db_prep_save(decode_value(field, value), db) for value in column_values
+            ])
+        else:
+            # Enteros, textos y booleanos se pasan tal cual al driver.
+            prepared.append(column_values)
+    for column, value in constants.items():
+        prepared.append([model._meta.get_field(column).get_db_prep_save(value, db)]*len(prepared[0]))
+    quote = db.ops.quote_name
+    sql = "INSERT INTO {} ({}) VALUES ({})".format(
+        quote(model._meta.db_table),
+        ', '.join(quote(model._meta.get_field(column).column) for column in columns),
+        ', '.join(['%s']*len(columns)),
+    )
+    rows = list(zip(*prepared))
+    with db.cursor() as cursor:
+        for offset in range(0, len(rows), BATCH_SIZE):
+            cursor.executemany(sql, rows[offset:offset + BATCH_SIZE])
+    return len(rows)
+
+
+def restore_users(tables):
+    """ Crea los usuarios del snapshot que no existen. Devuelve ({ID antiguo: ID nuevo},
+    filas creadas)."""
+    users = tables['users']
+    usernames = users['username']
+    existing = {}
+    for offset in range(0, len(usernames), BATCH_SIZE):
+        existing.update(User.objects.filter(
+            username__in=usernames[offset:offset + BATCH_SIZE]).values_list('username', 'id'))
+    new = [i for i, username in enumerate(usernames) if username not in existing]
+    new_ids = allocate_ids(User, len(new))
+    user_map = {users['id'][i]: existing[username] for i, username in enumerate(usernames)
+                if username in existing}
+    user_map.update((users['id'][i], new_id) for i, new_id in zip(new, new_ids))
+
+    # Los que ya existian conservan su UserData.
+    data = tables['user_data']
+    created = {users['id'][i] for i in new}
+    rows = [i for i, user_id in enumerate(data['user_id']) if user_id in created]
+    aliases = [data['alias'][i] for i in rows]
+    taken = set()
+    for offset in range(0, len(aliases), BATCH_SIZE):
+        taken.update(UserData.objects.filter(
+            alias__in=aliases[offset:offset + BATCH_SIZE]).values_list('alias', flat=True))
+    if taken:
+        raise ValueError(f"Aliases already used by other users: {sorted(taken)[:20]}")
+
+    count = insert_rows(User, {
+        **{column: [users[column][i] for i in new] for column in USER_COLUMNS if column != 'id'},
+        'id': list(new_ids),
+    }, {'password': UNUSABLE_PASSWORD_PREFIX, 'is_staff': False, 'is_superuser': False})
+    count += insert_rows(UserData, {
+        'user_id': [user_map[data['user_id'][i]] for i in rows],
+        **{column: [data[column][i] for i in rows] for column in USER_DATA_COLUMNS if column != 'user_id'},
+    })
+    return user_map, count
+
+
+def restore_plan(plan, game, maps):
+    plan['game'] = game.id
+    for round in plan['rounds']:
+        round['id'] = maps['rounds'][round['id']]
+        round['groups'] = [[maps['users'][user_id] for user_id in group] for group in round['groups']]
+        round['options'] = [[maps['users'][user_id] for user_id in options] for options in round['options']]
+    GamePlan.objects.create(game=game, version=plan['version'], data=write_plan(plan))
+
+
+def restore_reveal(reveal, game, maps):
+    reveal['game'] = game.id
+    reveal['players'] = {maps['users'][int(user_id)]: row for user_id, row in reveal['players'].items()}
+    GameReveal.objects.create(game=game, version=reveal['version'], data=write_reveal(reveal))
+
+
+@transaction.atomic
+def restore_snapshot(data):
+    """ Crea un juego nuevo con las filas del snapshot. Devuelve (juego, filas creadas)."""
+    tables = data['tables']
+    game = Game.objects.create(**{
+        name: decode_value(Game._meta.get_field(name), value) for name, value in data['game'].items()
+    })
+    maps = {}
+    maps['users'], rows = restore_users(tables)
+
+    for name, model, lookup, columns, remap in TABLES:
+        values = dict(tables[name])
+        if 'id' in columns:
+            # Otras tablas los referencian: se asignan los IDs nuevos aqui.
+            ids = allocate_ids(model, len(values['id']))
+            maps[name] = dict(zip(values['id'], ids))
+            values['id'] = list(ids)
+        for column, target in remap.items():
+            mapping = maps[target]
+            values[column] = [
+                [mapping[item] for item in value] if isinstance(value, list) else mapping[value]
+                for value in values[column]
+            ]
+        rows += insert_rows(model, values, {'game_id': game.id} if lookup == 'game' else None)
+
+    if data['plan'] is not None:
+        restore_plan(data['plan'], game, maps)
+    if data['reveal'] is not None:
+        restore_reveal(data['reveal'], game, maps)
+    # Con IDs explicitos Postgres no avanza las secuencias.
+    with connection.cursor() as cursor:
+        for sql in connection.ops.sequence_reset_sql(no_style(), [User, Teams, Round]):
+            cursor.execute(sql)
+    return game, rows + 1
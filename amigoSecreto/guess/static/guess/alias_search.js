@@ -0,0 +1,23 @@
+// Autocompletado del alias del gifted a partir de lo que se va escribiendo.
+(function () {
+  var input = document.querySelector('input[list="gifted-aliases"]');
+  var datalist = document.getElementById('gifted-aliases');
+  if (!input) return;
+  var timer = null;
+  input.addEventListener('input', function () {
+    clearTimeout(timer);
+    timer = setTimeout(function () {
+      if (!input.value) return;
+      fetch(input.dataset.searchUrl + '?q=' + encodeURIComponent(input.value))
+        .then(function (response) { return response.json(); })
+        .then(function (data) {
+          datalist.innerHTML = '';
+          data.results.forEach(function (alias) {
+            var option = document.createElement('option');
+            option.value = alias;
+            datalist.appendChild(option);
+          });
+        });
+    }, 150);
+  });
+})();
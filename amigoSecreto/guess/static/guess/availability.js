@@ -0,0 +1,23 @@
+// Comprueba mientras se escribe si el nombre de usuario y el alias estan libres.
+(function () {
+  document.querySelectorAll('input[data-availability-url]').forEach(function (input) {
+    var message = document.getElementById(input.name + '-availability');
+    var timer = null;
+    input.addEventListener('input', function () {
+      clearTimeout(timer);
+      timer = setTimeout(function () {
+        message.textContent = '';
+        if (!input.value) return;
+        var url = input.dataset.availabilityUrl + '?' + input.name + '=' + encodeURIComponent(input.value);
+        fetch(url)
+          // Con 429 (demasiadas comprobaciones) no se muestra nada: el servidor valida al enviar.
+          .then(function (response) { return response.ok ? response.json() : {}; })
+          .then(function (data) {
+            var result = data[input.name];
+            if (!result) return;
+            message.textContent = result.error || (result.available ? 'Available' : 'Already taken');
+          });
+      }, 250);
+    });
+  });
+})();
@@ -0,0 +1,114 @@
+"""
+Entrega de los ficheros estaticos en produccion.
+
+collectstatic copia los estaticos a STATIC_ROOT con el hash del contenido en el nombre
+(guess/forms.3c2a....css) y CompressedManifestStaticFilesStorage guarda ademas una
+copia comprimida con gzip (.gz) de los de texto. static_files_middleware los sirve desde
+la propia aplicacion antes que el resto del middleware (sin sesion ni BD): la copia
+.gz si el navegador acepta gzip y, como el nombre cambia con el contenido, con
+Cache-Control de un anyo.
+"""
+
+import asyncio
+import gzip
+import mimetypes
+import os
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage, staticfiles_storage
+from django.core.exceptions import MiddlewareNotUsed, SuspiciousFileOperation
+from django.core.files.base import ContentFile
+from django.http import FileResponse, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.decorators import sync_and_async_middleware
+from django.utils.http import http_date
+from django.views.static import was_modified_since
+
+COMPRESS_EXTENSIONS = ('.css', '.js', '.svg', '.html', '.txt', '.json', '.xml', '.map')
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """ ManifestStaticFilesStorage que tambien guarda la version .gz de los ficheros
+    de texto con hash, si comprimida ocupa menos."""
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        for name in sorted(set(self.hashed_files.values())):
+            if name.endswith(COMPRESS_EXTENSIONS) and self.compress(name):
+                yield name, f"{name}.gz", True
+
+    def compress(self, name):
+        """ Guarda name.gz. Devuelve False si no merecia la pena comprimirlo."""
+        with self.open(name) as original:
+            content = original.read()
+        compressed = gzip.compress(content, compresslevel=9, mtime=0)
+        if len(compressed) >= len(content)*0.95:
+            return False
+        if self.exists(f"{name}.gz"):
+            self.delete(f"{name}.gz")
+        self._save(f"{name}.gz", ContentFile(compressed))
+        return True
+
+
+class StaticFiles:
+    """ Ficheros de STATIC_ROOT que sirve static_files_middleware."""
+
+    def __init__(self):
+        self.prefix = settings.STATIC_URL
+        self.hashed = set(getattr(staticfiles_storage, 'hashed_files', {}).values())
+
+    def serve(self, request):
+        """ Respuesta con el fichero estatico de la peticion o None si no lo es."""
+        if request.method not in ('GET', 'HEAD') or not request.path_info.startswith(self.prefix):
+            return None
+        name = request.path_info[len(self.prefix):]
+        try:
+            path = safe_join(settings.STATIC_ROOT, name)
+        except SuspiciousFileOperation:
+            return None
+        if not os.path.isfile(path):
+            return None
+
+        content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        compressed = os.path.isfile(f"{path}.gz")
+        encoding = None
+        if compressed and 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', ''):
+            path, encoding = f"{path}.gz", 'gzip'
+
+        stat = os.stat(path)
+        etag = f'"{int(stat.st_mtime):x}-{stat.st_size:x}"'
+        if etag in request.META.get('HTTP_IF_NONE_MATCH', '') or not was_modified_since(
+                request.META.get('HTTP_IF_MODIFIED_SINCE'), stat.st_mtime, stat.st_size):
+            response = HttpResponseNotModified()
+        else:
+            response = FileResponse(open(path, 'rb'), content_type=content_type)
+            if encoding:
+                response['Content-Encoding'] = encoding
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(stat.st_mtime)
+        if compressed:
+            response['Vary'] = 'Accept-Encoding'
+        if name in self.hashed:
+            response['Cache-Control'] = f"public, max-age={settings.STATIC_MAX_AGE}, immutable"
+        else:
+            # Sin hash en el nombre el contenido puede cambiar: se revalida siempre.
+            response['Cache-Control'] = 'public, no-cache'
+        return response
+
+
+@sync_and_async_middleware
+def static_files_middleware(get_response):
+    """ Sirve los ficheros de STATIC_ROOT si settings.STATIC_SERVE. Tiene que ir
+    justo despues de SecurityMiddleware para no pasar por el resto del middleware
+    (tampoco por GZipMiddleware, ya que la version comprimida ya existe)."""
+    if not settings.STATIC_SERVE:
+        raise MiddlewareNotUsed
+    files = StaticFiles()
+    if asyncio.iscoroutinefunction(get_response):
+        async def middleware(request):
+            return files.serve(request) or await get_response(request)
+    else:
+        def middleware(request):
+            return files.serve(request) or get_response(request)
+    return middleware
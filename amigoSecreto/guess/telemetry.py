@@ -0,0 +1,150 @@
+"""
+Telemetria de los jobs de las selecciones.
+
+Cada ejecucion de scheduler.set_options guarda un SelectionTick con la hora a la que
+estaba programada, la hora a la que empezo (y el retraso entre ambas), lo que tardo,
+las filas que toco y la excepcion si fallo. A partir de esa tabla se generan los
+histogramas del dashboard y del endpoint de metricas (formato de Prometheus).
+"""
+
+import logging
+import time
+import traceback
+from contextlib import contextmanager
+from django.db.models import Count, Q, Sum
+from django.utils.timezone import now
+from .models import NotificationBatch, SelectionTick
+from .ratelimit import counters
+
+logger = logging.getLogger(__name__)
+
+# Limites superiores de los buckets de los histogramas, en segundos.
+LAG_BUCKETS = [0.5, 1, 5, 15, 30, 60, 300, 900, 3600]
+DURATION_BUCKETS = [0.05, 0.1, 0.5, 1, 5, 15, 60]
+
+
+class TickResult:
+    """ Lo que el job informa de su ejecucion."""
+    rows = 0
+
+
+@contextmanager
+def record_tick(round_id, selection, scheduled):
+    """ Mide el bloque y guarda su SelectionTick, tanto si termina bien como si falla."""
+    started = now()
+    start = time.perf_counter()
+    result = TickResult()
+    error = ''
+    try:
+        yield result
+    except Exception:
+        error = traceback.format_exc()
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        scheduled = scheduled or started
+        try:
+            SelectionTick.objects.create(
+                round_id=round_id,
+                selection=selection or 0,
+                scheduled=scheduled,
+                started=started,
+                lag_ms=int((started - scheduled).total_seconds()*1000),
+                duration_ms=int(duration*1000),
+                rows=result.rows,
+                error=error,
+            )
+        except Exception:
+            # La telemetria nunca debe romper el job.
+            logger.exception("Could not record the selection tick")
+
+
+def histogram(queryset, field, buckets):
+    """ Cuenta acumulada de filas con field (en ms) menor o igual a cada bucket (en s).
+    Devuelve [(bucket, cuenta)] terminando en ('+Inf', total), en una sola consulta."""
+    aggregates = {
+        f"le_{i}": Count('id', filter=Q(**{f"{field}__lte": bucket*1000}))
+        for i, bucket in enumerate(buckets)
+    }
+    counts = queryset.aggregate(total=Count('id'), sum=Sum(field), **aggregates)
+    rows = [(bucket, counts[f"le_{i}"]) for i, bucket in enumerate(buckets)]
+    rows.append(('+Inf', counts['total']))
+    return rows, (counts['sum'] or 0)/1000
+
+
+def prometheus_histogram(name, help, rows, total):
+    lines = [f"# HELP {name} {help}", f"# TYPE {name} histogram"]
+    for bucket, count in rows:
+        lines.append(f'{name}_bucket{{le="{bucket}"}} {count}')
+    lines.append(f"{name}_sum {total}")
+    lines.append(f"{name}_count {rows[-1][1]}")
+    return lines
+
+
+def tick_metrics():
+    """ Lineas de metricas de los SelectionTick en formato de Prometheus."""
+    ticks = SelectionTick.objects.all()
+    lag, lag_sum = histogram(ticks, 'lag_ms', LAG_BUCKETS)
+    duration, duration_sum = histogram(ticks, 'duration_ms', DURATION_BUCKETS)
+    totals = ticks.aggregate(rows=Sum('rows'), errors=Count('id', filter=~Q(error='')))
+    last = ticks.order_by('-started').values_list('started', flat=True).first()
+    lines = prometheus_histogram(
+        'guess_selection_tick_lag_seconds',
+        'Delay between the scheduled and the actual start of a selection tick.',
+        lag, lag_sum)
+    lines += prometheus_histogram(
+        'guess_selection_tick_duration_seconds',
+        'Duration of a selection tick.',
+        duration, duration_sum)
+    lines += [
+        '# HELP guess_selection_tick_rows_total Rows touched by selection ticks.',
+        '# TYPE guess_selection_tick_rows_total counter',
+        f"guess_selection_tick_rows_total {totals['rows'] or 0}",
+        '# HELP guess_selection_tick_errors_total Selection ticks that raised.',
+        '# TYPE guess_selection_tick_errors_total counter',
+        f"guess_selection_tick_errors_total {totals['errors']}",
+        '# HELP guess_selection_tick_last_started_timestamp_seconds Start of the last selection tick.',
+        '# TYPE guess_selection_tick_last_started_timestamp_seconds gauge',
+        f"guess_selection_tick_last_started_timestamp_seconds {last.timestamp() if last else 0}",
+    ]
+    return lines
+
+
+def rate_limit_metrics():
+    """ Lineas de metricas de las peticiones que dejo pasar o rechazo ratelimit."""
+    lines = [
+        '# HELP guess_ratelimit_requests_total POST requests checked by the rate limiter.',
+        '# TYPE guess_ratelimit_requests_total counter',
+    ]
+    for (scope, result), value in counters().items():
+        lines.append(f'guess_ratelimit_requests_total{{scope="{scope}",result="{result}"}} {value}')
+    return lines
+
+
+def notification_metrics():
+    """ Lineas de metricas de los avisos de las selecciones."""
+    totals = NotificationBatch.objects.aggregate(
+        sent=Sum('sent'), failed=Sum('failed'), skipped=Sum('skipped'),
+        duration=Sum('duration_ms'),
+        pending=Count('id', filter=~Q(status=NotificationBatch.DONE)),
+    )
+    lines = [
+        '# HELP guess_notifications_total Turn notifications processed by result.',
+        '# TYPE guess_notifications_total counter',
+    ]
+    for result in ('sent', 'failed', 'skipped'):
+        lines.append(f'guess_notifications_total{{result="{result}"}} {totals[result] or 0}')
+    lines += [
+        '# HELP guess_notification_delivery_seconds_total Time spent delivering notifications.',
+        '# TYPE guess_notification_delivery_seconds_total counter',
+        f"guess_notification_delivery_seconds_total {(totals['duration'] or 0)/1000}",
+        '# HELP guess_notification_batches_pending Notification batches not yet delivered.',
+        '# TYPE guess_notification_batches_pending gauge',
+        f"guess_notification_batches_pending {totals['pending']}",
+    ]
+    return lines
+
+
+def render_metrics():
+    """ Texto completo del endpoint de metricas."""
+    return '\n'.join(tick_metrics() + rate_limit_metrics() + notification_metrics()) + '\n'
@@ -1,3 +1,1317 @@
-from django.test import TestCase
+import copy
+import gzip
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+from collections import Counter
+from datetime import date, timedelta
+from io import StringIO
+from unittest import mock, skipUnless
+from urllib.parse import urlencode
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import Group
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core import mail
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured, PermissionDenied
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.http import HttpResponse
+from django.templatetags.static import static
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils.dateparse import parse_datetime
+from django.utils.timezone import now
+from django_apscheduler.models import DjangoJob
+from amigoSecreto import routers
+from amigoSecreto.routers import PRIMARY, PIN_COOKIE, ReplicaRouter, primary_pinning_middleware, use_primary
+from .aliases import VERSION_KEY as ALIASES_VERSION_KEY, AliasIndex, player_aliases
+from .analytics import rebuild as rebuild_analytics, record_guesses, report
+from .auth_cache import CachedModelBackend, check_shared_cache
+from .availability import VERSION_KEY, TakenNames
+from .enrollment import MIN_PLAYERS, assign_pending, enroll, enrolled_ids, is_enrolled, pending, unenroll
+from .forms import GameForm, GuessForm
+from .game_logic import (WOLFS, adjudicate, false_positive_weight, pair_gifts, round_lengths, split_groups,
+                         split_teams)
+from .gift_search import gift_of, search
+from .jobs import PHASE_KEY, STALE_AFTER as JOB_STALE_AFTER, create_game, fail_stale_jobs
+from .management.commands.archive_games import ARCHIVE_VERSION, GAME_TABLES
+from .models import *
+from .notifications import STALE_AFTER, deliver_pending
+from .offload import run_db
+from .plans import get_plan
+from .player_state import get_state
+from .profiling import list_profiles, load_profile
+from .ratelimit import ALLOWED, LIMITED, counters, rate_limit
+from .reveal import compute, get_reveal, reveal_game, reveal_page, save_results
+from .scheduler import LeaderElection, run_selection, set_options
+from .simulation import distribution, merge_batches, simulate_batch
+from .snapshots import dump_snapshot, read_snapshot, restore_snapshot, write_snapshot
+from .telemetry import histogram, record_tick
+from .views import AliasSearchView
+from .writebehind import get_queue, process_pending, save_guesses
 
-# Create your tests here.
+
+@override_settings(DB_REPLICAS=['replica'], DB_PRIMARY_ONLY=['guess.schedulerlease'],
+                   DB_REPLICA_PIN_SECONDS=5)
+class ReplicaRouterTests(SimpleTestCase):
+    """ Reparto de lecturas entre replicas y primario (amigoSecreto/routers.py)."""
+
+    def setUp(self):
+        self.router = ReplicaRouter()
+        routers.unpin()
+
+    def tearDown(self):
+        routers.unpin()
+
+    def test_reads_go_to_replicas(self):
+        self.assertEqual(self.router.db_for_read(Game), 'replica')
+
+    @override_settings(DB_REPLICAS=[])
+    def test_reads_go_to_primary_without_replicas(self):
+        self.assertEqual(self.router.db_for_read(Game), PRIMARY)
+
+    def test_primary_only_models(self):
+        self.assertEqual(self.router.db_for_read(SchedulerLease), PRIMARY)
+
+    def test_write_pins_to_primary(self):
+        self.assertEqual(self.router.db_for_write(Game), PRIMARY)
+        self.assertTrue(routers.has_written())
+        self.assertEqual(self.router.db_for_read(Game), PRIMARY)
+        routers.unpin()
+        self.assertEqual(self.router.db_for_read(Game), 'replica')
+
+    def test_use_primary(self):
+        with use_primary():
+            self.assertEqual(self.router.db_for_read(Game), PRIMARY)
+            with use_primary():
+                pass
+            # Al salir del bloque anidado se sigue en el primario.
+            self.assertEqual(self.router.db_for_read(Game), PRIMARY)
+        self.assertEqual(self.router.db_for_read(Game), 'replica')
+
+    def test_use_primary_keeps_previous_pin(self):
+        routers.pin_to_primary()
+        with use_primary():
+            pass
+        self.assertTrue(routers.is_pinned())
+
+    def test_middleware_sets_cookie_after_write(self):
+        def view(request):
+            self.router.db_for_write(Game)
+            return HttpResponse()
+
+        response = primary_pinning_middleware(view)(RequestFactory().post('/'))
+        self.assertIn(PIN_COOKIE, response.cookies)
+        self.assertEqual(response.cookies[PIN_COOKIE]['max-age'], 5)
+        self.assertFalse(routers.is_pinned())
+
+    def test_middleware_without_write(self):
+        response = primary_pinning_middleware(lambda request: HttpResponse())(RequestFactory().get('/'))
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+
+    def test_middleware_pins_with_cookie(self):
+        reads = []
+
+        def view(request):
+            reads.append(self.router.db_for_read(Game))
+            return HttpResponse()
+
+        request = RequestFactory().get('/')
+        request.COOKIES[PIN_COOKIE] = '1'
+        primary_pinning_middleware(view)(request)
+        primary_pinning_middleware(view)(RequestFactory().get('/'))
+        self.assertEqual(reads, [PRIMARY, 'replica'])
+
+
+@skipUnless(settings.DB_REPLICAS, 'Needs DB_REPLICA_NAMES')
+class ReplicaDatabaseTests(TestCase):
+    """ Lecturas y escrituras con las replicas de DB_REPLICA_NAMES (en los tests
+    son espejos de 'default')."""
+
+    def setUp(self):
+        routers.unpin()
+
+    def tearDown(self):
+        routers.unpin()
+
+    def test_reads_your_writes(self):
+        self.assertIn(Game.objects.all().db, settings.DB_REPLICAS)
+        game = Game.objects.create(startDate=now(), days=6, endDate=now())
+        queryset = Game.objects.filter(id=game.id)
+        self.assertEqual(queryset.db, PRIMARY)
+        self.assertTrue(queryset.exists())
+
+
+class GameLogicTests(SimpleTestCase):
+    """ Reglas del juego (game_logic.py) y simulador (simulation.py)."""
+
+    def test_round_lengths(self):
+        for days in range(6, 13):
+            self.assertEqual(sum(round_lengths(days)), days)
+
+    def test_pair_gifts(self):
+        rng = random.Random(1)
+        wolfs, villagers = split_teams(range(9), rng)
+        self.assertEqual((len(wolfs), len(villagers)), (4, 5))
+        pairs = pair_gifts(wolfs, villagers, rng)
+        self.assertEqual(len(pairs), 2*len(wolfs))
+        # Cada uno regala como mucho una vez y siempre al equipo rival.
+        self.assertEqual(len({gifter for gifter, _ in pairs}), len(pairs))
+        for gifter, gifted in pairs:
+            self.assertNotEqual(gifter in wolfs, gifted in wolfs)
+
+    def test_split_groups(self):
+        groups = split_groups(range(20), random.Random(1))
+        self.assertEqual([len(group) for group in groups], [4, 4, 3, 3, 3, 3])
+        self.assertEqual(sorted(sum(groups, [])), list(range(20)))
+
+    def test_adjudicate(self):
+        self.assertTrue(adjudicate(True, 20, mock.Mock(choices=mock.Mock(side_effect=AssertionError))))
+        rng = random.Random(1)
+        false_positives = sum(adjudicate(False, 20, rng) for _ in range(4000))/4000
+        self.assertAlmostEqual(false_positives, false_positive_weight(20), delta=0.03)
+
+    def test_simulate_batch(self):
+        batch = simulate_batch(30, 6, 20, seed=1)
+        self.assertEqual(batch, simulate_batch(30, 6, 20, seed=1))
+        self.assertEqual(sum(batch['wins'].values()), 20)
+        total = merge_batches([batch, batch])
+        self.assertEqual(total['games'], 40)
+        self.assertEqual(sum(total[WOLFS].values()), 40)
+
+    def test_distribution(self):
+        self.assertEqual(distribution(Counter({1: 1, 3: 1})), {'mean': 2, 'std': 1, 'p5': 1, 'p50': 1, 'p95': 3})
+
+
+class LeaderElectionTests(TestCase):
+    """ Lease del lider del scheduler (scheduler.LeaderElection)."""
+
+    def setUp(self):
+        self.first = LeaderElection(node='first', ttl=60)
+        self.second = LeaderElection(node='second', ttl=60)
+
+    def test_acquire_free_lease(self):
+        self.assertTrue(self.first.try_acquire())
+        lease = SchedulerLease.objects.get(name=self.first.name)
+        self.assertEqual(lease.holder, 'first')
+        self.assertGreater(lease.expires, now())
+
+    def test_held_lease(self):
+        self.assertTrue(self.first.try_acquire())
+        self.assertFalse(self.second.try_acquire())
+        # El lider renueva su propio lease.
+        self.assertTrue(self.first.try_acquire())
+        self.assertEqual(SchedulerLease.objects.get().holder, 'first')
+
+    def test_expired_lease(self):
+        self.assertTrue(self.first.try_acquire())
+        SchedulerLease.objects.update(expires=now() - timedelta(seconds=1))
+        self.assertTrue(self.second.try_acquire())
+        self.assertFalse(self.first.try_acquire())
+        self.assertEqual(SchedulerLease.objects.get().holder, 'second')
+
+    def test_release(self):
+        self.assertTrue(self.first.try_acquire())
+        self.first.release()
+        self.assertTrue(self.second.try_acquire())
+        # Solo libera el lease quien lo tiene.
+        self.first.release()
+        self.assertFalse(self.first.try_acquire())
+
+    def test_run(self):
+        def expire():
+            SchedulerLease.objects.update(expires=now() - timedelta(seconds=1))
+
+        steps = [
+            # El lease caduca sin renovarse y lo toma otro nodo.
+            lambda: (expire(), self.assertTrue(self.second.try_acquire())),
+            # Lo vuelve a soltar.
+            self.second.release,
+            lambda: None,
+        ]
+        stop = mock.Mock(is_set=lambda: not steps, wait=lambda timeout: steps.pop(0)())
+        scheduler = mock.Mock()
+        # close_old_connections cerraria la transaccion del test.
+        with mock.patch('guess.scheduler.get_scheduler', return_value=scheduler), \
+                mock.patch('guess.scheduler.close_old_connections'):
+            self.first.run(stop)
+        self.assertEqual([call[0] for call in scheduler.method_calls], [
+            'resume', 'wakeup', 'pause', 'resume', 'wakeup', 'pause'])
+        self.assertFalse(self.first.is_leader)
+        # Al parar libera el lease.
+        self.assertTrue(self.second.try_acquire())
+
+
+class GameSetup:
+    """ Base de los tests que necesitan un juego creado con GameForm y PLAYERS
+    jugadores inscritos."""
+    PLAYERS = 20
+
+    def setUp(self):
+        for clear in (get_plan.cache_clear, get_reveal.cache_clear, player_aliases.invalidate,
+                      cache.clear):
+            clear()
+        for name in ('Guessing', 'Guessed', 'NextToGuess'):
+            Group.objects.get_or_create(name=name)
+        User.objects.bulk_create(
+            [User(username=f"player{i}", password='!') for i in range(self.PLAYERS)])
+        ids = list(User.objects.filter(username__startswith='player').values_list('id', flat=True))
+        UserData.objects.bulk_create([
+            UserData(user_id=user_id, alias=f"p{i:03d}", gift=f"gift {i}")
+            for i, user_id in enumerate(ids)
+        ])
+        enroll(ids)
+        form = GameForm(data={'startDate': (date.today() + timedelta(days=1)).isoformat(), 'days': 6})
+        self.assertTrue(form.is_valid(), form.errors)
+        self.game = form.save()
+        self.plan = get_plan(self.game.id)
+
+    def select(self, selection=0):
+        """ Abre la seleccion de la primera ronda como su job."""
+        round = self.plan.rounds[0]
+        set_options(round.id, round.groups[selection], round.options[selection],
+                    selection == 0, selection,
+                    players=round.players() if selection == 0 else None)
+
+    def guesses(self, selection=0):
+        """ (usuario, datos del GuessForm, acierta) de los jugadores del grupo de la
+        seleccion con alguna opcion que regala. Los pares aciertan."""
+        round = self.plan.rounds[0]
+        group, options = round.groups[selection], round.options[selection]
+        gives_to = dict(GivesTo.objects.filter(game=self.game).values_list('gifter_id', 'gifted_id'))
+        aliases = dict(UserData.objects.values_list('user_id', 'alias'))
+        result = []
+        for i, user_id in enumerate(group):
+            gifter = next((option for option in options[3*i:3*i + 3] if option in gives_to), None)
+            if gifter is None:
+                continue
+            correct = not len(result) % 2
+            gifted = gives_to[gifter] if correct else gifter
+            result.append((User.objects.get(id=user_id),
+                           {'gifter': aliases[gifter], 'gifted': aliases[gifted]}, correct))
+        self.assertTrue(result)
+        return result
+
+
+# Las replicas de DB_REPLICA_NAMES solo las usa ReplicaDatabaseTests.
+@override_settings(DB_REPLICAS=[], NOTIFICATIONS_EMBEDDED=False, GUESS_WRITE_BEHIND=False)
+class GameTestCase(GameSetup, TestCase):
+    pass
+
+
+class AliasTests(GameTestCase):
+    """ Indice de los alias de los jugadores del juego activo (aliases.py)."""
+
+    def test_index_search(self):
+        index = AliasIndex((f"a{i:02d}", i) for i in range(25))
+        index.add('b00', 25)
+        self.assertEqual(index.search('a', 1, 10), ([f"a{i:02d}" for i in range(10)], True))
+        self.assertEqual(index.search('a', 3, 10), ([f"a{i:02d}" for i in range(20, 25)], False))
+        self.assertEqual(index.search('a', 4, 10), ([], False))
+        self.assertEqual(index.search('a1', 1, 10), ([f"a{i:02d}" for i in range(10, 20)], False))
+        self.assertEqual(index.search('c'), ([], False))
+        self.assertEqual((index.lookup('b00'), index.lookup('b01')), (25, None))
+
+    def test_follows_the_current_game(self):
+        aliases = dict(UserData.objects.values_list('user_id', 'alias'))
+        players = sorted(aliases)
+        self.assertEqual(player_aliases.lookup(aliases[players[-1]]), players[-1])
+        version = cache.get(ALIASES_VERSION_KEY)
+        enroll(players[:10])
+        form = GameForm(data={'startDate': (date.today() + timedelta(days=2)).isoformat(), 'days': 6})
+        self.assertTrue(form.is_valid(), form.errors)
+        form.save()
+        # Con una cache local por proceso la version del que creo el juego no llega.
+        cache.set(ALIASES_VERSION_KEY, version, None)
+        self.assertIsNone(player_aliases.lookup(aliases[players[-1]]))
+        self.assertEqual(player_aliases.lookup(aliases[players[0]]), players[0])
+
+    def test_search_view(self):
+        url = reverse('alias_search')
+        self.assertEqual(self.client.get(url, {'q': 'p0'}).status_code, 302)
+        self.client.force_login(User.objects.get(username='player0'))
+        with mock.patch.object(AliasSearchView, 'page_size', 8):
+            self.assertEqual(self.client.get(url, {'q': 'p0', 'page': 'x'}).json(), {
+                'results': [f"p{i:03d}" for i in range(8)], 'page': 1, 'has_next': True})
+            self.assertEqual(self.client.get(url, {'q': 'p0', 'page': 3}).json(), {
+                'results': [f"p{i:03d}" for i in range(16, 20)], 'page': 3, 'has_next': False})
+        self.assertEqual(self.client.get(url, {'q': 'q'}).json()['results'], [])
+
+
+class GameJobTests(GameTestCase):
+    """ Creacion de un juego en segundo plano (jobs.py)."""
+
+    def setUp(self):
+        super().setUp()
+        # Los jugadores vuelven a inscribirse para el siguiente juego.
+        enroll(list(PlayerState.objects.filter(game=self.game).values_list('user_id', flat=True)))
+        self.form = GameForm(data={'startDate': (date.today() + timedelta(days=2)).isoformat(), 'days': 6})
+        self.assertTrue(self.form.is_valid(), self.form.errors)
+        self.job = GameJob.objects.create()
+
+    def test_create_game(self):
+        create_game(self.job.id, self.form)
+        job = GameJob.objects.get(id=self.job.id)
+        self.assertEqual((job.status, job.phase, job.progress()), (GameJob.DONE, 'scheduling', 1.0))
+        self.assertTrue(DjangoJob.objects.filter(id=f"reveal-{job.game_id}").exists())
+
+    def test_failure_rolls_back(self):
+        counts = [model.objects.count() for model in (Game, Round, GamePlan, PlayerState, DjangoJob)]
+        with mock.patch.object(GameForm, 'create_selections', side_effect=ValueError('broken')):
+            with self.assertRaises(ValueError):
+                create_game(self.job.id, self.form)
+        job = GameJob.objects.get(id=self.job.id)
+        self.assertEqual((job.status, job.phase, job.game), (GameJob.FAILED, 'scheduling', None))
+        self.assertIn('broken', job.error)
+        self.assertEqual([model.objects.count() for model in (Game, Round, GamePlan, PlayerState, DjangoJob)],
+                         counts)
+
+    def test_phase_while_running(self):
+        User.objects.create_superuser('admin', password='admin')
+        self.client.login(username='admin', password='admin')
+        GameJob.objects.filter(id=self.job.id).update(status=GameJob.RUNNING)
+        cache.set(PHASE_KEY.format(self.job.id), 'rounds')
+        response = self.client.get(reverse('game_job', args=[self.job.id]))
+        self.assertEqual((response.json()['phase'], response.json()['progress']), ('rounds', 0.5))
+
+    def test_fail_stale_jobs(self):
+        stale = [GameJob.objects.create(status=status).id for status in (GameJob.QUEUED, GameJob.RUNNING)]
+        GameJob.objects.filter(id__in=stale).update(updated=now() - JOB_STALE_AFTER - timedelta(seconds=1))
+        self.assertEqual(fail_stale_jobs(), 2)
+        self.assertEqual(set(GameJob.objects.filter(status=GameJob.FAILED).values_list('id', flat=True)),
+                         set(stale))
+        self.assertEqual(GameJob.objects.get(id=self.job.id).status, GameJob.QUEUED)
+
+
+class ArchiveGamesTests(GameTestCase):
+    """ Archivo y purga de los juegos terminados (comando archive_games)."""
+
+    def setUp(self):
+        super().setUp()
+        self.select()
+        for user, data, _ in self.guesses():
+            form = GuessForm(data, user=user)
+            self.assertTrue(form.is_valid(), form.errors)
+            form.save()
+        reveal_game(self.game)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def archive(self, *args):
+        call_command('archive_games', *args, '--game', str(self.game.id), '--archive-dir', self.directory,
+                     '--batch-size', '7', '--pause', '0', stdout=StringIO())
+        path, = (os.path.join(self.directory, name) for name in os.listdir(self.directory))
+        with gzip.open(path, 'rt') as archive:
+            return [json.loads(line) for line in archive]
+
+    def test_unfinished_game(self):
+        with self.assertRaises(CommandError):
+            self.archive()
+
+    def test_archive_and_purge(self):
+        Game.objects.filter(id=self.game.id).update(endDate=now() - timedelta(days=1))
+        guesses = Guess.objects.filter(game=self.game).count()
+        lines = self.archive()
+        self.assertEqual(lines[0]['version'], ARCHIVE_VERSION)
+        models = Counter(line['model'] for line in lines[1:])
+        self.assertEqual(models['guess.game'], 1)
+        self.assertEqual(models['guess.guess'], guesses)
+        self.assertEqual(models['guess.selectiontick'], 1)
+        self.assertEqual(models['guess.gamereveal'], 1)
+        self.assertEqual(models['guess.playerstate'], self.PLAYERS)
+        self.assertFalse(Game.objects.filter(id=self.game.id).exists())
+        for model, lookup in GAME_TABLES:
+            self.assertFalse(model.objects.filter(**{lookup: self.game.id}).exists(), model)
+
+    def test_no_delete(self):
+        Game.objects.filter(id=self.game.id).update(endDate=now() - timedelta(days=1))
+        self.archive('--no-delete')
+        self.assertEqual(PlayerState.objects.filter(game=self.game).count(), self.PLAYERS)
+
+
+@override_settings(DB_REPLICAS=[])
+class ProfilerTests(TestCase):
+    """ Profiling de peticiones para superusuarios (profiling.py)."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        profiles_dir = self.settings(PROFILES_DIR=directory.name)
+        profiles_dir.enable()
+        self.addCleanup(profiles_dir.disable)
+        self.admin = User.objects.create_superuser('admin', password='admin')
+        self.player = User.objects.create(username='player', password='!')
+
+    def test_superuser(self):
+        self.client.force_login(self.admin)
+        self.client.get(reverse('home'), {'profile': '1'})
+        self.client.get(reverse('home'), HTTP_X_PROFILE='1')
+        profiles = list_profiles()
+        self.assertEqual(len(profiles), 2)
+        self.assertEqual((profiles[0]['path'], profiles[0]['status']), ('/', 200))
+        self.assertGreater(profiles[0]['query_count'], 0)
+        profile = load_profile(profiles[0]['name'])
+        self.assertTrue(profile['functions'])
+        self.assertTrue(os.path.isfile(os.path.join(settings.PROFILES_DIR, profile['name'] + '.prof')))
+        self.assertContains(self.client.get(reverse('profiles')), profile['name'])
+        self.assertEqual(self.client.get(reverse('profile_detail', args=[profile['name']])).status_code, 200)
+        self.assertEqual(self.client.get(reverse('profile_detail', args=['missing'])).status_code, 404)
+
+    def test_not_requested_or_not_superuser(self):
+        self.client.force_login(self.admin)
+        self.client.get(reverse('home'))
+        self.client.force_login(self.player)
+        self.client.get(reverse('home'), {'profile': '1'})
+        self.assertEqual(list_profiles(), [])
+        self.assertEqual(self.client.get(reverse('profiles')).status_code, 403)
+
+
+class TelemetryTests(GameTestCase):
+    """ SelectionTick de los jobs de las selecciones y metricas (telemetry.py)."""
+
+    def setUp(self):
+        super().setUp()
+        self.round = self.plan.rounds[0]
+
+    def test_tick(self):
+        run_selection(self.game.id, 0, 0, now() - timedelta(seconds=90))
+        tick = SelectionTick.objects.get(round_id=self.round.id)
+        self.assertGreaterEqual(tick.lag_ms, 90*1000)
+        self.assertGreater(tick.rows, len(self.round.groups[0]))
+        self.assertEqual((tick.selection, tick.error), (0, ''))
+
+    def test_failed_tick(self):
+        with self.assertRaises(ValueError):
+            with record_tick(self.round.id, 2, None) as tick:
+                tick.rows = 3
+                raise ValueError('broken')
+        tick = SelectionTick.objects.get(round_id=self.round.id)
+        self.assertEqual((tick.selection, tick.rows, tick.lag_ms), (2, 3, 0))
+        self.assertIn('broken', tick.error)
+
+    def test_histogram(self):
+        for lag_ms in (100, 2000, 7200*1000):
+            SelectionTick.objects.create(round_id=self.round.id, selection=0, scheduled=now(), started=now(),
+                                         lag_ms=lag_ms, duration_ms=0)
+        rows, total = histogram(SelectionTick.objects.all(), 'lag_ms', [1, 5])
+        self.assertEqual(rows, [(1, 1), (5, 2), ('+Inf', 3)])
+        self.assertEqual(total, 7202.1)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_metrics_view(self):
+        with record_tick(self.round.id, 0, None):
+            pass
+        url = reverse('metrics')
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        response = self.client.get(url, HTTP_AUTHORIZATION='Bearer secret')
+        self.assertIn('guess_selection_tick_lag_seconds_count 1', response.content.decode())
+        self.assertIn('guess_selection_tick_errors_total 0', response.content.decode())
+
+
+class EnrollmentTests(GameTestCase):
+    """ Inscripcion en el proximo juego (enrollment.py)."""
+
+    def setUp(self):
+        super().setUp()
+        self.players = list(PlayerState.objects.filter(game=self.game).values_list('user_id', flat=True))
+        self.outsider = User.objects.create(username='outsider', password='!')
+
+    def test_enroll(self):
+        self.assertEqual(enroll(self.players[:3]), 3)
+        # Los ya inscritos se ignoran.
+        self.assertEqual(enroll(self.players[:5]), 2)
+        self.assertTrue(is_enrolled(self.players[0]))
+        self.assertEqual(unenroll(self.players[0]), 1)
+        self.assertEqual(unenroll(self.players[0]), 0)
+        self.assertFalse(is_enrolled(self.players[0]))
+        self.assertEqual(pending().count(), 4)
+
+    def test_assign_pending(self):
+        self.assertEqual(set(enrolled_ids(self.game)), set(self.players))
+        self.assertFalse(pending().exists())
+        self.assertNotIn(self.outsider.id, self.players)
+        enroll(self.players[:2])
+        game = Game.objects.create(startDate=now(), days=6, endDate=now())
+        self.assertEqual(assign_pending(game), 2)
+        self.assertEqual(set(enrolled_ids(game)), set(self.players[:2]))
+        # Las del juego anterior no cambian.
+        self.assertEqual(len(set(enrolled_ids(self.game))), self.PLAYERS)
+
+    def test_min_players(self):
+        enroll(self.players[:MIN_PLAYERS - 1])
+        form = GameForm(data={'startDate': (date.today() + timedelta(days=2)).isoformat(), 'days': 6})
+        self.assertFalse(form.is_valid())
+
+    def test_enroll_view(self):
+        self.client.force_login(self.outsider)
+        self.assertRedirects(self.client.post(reverse('enroll')), reverse('home'), fetch_redirect_response=False)
+        self.assertTrue(is_enrolled(self.outsider.id))
+        self.client.post(reverse('enroll'), {'leave': '1'})
+        self.assertFalse(is_enrolled(self.outsider.id))
+
+
+class PlayerStateTests(GameTestCase):
+    """ Transiciones de PlayerState al crear el juego, abrir selecciones y adivinar."""
+
+    def states(self):
+        return {state.user_id: state for state in PlayerState.objects.filter(game=self.game)}
+
+    def test_created_with_the_game(self):
+        states = self.states()
+        self.assertEqual(len(states), self.PLAYERS)
+        aliases = dict(UserData.objects.values_list('user_id', 'alias'))
+        teams = dict(UserTeam.objects.values_list('user_id', 'team__name'))
+        for user_id, state in states.items():
+            self.assertEqual(state.status, PlayerState.NEXT_TO_GUESS)
+            self.assertEqual(state.alias, aliases[user_id])
+            self.assertEqual(state.team, teams[user_id])
+
+    def test_selection(self):
+        self.select()
+        round = self.plan.rounds[0]
+        group, options = round.groups[0], round.options[0]
+        aliases = dict(UserData.objects.values_list('user_id', 'alias'))
+        states = self.states()
+        for i, user_id in enumerate(group):
+            state = states.pop(user_id)
+            self.assertEqual(state.status, PlayerState.GUESSING)
+            self.assertEqual(state.selection, 0)
+            self.assertEqual(state.options, [aliases[option] for option in options[3*i:3*i + 3]])
+        for state in states.values():
+            self.assertEqual(state.status, PlayerState.NEXT_TO_GUESS)
+            self.assertEqual(state.options, [])
+
+    def test_guess(self):
+        self.select()
+        user, data, correct = self.guesses()[0]
+        form = GuessForm(data, user=user)
+        self.assertTrue(form.is_valid(), form.errors)
+        form.save()
+        state = get_state(user.id)
+        self.assertEqual(state.status, PlayerState.GUESSED)
+        self.assertIsNone(state.selection)
+        self.assertEqual(state.options, [])
+        guess = Guess.objects.get(owner=user)
+        self.assertEqual(UserData.objects.get(user=guess.gifter).alias, data['gifter'])
+        self.assertEqual(guess.game, self.game)
+        if correct:
+            self.assertTrue(guess.answer)
+        self.assertTrue(user.groups.filter(name='Guessed').exists())
+        with self.assertRaises(PermissionDenied):
+            GuessForm(data, user=user)
+
+    def test_guess_after_new_game(self):
+        self.select()
+        user, data, _ = self.guesses()[0]
+        form = GuessForm(data, user=user)
+        self.assertTrue(form.is_valid(), form.errors)
+        # Se crea otro juego entre la validacion y el guardado.
+        enroll(list(PlayerState.objects.filter(game=self.game).values_list('user_id', flat=True)))
+        game_form = GameForm(data={'startDate': (date.today() + timedelta(days=2)).isoformat(), 'days': 6})
+        self.assertTrue(game_form.is_valid(), game_form.errors)
+        game_form.save()
+        form.save()
+        self.assertEqual(Guess.objects.get(owner=user).game, self.game)
+
+    def test_guess_is_atomic(self):
+        self.select()
+        user, data, _ = self.guesses()[0]
+        form = GuessForm(data, user=user)
+        self.assertTrue(form.is_valid(), form.errors)
+        with mock.patch('guess.forms.mark_guessed', side_effect=ValueError):
+            with self.assertRaises(ValueError):
+                form.save()
+        self.assertFalse(Guess.objects.filter(owner=user).exists())
+        self.assertTrue(user.groups.filter(name='Guessing').exists())
+        self.assertEqual(SelectionStats.objects.get(round__game=self.game).guesses, 0)
+
+    def test_next_selection(self):
+        self.select()
+        first = set(self.plan.rounds[0].groups[0])
+        self.select(1)
+        second = set(self.plan.rounds[0].groups[1])
+        for user_id, state in self.states().items():
+            if user_id in second:
+                self.assertEqual(state.status, PlayerState.GUESSING)
+                self.assertEqual(state.selection, 1)
+            elif user_id in first:
+                self.assertEqual(state.status, PlayerState.GUESSED)
+            else:
+                self.assertEqual(state.status, PlayerState.NEXT_TO_GUESS)
+
+
+@override_settings(DB_REPLICAS=[], RATE_LIMITS={'signup': '3/300', 'availability': '2/60', 'guess': ''})
+class RateLimitTests(TestCase):
+    """ Limite de peticiones por cliente (ratelimit.py)."""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_signup_posts(self):
+        url = reverse('sign_up')
+        for _ in range(3):
+            self.assertNotEqual(self.client.post(url, {}).status_code, 429)
+        response = self.client.post(url, {})
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(int(response['Retry-After']), 0)
+        # Los GET no gastan tokens.
+        self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertEqual(counters()[('signup', ALLOWED)], 3)
+        self.assertEqual(counters()[('signup', LIMITED)], 1)
+
+    def test_bucket_per_ip(self):
+        url = reverse('sign_up')
+        for _ in range(4):
+            self.client.post(url, {}, REMOTE_ADDR='10.0.0.1')
+        self.assertNotEqual(self.client.post(url, {}, REMOTE_ADDR='10.0.0.2').status_code, 429)
+
+    def test_availability_gets(self):
+        url = reverse('availability')
+        for _ in range(2):
+            self.assertEqual(self.client.get(url, {'username': 'someone'}).status_code, 200)
+        self.assertEqual(self.client.get(url, {'username': 'someone'}).status_code, 429)
+
+    def test_unlimited_scope(self):
+        view = rate_limit('guess')(lambda request: HttpResponse())
+        for _ in range(10):
+            self.assertEqual(view(RequestFactory().post('/')).status_code, 200)
+
+
+# Las vistas asincronas usan la BD desde los hilos de offload.py, que no ven la
+# transaccion de TestCase.
+@override_settings(DB_REPLICAS=['default'], NOTIFICATIONS_EMBEDDED=False, GUESS_WRITE_BEHIND=False,
+                   RATE_LIMITS={'guess': '1/60'})
+class AsyncViewTests(GameSetup, TransactionTestCase):
+    """ Vistas asincronas servidas con ASGI (AsyncView y offload.py). 'default' hace de
+    replica para ver si las lecturas se fijan al primario."""
+
+    def setUp(self):
+        super().setUp()
+        self.select()
+        self.user, self.data, _ = self.guesses()[0]
+        self.async_client.force_login(self.user)
+
+    def post(self, url, data):
+        # El AsyncClient de Django 3.1 no lee bien los cuerpos multipart.
+        return self.async_client.post(url, urlencode(data), content_type='application/x-www-form-urlencoded')
+
+    async def test_welcome(self):
+        response = await self.async_client.get(reverse('home_async'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['state'].user_id, self.user.id)
+
+    async def test_login_required(self):
+        self.async_client.cookies.clear()
+        response = await self.async_client.get(reverse('guess_async'))
+        self.assertEqual(response.status_code, 302)
+
+    async def test_guess(self):
+        url = reverse('guess_async')
+        response = await self.async_client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(self.data['gifter'], response.content.decode())
+        response = await self.post(url, self.data)
+        self.assertEqual(response.status_code, 302)
+        # La escritura en el pool fija al primario las siguientes peticiones.
+        self.assertIn(PIN_COOKIE, response.cookies)
+        state = await run_db(get_state, self.user.id)
+        self.assertEqual(state.status, PlayerState.GUESSED)
+        self.assertEqual((await self.post(url, self.data)).status_code, 429)
+
+    async def test_pinned_reads(self):
+        with mock.patch('amigoSecreto.routers.random.choice', side_effect=lambda replicas: replicas[0]) as choice:
+            await self.async_client.get(reverse('home_async'))
+            self.assertTrue(choice.called)
+            choice.reset_mock()
+            self.async_client.cookies[PIN_COOKIE] = '1'
+            await self.async_client.get(reverse('home_async'))
+            self.assertFalse(choice.called)
+
+
+class NotificationTests(GameTestCase):
+    """ Avisos a los jugadores de cada seleccion (notifications.py). El runner de
+    tests envia el correo con el backend locmem."""
+
+    def setUp(self):
+        super().setUp()
+        self.group = self.plan.rounds[0].groups[0]
+        for user in User.objects.exclude(id=self.group[0]):
+            user.email = f"{user.username}@example.com"
+            user.save()
+
+    def test_deliver(self):
+        self.select()
+        # El job de la seleccion se puede repetir sin duplicar los avisos.
+        self.select()
+        self.assertEqual(NotificationBatch.objects.count(), 1)
+        batches = deliver_pending(batch_size=2)
+        self.assertEqual(len(batches), 1)
+        batch = batches[0]
+        self.assertEqual(batch.status, NotificationBatch.DONE)
+        self.assertEqual((batch.queued, batch.sent, batch.skipped, batch.failed),
+                         (len(self.group), len(self.group) - 1, 1, 0))
+        recipients = {message.to[0]: message for message in mail.outbox}
+        self.assertEqual(len(recipients), len(self.group) - 1)
+        state = PlayerState.objects.get(game=self.game, user_id=self.group[1])
+        message = recipients[state.user.email]
+        self.assertIn(state.alias, message.body)
+        for option in state.options:
+            self.assertIn(option, message.body)
+        self.assertEqual(deliver_pending(), [])
+
+    def test_skips_players_not_guessing(self):
+        self.select()
+        self.select(1)
+        deliver_pending()
+        second = set(self.plan.rounds[0].groups[1])
+        sent = {message.to[0] for message in mail.outbox}
+        self.assertEqual(sent, set(User.objects.filter(id__in=second).exclude(
+            email='').values_list('email', flat=True)))
+
+    def test_reclaims_stale_batch(self):
+        self.select()
+        NotificationBatch.objects.update(
+            status=NotificationBatch.SENDING, heartbeat=now() - STALE_AFTER/2)
+        self.assertEqual(deliver_pending(), [])
+        NotificationBatch.objects.update(heartbeat=now() - 2*STALE_AFTER)
+        self.assertEqual(len(deliver_pending()), 1)
+        self.assertEqual(len(mail.outbox), len(self.group) - 1)
+
+
+@override_settings(STATICFILES_STORAGE='guess.staticfiles.CompressedManifestStaticFilesStorage',
+                   STATIC_SERVE=True)
+class StaticFilesTests(SimpleTestCase):
+    """ collectstatic con CompressedManifestStaticFilesStorage y
+    static_files_middleware (staticfiles.py)."""
+    NAME = 'guess/forms.css'
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.root = directory.name
+        static_root = self.settings(STATIC_ROOT=self.root)
+        static_root.enable()
+        self.addCleanup(static_root.disable)
+        call_command('collectstatic', interactive=False, verbosity=0)
+        self.hashed = staticfiles_storage.stored_name(self.NAME)
+
+    def test_collected(self):
+        self.assertRegex(self.hashed, r'^guess/forms\.[0-9a-f]{12}\.css$')
+        self.assertTrue(os.path.isfile(os.path.join(self.root, 'staticfiles.json')))
+        with open(os.path.join(self.root, self.hashed), 'rb') as original, \
+                gzip.open(os.path.join(self.root, f"{self.hashed}.gz")) as compressed:
+            self.assertEqual(compressed.read(), original.read())
+        self.assertEqual(static(self.NAME), f"/static/{self.hashed}")
+
+    def test_serve_hashed(self):
+        response = self.client.get(f"/static/{self.hashed}", HTTP_ACCEPT_ENCODING='gzip, br')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertIn('immutable', response['Cache-Control'])
+        with open(os.path.join(self.root, f"{self.hashed}.gz"), 'rb') as compressed:
+            self.assertEqual(b''.join(response.streaming_content), compressed.read())
+        response = self.client.get(f"/static/{self.hashed}", HTTP_ACCEPT_ENCODING='gzip',
+                                   HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_serve_unhashed(self):
+        response = self.client.get(f"/static/{self.NAME}")
+        self.assertNotIn('Content-Encoding', response)
+        self.assertEqual(response['Cache-Control'], 'public, no-cache')
+
+
+class AuthCacheTests(TestCase):
+    """ Usuario de la sesion leido con CachedModelBackend (auth_cache.py)."""
+    BACKENDS = ['guess.auth_cache.CachedModelBackend', 'django.contrib.auth.backends.ModelBackend']
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('cached', password='secret')
+        UserData.objects.create(user=self.user, alias='cach', gift='taza')
+        self.override = self.settings(AUTHENTICATION_BACKENDS=self.BACKENDS, DB_REPLICAS=[])
+        self.override.enable()
+        self.addCleanup(self.override.disable)
+        self.client.force_login(self.user, backend=self.BACKENDS[0])
+
+    def get(self, name):
+        return self.client.get(reverse(name)).status_code
+
+    def test_cached_user(self):
+        self.assertEqual(self.get('gift_search'), 200)
+        user = CachedModelBackend().get_user(self.user.id)
+        self.assertEqual(user.data.alias, 'cach')
+
+    def test_deactivated(self):
+        self.assertEqual(self.get('gift_search'), 200)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.get('gift_search'), 302)
+
+    def test_superuser_revoked(self):
+        User.objects.filter(id=self.user.id).update(is_superuser=True)
+        self.assertEqual(self.get('enrollments'), 200)
+        # Sin signals ni invalidate_user: la copia de la cache no se entera.
+        User.objects.filter(id=self.user.id).update(is_superuser=False)
+        self.assertEqual(self.get('enrollments'), 403)
+
+    def test_password_changed(self):
+        self.assertEqual(self.get('gift_search'), 200)
+        User.objects.filter(id=self.user.id).update(password=make_password('other'))
+        self.assertEqual(self.get('gift_search'), 302)
+
+    def test_deleted(self):
+        self.assertEqual(self.get('gift_search'), 200)
+        User.objects.filter(id=self.user.id).delete()
+        self.assertIsNone(CachedModelBackend().get_user(self.user.id))
+
+    @override_settings(AUTHENTICATION_BACKENDS=BACKENDS)
+    def test_needs_shared_cache(self):
+        with self.assertRaises(ImproperlyConfigured):
+            check_shared_cache()
+        with override_settings(CACHES={'default': {
+                'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache'}}):
+            check_shared_cache()
+
+
+@override_settings(DB_REPLICAS=[], RATE_LIMITS={})
+class AvailabilityTests(TestCase):
+    """ Indice de nombres ocupados del registro (availability.py). Los on_commit de
+    TestCase no se ejecutan: el indice no se entera de las altas, como un proceso con
+    una cache local."""
+
+    def setUp(self):
+        cache.clear()
+        User.objects.create(username='taken', password='!')
+        self.names = TakenNames()
+        self.names.get()
+        User.objects.create(username='newcomer', password='!')
+
+    def test_index(self):
+        self.assertFalse(self.names.is_available('username', 'taken'))
+        self.assertTrue(self.names.is_available('username', 'free'))
+        User.objects.filter(username='taken').delete()
+        self.assertTrue(self.names.is_available('username', 'taken'))
+
+    @override_settings(SHARED_CACHE=False)
+    def test_stale_index(self):
+        self.assertFalse(self.names.is_available('username', 'newcomer'))
+
+    @override_settings(SHARED_CACHE=True)
+    def test_stale_index_with_shared_cache(self):
+        # Con una cache compartida el alta cambia VERSION_KEY al confirmarse.
+        self.assertTrue(self.names.is_available('username', 'newcomer'))
+        cache.set(VERSION_KEY, 'new')
+        self.assertFalse(self.names.is_available('username', 'newcomer'))
+
+    @override_settings(SHARED_CACHE=False)
+    def test_view(self):
+        response = self.client.get(reverse('availability'), {'username': 'newcomer', 'alias': 'free'})
+        self.assertEqual(response.json(), {'username': {'available': False}, 'alias': {'available': True}})
+
+
+class RevealTests(GameTestCase):
+    """ Resultado final de un juego (reveal.py)."""
+
+    def setUp(self):
+        super().setUp()
+        self.select()
+        for user, data, _ in self.guesses():
+            form = GuessForm(data, user=user)
+            self.assertTrue(form.is_valid(), form.errors)
+            form.save()
+
+    def test_aggregates(self):
+        data = compute(self.game)
+        gives_to = dict(GivesTo.objects.filter(game=self.game).values_list('gifter_id', 'gifted_id'))
+        aliases = dict(UserData.objects.values_list('user_id', 'alias'))
+        guesses = list(Guess.objects.filter(game=self.game))
+        discovered = {guess.gifter_id for guess in guesses if gives_to.get(guess.gifter_id) == guess.gifted_id}
+        self.assertTrue(discovered)
+        teams = {}
+        for state in PlayerState.objects.filter(game=self.game):
+            owned = [guess for guess in guesses if guess.owner_id == state.user_id]
+            points = sum(guess.answer for guess in owned)
+            teams[state.team] = teams.get(state.team, 0) + points
+            self.assertEqual(data['players'][state.user_id], [
+                state.alias, state.team,
+                aliases[gives_to[state.user_id]],
+                next(aliases[gifter] for gifter, gifted in gives_to.items() if gifted == state.user_id),
+                state.user_id in discovered, len(owned), points,
+            ])
+        self.assertEqual(dict(data['teams']), teams)
+        self.assertEqual([points for _, points in data['teams']], sorted(teams.values(), reverse=True))
+
+    def test_reveal_game(self):
+        self.assertIsNone(get_reveal(self.game.id))
+        self.assertIsNone(reveal_page(None))
+        reveal = reveal_game(self.game)
+        self.assertEqual(get_reveal(self.game.id).players, reveal.players)
+        for name, points in reveal.teams:
+            self.assertEqual(Teams.objects.get(game=self.game, name=name).score, points)
+        guessed = set(UserData.objects.filter(guessed=True).values_list('user_id', flat=True))
+        self.assertEqual(guessed, {user_id for user_id, row in reveal.players.items() if row[4]})
+        user_id, row = next(iter(reveal.players.items()))
+        self.assertIn(row[0], reveal_page(user_id))
+
+    def test_reveal_again(self):
+        reveal_game(self.game)
+        self.assertIsNotNone(get_reveal(self.game.id))
+        state = PlayerState.objects.filter(game=self.game).first()
+        points = get_reveal(self.game.id).player(state.user_id)['points']
+        Guess.objects.create(game=self.game, owner=state.user, gifter=state.user, gifted=state.user,
+                             date=now(), answer=True)
+        # Otro proceso vuelve a revelarlo: este tiene el anterior en memoria.
+        save_results(self.game, compute(self.game))
+        self.assertEqual(get_reveal(self.game.id).player(state.user_id)['points'], points + 1)
+
+    def test_reveal_page_again(self):
+        reveal_game(self.game)
+        state = PlayerState.objects.filter(game=self.game).first()
+        self.assertIn(self.points(state.user_id), reveal_page(state.user_id))
+        Guess.objects.create(game=self.game, owner=state.user, gifter=state.user, gifted=state.user,
+                             date=now(), answer=True)
+        # La pagina anterior sigue en la cache, pero ya no es la del GameReveal.
+        reveal_game(self.game)
+        self.assertIn(self.points(state.user_id), reveal_page(state.user_id))
+        save_results(self.game, compute(self.game))
+        self.assertIn(self.points(state.user_id), reveal_page(state.user_id))
+
+    def points(self, user_id):
+        return f"Aciertos: {get_reveal(self.game.id).player(user_id)['points']}."
+
+
+class AnalyticsTests(GameTestCase):
+    """ Contadores de las adivinanzas por seleccion y por equipo (analytics.py)."""
+
+    def setUp(self):
+        super().setUp()
+        # El job se ejecuta una hora despues de la ventana del plan.
+        self.scheduled = now() - timedelta(hours=1)
+        run_selection(self.game.id, 0, 0, self.scheduled)
+
+    def guess_all(self):
+        guesses = self.guesses()
+        for user, data, _ in guesses:
+            form = GuessForm(data, user=user)
+            self.assertTrue(form.is_valid(), form.errors)
+            form.save()
+        return guesses
+
+    def counters(self):
+        selections = list(SelectionStats.objects.filter(round__game=self.game).order_by(
+            'round_id', 'selection').values_list(
+            'round_id', 'selection', 'opened', 'group', 'guesses', 'correct', 'false_positives',
+            'expected_false_positives', 'time_to_guess_ms'))
+        teams = list(TeamStats.objects.filter(game=self.game).order_by('team').values_list(
+            'team', 'guesses', 'correct', 'false_positives', 'expected_false_positives'))
+        return selections, teams
+
+    def test_open_selection(self):
+        stats = SelectionStats.objects.get(round__game=self.game)
+        self.assertEqual(stats.opened, self.scheduled)
+        self.assertEqual(stats.group, len(self.plan.rounds[0].groups[0]))
+        self.assertEqual(TeamStats.objects.filter(game=self.game).count(), 2)
+
+    def test_guesses(self):
+        guesses = self.guess_all()
+        correct = sum(correct for _, _, correct in guesses)
+        stats = SelectionStats.objects.get(round__game=self.game)
+        self.assertEqual((stats.guesses, stats.correct), (len(guesses), correct))
+        self.assertGreaterEqual(stats.time_to_guess_ms, len(guesses)*3600*1000)
+        teams = TeamStats.objects.filter(game=self.game)
+        self.assertEqual(sum(team.guesses for team in teams), len(guesses))
+        self.assertEqual(sum(team.correct for team in teams), correct)
+
+        data = report(self.game.id)
+        selection = data['selections'][0]
+        self.assertEqual(selection['guesses'], len(guesses))
+        self.assertEqual(selection['participation'], len(guesses)/stats.group)
+        self.assertGreaterEqual(selection['mean_time_to_guess_s'], 3600)
+        self.assertEqual(sum(team['guesses'] for team in data['teams']), len(guesses))
+
+    def test_write_behind(self):
+        with tempfile.TemporaryDirectory() as directory, self.settings(
+                GUESS_WRITE_BEHIND=True, GUESS_QUEUE_EMBEDDED=False,
+                GUESS_QUEUE_PATH=os.path.join(directory, 'queue.sqlite3')):
+            guesses = self.guess_all()
+            process_pending()
+        self.assertEqual(SelectionStats.objects.get(round__game=self.game).guesses, len(guesses))
+
+    def test_rebuild(self):
+        self.guess_all()
+        counters = self.counters()
+        self.assertEqual(rebuild_analytics(self.game), sum(row[4] for row in counters[0]))
+        self.assertEqual(self.counters(), counters)
+
+    def test_json_view(self):
+        self.guess_all()
+        User.objects.filter(id=self.guesses()[0][0].id).update(is_superuser=True)
+        self.client.force_login(self.guesses()[0][0])
+        response = self.client.get(reverse('analytics_json'), {'game': self.game.id})
+        self.assertEqual(response.json()['selections'][0]['guesses'],
+                         SelectionStats.objects.get(round__game=self.game).guesses)
+
+
+class SnapshotTests(GameTestCase):
+    """ Copia de un juego con dump_snapshot y restore_snapshot (snapshots.py)."""
+
+    def setUp(self):
+        super().setUp()
+        self.select()
+        for user, data, _ in self.guesses():
+            form = GuessForm(data, user=user)
+            self.assertTrue(form.is_valid(), form.errors)
+            form.save()
+        reveal_game(self.game)
+
+    def normalize(self, data):
+        """ Tablas del snapshot sin los IDs que cambian al restaurar: los equipos y las
+        rondas se referencian por su posicion."""
+        positions = {name: {row_id: i for i, row_id in enumerate(data['tables'][name]['id'])}
+                     for name in ('teams', 'rounds')}
+        tables = {}
+        for name, columns in data['tables'].items():
+            columns = {column: values for column, values in columns.items() if column != 'id'}
+            for column, target in (('team_id', 'teams'), ('round_id', 'rounds')):
+                if column in columns:
+                    columns[column] = [positions[target][value] for value in columns[column]]
+            tables[name] = columns
+        plan = [(round['groups'], round['options']) for round in data['plan']['rounds']]
+        return data['game'], tables, plan, data['reveal']['players']
+
+    def test_clone(self):
+        data = dump_snapshot(self.game)
+        # restore_snapshot remapea el plan y el resultado sobre los datos que recibe.
+        game, rows = restore_snapshot(copy.deepcopy(data))
+        self.assertNotEqual(game.id, self.game.id)
+        self.assertGreater(rows, 1)
+        get_plan.cache_clear()
+        self.assertEqual(self.normalize(dump_snapshot(game)), self.normalize(data))
+        self.assertEqual(get_reveal(game.id).players, get_reveal(self.game.id).players)
+
+    def test_restore_in_empty_database(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'game.snapshot')
+            self.assertGreater(write_snapshot(self.game, path), 0)
+            data = read_snapshot(path)
+        aliases = dict(UserData.objects.values_list('user__username', 'alias'))
+        Game.objects.all().delete()
+        User.objects.all().delete()
+
+        game, _ = restore_snapshot(data)
+        self.assertEqual(dict(UserData.objects.values_list('user__username', 'alias')), aliases)
+        self.assertFalse(User.objects.first().has_usable_password())
+        self.assertEqual(PlayerState.objects.filter(game=game).count(), self.PLAYERS)
+        self.assertEqual(Guess.objects.filter(game=game).count(), len(data['tables']['guesses']['owner_id']))
+        # Los IDs de los usuarios cambian: el plan se remapea.
+        usernames = dict(User.objects.values_list('id', 'username'))
+        round = get_plan(game.id).rounds[0]
+        self.assertEqual([usernames[user_id] for user_id in round.groups[0]], [
+            dict(zip(data['tables']['users']['id'], data['tables']['users']['username']))[user_id]
+            for user_id in data['plan']['rounds'][0]['groups'][0]
+        ])
+
+    def test_unsupported_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'game.snapshot')
+            with open(path, 'wb') as snapshot:
+                snapshot.write(b'not a snapshot')
+            with self.assertRaises(ValueError):
+                read_snapshot(path)
+
+
+class BenchFormsTests(SimpleTestCase):
+    """ manage.py bench_forms con settings_bench, en otro proceso porque crea su
+    propia BD en memoria."""
+
+    def test_run(self):
+        env = {**os.environ, 'DJANGO_SETTINGS_MODULE': 'amigoSecreto.settings_bench'}
+        result = subprocess.run(
+            [sys.executable, '-W', 'ignore', 'manage.py', 'bench_forms', '--players', '12', '--repeat', '1',
+             '--no-history'],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True, timeout=120)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        for case in ('create_teams', 'create_selections', 'set_options', 'GuessForm.__init__',
+                     'GuessForm.save', 'SignUpForm.save'):
+            self.assertRegex(result.stdout, rf"{re.escape(case)} +12 ")
+
+
+class WriteBehindTests(GameTestCase):
+    """ Escritura diferida de las adivinanzas (writebehind.py)."""
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        override = self.settings(GUESS_WRITE_BEHIND=True, GUESS_QUEUE_EMBEDDED=False,
+                                 GUESS_QUEUE_PATH=os.path.join(directory.name, 'queue.sqlite3'))
+        override.enable()
+        self.addCleanup(override.disable)
+        self.select()
+
+    def submit_all(self):
+        guesses = self.guesses()
+        for user, data, _ in guesses:
+            form = GuessForm(data, user=user)
+            self.assertTrue(form.is_valid(), form.errors)
+            form.save()
+        return guesses
+
+    def test_reads_own_guess_before_saving(self):
+        guesses = self.submit_all()
+        self.assertEqual(len(get_queue()), len(guesses))
+        self.assertFalse(Guess.objects.exists())
+        for user, data, _ in guesses:
+            self.assertEqual(get_state(user.id).status, PlayerState.GUESSED)
+            with self.assertRaises(PermissionDenied):
+                GuessForm(data, user=user)
+        # Sin la marca de la cache se sigue viendo en la cola.
+        cache.clear()
+        self.assertEqual(get_state(guesses[0][0].id).status, PlayerState.GUESSED)
+
+    def test_process_pending(self):
+        guesses = self.submit_all()
+        self.assertEqual(process_pending(batch_size=2), len(guesses))
+        self.assertEqual(len(get_queue()), 0)
+        saved = {guess.owner_id: guess for guess in Guess.objects.filter(game=self.game)}
+        self.assertEqual(set(saved), {user.id for user, _, _ in guesses})
+        for user, _, correct in guesses:
+            if correct:
+                self.assertTrue(saved[user.id].answer)
+            state = PlayerState.objects.get(game=self.game, user=user)
+            self.assertEqual(state.status, PlayerState.GUESSED)
+            self.assertTrue(user.groups.filter(name='Guessed').exists())
+
+    def test_saved_batch_is_not_duplicated(self):
+        guesses = self.submit_all()
+        entries = get_queue().peek(len(guesses))
+        self.assertEqual(process_pending(), len(guesses))
+        # El lote se guardo pero no se llego a borrar de la cola.
+        for entry in entries:
+            entry['date'] = parse_datetime(entry['date'])
+        self.assertEqual(save_guesses(entries), 0)
+        self.assertEqual(Guess.objects.count(), len(guesses))
+
+    def test_failed_entries(self):
+        guesses = self.submit_all()
+        poison = guesses[0][0].id
+
+        def record(stats):
+            if any(row[1] == poison for row in stats):
+                raise ValueError('poison')
+            return record_guesses(stats)
+
+        with mock.patch('guess.writebehind.record_guesses', record), \
+                self.assertLogs('guess.writebehind', 'ERROR'):
+            self.assertEqual(process_pending(), len(guesses))
+        self.assertEqual(len(get_queue()), 0)
+        self.assertEqual(set(Guess.objects.values_list('owner_id', flat=True)),
+                         {user.id for user, _, _ in guesses[1:]})
+        failed = get_queue().failed()
+        self.assertEqual([entry['user_id'] for entry in failed], [poison])
+        self.assertIn('ValueError', failed[0]['error'])
+
+        self.assertEqual(get_queue().retry_failed(), 1)
+        self.assertEqual(get_queue().failed(), [])
+        self.assertEqual(process_pending(), 1)
+        self.assertTrue(Guess.objects.filter(owner_id=poison).exists())
+
+
+@override_settings(DB_REPLICAS=[])
+class GiftSearchTests(TestCase):
+    """ Busqueda de regalos por relevancia (gift_search.search)."""
+    GIFTS = [
+        'libro de cocina con recetas de todo el mundo',
+        'libro',
+        'juego de mesa',
+        'libros antiguos',
+        'canción de cuna',
+        'mesa de cocina',
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        for i, gift in enumerate(cls.GIFTS):
+            user = User.objects.create(username=f"wisher{i}", password='!')
+            UserData.objects.create(user=user, alias=f"w{i:03d}", gift=gift)
+
+    def aliases(self, query, page=1, page_size=20):
+        results, _ = search(query, page, page_size)
+        return [result['alias'] for result in results]
+
+    def test_empty_query(self):
+        self.assertEqual(search(' ?! '), ([], False))
+
+    def test_prefixes(self):
+        self.assertEqual(set(self.aliases('libr')), {'w000', 'w001', 'w003'})
+        self.assertEqual(self.aliases('xyz'), [])
+
+    def test_all_terms(self):
+        self.assertEqual(set(self.aliases('mesa cocina')), {'w005'})
+
+    @skipUnless(connection.vendor in ('sqlite', 'postgresql'), 'Ranked by the text index')
+    def test_ranking(self):
+        # Cuanto mas corto el regalo con la palabra, mas relevante.
+        self.assertEqual(self.aliases('libro'), ['w001', 'w003', 'w000'])
+        results, _ = search('libro')
+        scores = [result['score'] for result in results]
+        self.assertEqual(scores, sorted(scores, reverse=True))
+
+    @skipUnless(connection.vendor == 'sqlite', 'Only unicode61 removes accents')
+    def test_accents(self):
+        self.assertEqual(self.aliases('cancion'), ['w004'])
+
+    def test_pages(self):
+        first, has_next = search('de', 1, 2)
+        self.assertTrue(has_next)
+        second, has_next = search('de', 2, 2)
+        self.assertFalse(has_next)
+        self.assertEqual(len(first) + len(second), 4)
+        self.assertFalse({result['alias'] for result in first} & {result['alias'] for result in second})
+
+    def test_view(self):
+        self.client.force_login(User.objects.get(username='wisher0'))
+        response = self.client.get(reverse('gift_search'), {'q': 'juego'})
+        self.assertEqual(response.json(), {
+            'results': [{'alias': 'w002', 'gift': 'juego de mesa', 'score': search('juego')[0][0]['score']}],
+            'page': 1,
+            'has_next': False,
+        })
+
+
+@override_settings(DB_REPLICAS=[])
+class GiftCacheTests(TransactionTestCase):
+    """ gift_of y su invalidacion al guardar UserData, que ocurre al confirmar la
+    transaccion."""
+
+    def setUp(self):
+        cache.clear()
+        user = User.objects.create(username='wisher', password='!')
+        self.data = UserData.objects.create(user=user, alias='wish', gift='taza')
+
+    def test_cached(self):
+        self.assertEqual(gift_of('wish'), 'taza')
+        with self.assertNumQueries(0):
+            self.assertEqual(gift_of('wish'), 'taza')
+        self.assertIsNone(gift_of('nope'))
+
+    def test_gift_changed(self):
+        gift_of('wish')
+        self.data.gift = 'termo'
+        self.data.save(update_fields=['gift'])
+        self.assertEqual(gift_of('wish'), 'termo')
+
+    def test_alias_changed(self):
+        gift_of('wish')
+        self.data.alias = 'wash'
+        self.data.save()
+        self.assertIsNone(gift_of('wish'))
+        self.assertEqual(gift_of('wash'), 'taza')
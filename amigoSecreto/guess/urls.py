@@ -7,7 +7,23 @@ urlpatterns = [
     path('', WelcomeView.as_view(), name='home'),
     path('signup/', SignUpView.as_view(), name='sign_up'),
     path('signin/', SignInView.as_view(), name='sign_in'),
+    path('availability/', AvailabilityView.as_view(), name='availability'),
     path('signout/', SignOutView.as_view(), name='sign_out'),
+    path('enroll/', EnrollView.as_view(), name='enroll'),
+    path('enrollments/', EnrollmentListView.as_view(), name='enrollments'),
     path('create_game/', CreateGameView.as_view(), name='create_game'),
+    path('create_game/<int:pk>/', GameJobView.as_view(), name='game_job'),
     path('guess/', GuessView.as_view(), name='guess'),
+    path('reveal/', RevealView.as_view(), name='reveal'),
+    path('async/', AsyncWelcomeView.as_view(), name='home_async'),
+    path('async/guess/', AsyncGuessView.as_view(), name='guess_async'),
+    path('aliases/', AliasSearchView.as_view(), name='alias_search'),
+    path('gifts/', GiftSearchView.as_view(), name='gift_search'),
+    path('gifts/<str:alias>/', GiftView.as_view(), name='gift'),
+    path('profiles/', ProfileListView.as_view(), name='profiles'),
+    path('scheduler/', SchedulerDashboardView.as_view(), name='scheduler'),
+    path('analytics/', AnalyticsView.as_view(), name='analytics'),
+    path('analytics/json/', AnalyticsJsonView.as_view(), name='analytics_json'),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
+    path('profiles/<str:name>/', ProfileDetailView.as_view(), name='profile_detail'),
 ]
\ No newline at end of file
@@ -1,19 +1,39 @@
-from django.shortcuts import render, redirect
+import asyncio
+import functools
+from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth import login, authenticate
-from django.contrib.auth.views import LoginView, LogoutView
+from django.contrib.auth.views import LoginView, LogoutView, redirect_to_login
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.contrib.auth.models import User
 # from django.contrib.auth.decorators import login_required, user_passes_test
-from django.views.generic import CreateView, TemplateView
+from django.views.generic import CreateView, ListView, TemplateView, View
+from django.http import JsonResponse, Http404, HttpResponse
+from django.conf import settings
+from django.utils.crypto import constant_time_compare
 from django.utils.decorators import method_decorator
 from .models import *
 from .forms import *
+from .aliases import player_aliases
+from .gift_search import gift_of, search as search_gifts
+from .availability import taken_names, FIELDS as AVAILABILITY_FIELDS
+from .plans import get_plan
+from .enrollment import enroll, unenroll, is_enrolled, pending
+from .player_state import get_state
+from .reveal import latest_game_id, reveal_page
+from .analytics import report
+from .ratelimit import rate_limit
+from .offload import run_db
+from .jobs import enqueue_game_creation, job_phase
+from .profiling import list_profiles, load_profile
+from .telemetry import histogram, render_metrics, LAG_BUCKETS, DURATION_BUCKETS
+from amigoSecreto.routers import use_primary
 
 
 class SignInView(LoginView):
     """ Clase heredada de LoginView que representa la vista para el login."""
     template_name = 'templates/signin.html'
 
+@method_decorator(rate_limit('signup'), name='dispatch')
 class SignUpView(CreateView):
     """ Clase heredada de CreateView que representa la vista para el registro."""
     model = User
@@ -34,11 +54,40 @@ class SignOutView(LogoutView):
     """ Clase heredada de LogoutView que representa la vista para el cierre de sesion."""
     pass
 
+def welcome_context(user):
+    """ Estado del usuario en su ultimo juego (su PlayerState) y las selecciones en las
+    que adivina, obtenidas del plan precalculado del juego."""
+    context = {'enrolled': is_enrolled(user.id), 'revealed': latest_game_id() is not None}
+    context['state'] = state = get_state(user.id)
+    plan = get_plan(state.game_id) if state else None
+    if plan is not None:
+        context['turns'] = [
+            {'round': r + 1, 'selection': s + 1, 'start': start}
+            for r, s, start in plan.turns(user.id)
+        ]
+    return context
+
 class WelcomeView(LoginRequiredMixin, TemplateView):
     """ Clase heredada de TemplateView que representa la vista para la pagina principal.
     En caso de no haber usuario registrado, redirige a la vista del login."""
     template_name = 'templates/welcome.html'
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context.update(welcome_context(self.request.user))
+        return context
+
+class EnrollView(LoginRequiredMixin, View):
+    """ Vista que inscribe al usuario registrado en el proximo juego, o lo quita si
+    envia leave."""
+
+    def post(self, request):
+        if 'leave' in request.POST:
+            unenroll(request.user.id)
+        else:
+            enroll([request.user.id])
+        return redirect('home')
+
 class CreateGameView(LoginRequiredMixin, UserPassesTestMixin, CreateView):
     """ Clase heredada de CreateView que representa la vista para la creacion de una
     instancia de juego."""
@@ -54,12 +103,37 @@ class CreateGameView(LoginRequiredMixin, UserPassesTestMixin, CreateView):
 
     def form_valid(self, form):
         '''
-        En este parte, si el formulario es valido guardamos lo que se 
-        obtiene de él.
+        En este parte, si el formulario es valido encolamos la creacion del
+        juego y redirigimos a la vista de su progreso.
         '''
-        form.save()
-        return redirect('/')
+        job = enqueue_game_creation(form)
+        return redirect('game_job', pk=job.id)
+
+class GameJobView(LoginRequiredMixin, UserPassesTestMixin, View):
+    """ Vista que devuelve en JSON el progreso de la creacion de un juego."""
+
+    def test_func(self):
+        """ Función para usar con UserPassesTestMixin.
+            Permite solo a superusuarios
+        """
+        return self.request.user.is_superuser
 
+    def get(self, request, pk):
+        # El progreso se escribe en el primario desde otro hilo.
+        with use_primary():
+            job = get_object_or_404(GameJob, pk=pk)
+        job.phase = job_phase(job)
+        return JsonResponse({
+            'id': job.id,
+            'status': job.status,
+            'phase': job.phase,
+            'phases': GameJob.PHASES,
+            'progress': job.progress(),
+            'game': job.game_id,
+            'error': job.error,
+        })
+
+@method_decorator(rate_limit('guess'), name='dispatch')
 class GuessView(LoginRequiredMixin, CreateView):
     model = Guess
     template_name = 'templates/guess_form.html'
@@ -82,3 +156,229 @@ class GuessView(LoginRequiredMixin, CreateView):
     def test_func(self):
         # TODO verificar que el usuario esta en Guessing.
         return True
+
+class AsyncView(View):
+    """ View cuyos handlers (get, post...) son corrutinas, para servirla con ASGI.
+    Django 3.1 no detecta las vistas de clase asincronas, asi que as_view la envuelve
+    en una corrutina.
+    El usuario (sesion y auth) se carga en el pool de offload.py y, si login_required,
+    se redirige al login como LoginRequiredMixin."""
+    login_required = True
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        view = super().as_view(**initkwargs)
+
+        async def async_view(request, *args, **kwargs):
+            return await view(request, *args, **kwargs)
+        return functools.update_wrapper(async_view, view)
+
+    async def dispatch(self, request, *args, **kwargs):
+        authenticated = await run_db(lambda: request.user.is_authenticated)
+        if self.login_required and not authenticated:
+            return redirect_to_login(request.get_full_path())
+        response = super().dispatch(request, *args, **kwargs)
+        if asyncio.iscoroutine(response):
+            response = await response
+        return response
+
+class AsyncWelcomeView(AsyncView):
+    """ Version asincrona de WelcomeView: las consultas van al pool y la plantilla se
+    genera en el event loop."""
+    template_name = WelcomeView.template_name
+
+    async def get(self, request):
+        context = await run_db(welcome_context, request.user)
+        return render(request, self.template_name, context)
+
+@method_decorator(rate_limit('guess'), name='dispatch')
+class AsyncGuessView(AsyncView):
+    """ Version asincrona de GuessView: crear el form (lee el PlayerState) y
+    guardarlo van al pool."""
+    template_name = GuessView.template_name
+
+    async def get(self, request):
+        form = await run_db(GuessForm, user=request.user)
+        return render(request, self.template_name, {'form': form})
+
+    async def post(self, request):
+        def save():
+            form = GuessForm(request.POST, user=request.user)
+            if form.is_valid():
+                form.save()
+                return None
+            return form
+        form = await run_db(save)
+        if form is None:
+            return redirect('/')
+        return render(request, self.template_name, {'form': form})
+
+class RevealView(LoginRequiredMixin, View):
+    """ Vista con los resultados del ultimo juego terminado. La pagina de cada jugador
+    se renderiza al terminar el juego y se sirve desde la cache (ver reveal.py)."""
+
+    def get(self, request):
+        html = reveal_page(request.user.id)
+        if html is None:
+            raise Http404("No game has finished yet")
+        return HttpResponse(html)
+
+class AliasSearchView(LoginRequiredMixin, View):
+    """ Vista que devuelve en JSON los alias de los jugadores del juego activo que
+    empiezan por el parametro q, paginados con el parametro page."""
+    page_size = 20
+
+    def get(self, request):
+        prefix = request.GET.get('q', '')
+        try:
+            page = max(1, int(request.GET.get('page', 1)))
+        except ValueError:
+            page = 1
+        results, has_next = player_aliases.search(prefix, page, self.page_size)
+        return JsonResponse({
+            'results': results,
+            'page': page,
+            'has_next': has_next,
+        })
+
+class GiftSearchView(LoginRequiredMixin, View):
+    """ Vista que devuelve en JSON los jugadores cuyo regalo deseado contiene las
+    palabras del parametro q, de mas a menos relevante y paginados con el parametro
+    page."""
+    page_size = 20
+
+    def get(self, request):
+        query = request.GET.get('q', '')
+        try:
+            page = max(1, int(request.GET.get('page', 1)))
+        except ValueError:
+            page = 1
+        results, has_next = search_gifts(query, page, self.page_size)
+        return JsonResponse({
+            'results': results,
+            'page': page,
+            'has_next': has_next,
+        })
+
+class GiftView(LoginRequiredMixin, View):
+    """ Vista que devuelve en JSON el regalo deseado del jugador con el alias indicado."""
+
+    def get(self, request, alias):
+        gift = gift_of(alias)
+        if gift is None:
+            raise Http404("There is no player with that alias")
+        return JsonResponse({'alias': alias, 'gift': gift})
+
+@method_decorator(rate_limit('availability', methods=('GET',)), name='dispatch')
+class AvailabilityView(View):
+    """ Vista que devuelve en JSON si los parametros username y alias son validos y
+    estan libres, para comprobarlo mientras se rellena el registro."""
+
+    def get(self, request):
+        results = {}
+        for field in AVAILABILITY_FIELDS:
+            value = request.GET.get(field)
+            if value is None:
+                continue
+            try:
+                SignUpForm.base_fields[field].clean(value)
+            except ValidationError as error:
+                results[field] = {'available': False, 'error': error.messages[0]}
+                continue
+            results[field] = {'available': taken_names.is_available(field, value)}
+        return JsonResponse(results)
+
+class SuperuserRequiredMixin(LoginRequiredMixin, UserPassesTestMixin):
+    """ Mixin para las vistas de diagnostico que solo pueden ver los superusuarios."""
+
+    def test_func(self):
+        """ Función para usar con UserPassesTestMixin.
+            Permite solo a superusuarios
+        """
+        return self.request.user.is_superuser
+
+class EnrollmentListView(SuperuserRequiredMixin, ListView):
+    """ Vista que lista por paginas los usuarios inscritos en el proximo juego."""
+    template_name = 'templates/enrollments.html'
+    context_object_name = 'enrollments'
+    paginate_by = 50
+
+    def get_queryset(self):
+        return pending().select_related('user').order_by('joined_at', 'id')
+
+class ProfileListView(SuperuserRequiredMixin, TemplateView):
+    """ Vista que lista los perfiles guardados con ?profile=1 o la cabecera X-Profile."""
+    template_name = 'templates/profiles.html'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['profiles'] = list_profiles()
+        return context
+
+class ProfileDetailView(SuperuserRequiredMixin, TemplateView):
+    """ Vista que muestra las funciones mas costosas y el SQL de un perfil."""
+    template_name = 'templates/profile_detail.html'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        profile = load_profile(kwargs['name'])
+        if profile is None:
+            raise Http404("Profile not found")
+        context['profile'] = profile
+        return context
+
+class SchedulerDashboardView(SuperuserRequiredMixin, TemplateView):
+    """ Vista con la telemetria de los jobs de las selecciones y el informe de envio
+    de sus avisos."""
+    template_name = 'templates/scheduler.html'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        ticks = SelectionTick.objects.all()
+        context['lag'] = histogram(ticks, 'lag_ms', LAG_BUCKETS)[0]
+        context['duration'] = histogram(ticks, 'duration_ms', DURATION_BUCKETS)[0]
+        context['sla_ms'] = settings.SELECTION_LAG_SLA*1000
+        context['late'] = ticks.filter(lag_ms__gt=context['sla_ms']).count()
+        context['ticks'] = ticks.order_by('-started')[:50]
+        context['notifications'] = NotificationBatch.objects.defer('recipients').order_by('-created')[:50]
+        return context
+
+class AnalyticsMixin(SuperuserRequiredMixin):
+    """ Estadisticas del juego del parametro game (por defecto el ultimo creado),
+    leidas solo de las tablas de contadores (ver analytics.py)."""
+
+    def get_report(self):
+        try:
+            game_id = int(self.request.GET['game'])
+        except (KeyError, ValueError):
+            game_id = Game.objects.order_by('-startDate').values_list('id', flat=True).first()
+        if game_id is None:
+            raise Http404("There are no games")
+        return report(game_id)
+
+class AnalyticsView(AnalyticsMixin, TemplateView):
+    """ Vista con las estadisticas de las adivinanzas por seleccion y por equipo."""
+    template_name = 'templates/analytics.html'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['report'] = self.get_report()
+        return context
+
+class AnalyticsJsonView(AnalyticsMixin, View):
+    """ Vista que devuelve en JSON las mismas estadisticas que AnalyticsView."""
+
+    def get(self, request):
+        return JsonResponse(self.get_report())
+
+class MetricsView(View):
+    """ Vista con las metricas en formato de Prometheus. La pueden leer los
+    superusuarios o quien envie el token de settings.METRICS_TOKEN."""
+
+    def get(self, request):
+        token = settings.METRICS_TOKEN
+        authorization = request.META.get('HTTP_AUTHORIZATION', '')
+        if not request.user.is_superuser and not (
+                token and constant_time_compare(authorization, f"Bearer {token}")):
+            return HttpResponse(status=403)
+        return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4')
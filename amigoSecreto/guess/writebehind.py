@@ -0,0 +1,184 @@
+"""
+Escritura diferida de las adivinanzas (settings.GUESS_WRITE_BEHIND).
+
+Al abrirse una seleccion todo su grupo adivina a la vez, y cada GuessForm.save
+inserta su Guess, consulta su GivesTo, mueve al jugador de grupo y actualiza su
+PlayerState y las estadisticas antes de responder. Con GUESS_WRITE_BEHIND,
+GuessForm.save solo valida la adivinanza, la anyade a una cola local y responde:
+    - La cola es una BD SQLite en GUESS_QUEUE_PATH (una por nodo) con journal WAL y
+      synchronous=FULL: la adivinanza esta en disco antes de responder.
+    - Un worker (el pool de jobs.py si GUESS_QUEUE_EMBEDDED, o manage.py
+      process_guesses) la guarda en lotes de hasta GUESS_BATCH_SIZE: decide las
+      respuestas con una sola consulta a GivesTo, inserta las Guess con bulk_create,
+      mueve a los jugadores de grupo y marca sus PlayerState con un UPDATE para todo
+      el lote y suma las estadisticas con un UPDATE por seleccion y equipo.
+    - Cada usuario lee lo que escribe: hasta que su adivinanza se guarda get_state lo
+      devuelve ya en Guessed (ver guess_queue.is_pending).
+Si el proceso cae con adivinanzas en la cola, se guardan al arrancar (wsgi.py /
+asgi.py) o con process_guesses. Un lote que se guardo en la BD pero no se llego a
+borrar de la cola no se duplica: se descartan las Guess que ya existen (mismo
+jugador y fecha). Si un lote falla se guardan sus adivinanzas una a una y las que
+siguen fallando se apartan a la tabla failed de la cola (process_guesses
+--retry-failed las devuelve). Si la BD no esta disponible el lote se queda en la cola
+y el worker se para hasta el siguiente wake().
+"""
+
+import logging
+import sqlite3
+import threading
+from django.conf import settings
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.core.exceptions import PermissionDenied
+from django.db import InterfaceError, OperationalError, transaction
+from django.utils.dateparse import parse_datetime
+from .analytics import record_guesses
+from .game_logic import adjudicate
+from .models import *
+from .guess_queue import PENDING_TIMEOUT, get_queue, pending_key
+from .player_state import mark_all_guessed
+from .jobs import submit
+from amigoSecreto.routers import use_primary
+
+logger = logging.getLogger(__name__)
+
+
+def submit_guess(state, gifter_id, gifted_id, date):
+    """ Encola la adivinanza del jugador de state (en Guessing) y avisa al worker."""
+    key = pending_key(state.user_id)
+    # La marca va antes que la cola para que el worker, al borrarla, no la adelante.
+    cache.set(key, (state.game_id, state.selection), PENDING_TIMEOUT)
+    try:
+        get_queue().append(state.game_id, state.user_id, state.selection, state.team,
+                           gifter_id, gifted_id, date)
+    except sqlite3.IntegrityError:
+        raise PermissionDenied("You already guessed in this selection")
+    except Exception:
+        cache.delete(key)
+        raise
+    wake()
+
+
+def save_guesses(entries):
+    """ Guarda en la BD un lote de adivinanzas de la cola (con date ya como datetime).
+    Devuelve las guardadas."""
+    existing = set(Guess.objects.filter(
+        owner_id__in={entry['user_id'] for entry in entries},
+        date__in={entry['date'] for entry in entries},
+    ).values_list('owner_id', 'date'))
+    entries = [entry for entry in entries if (entry['user_id'], entry['date']) not in existing]
+    if not entries:
+        return 0
+
+    gives_to = {
+        (game_id, gifter): gifted
+        for game_id, gifter, gifted in GivesTo.objects.filter(
+            game_id__in={entry['game_id'] for entry in entries},
+            gifter_id__in={entry['gifter_id'] for entry in entries},
+        ).values_list('game_id', 'gifter_id', 'gifted_id')
+    }
+    game_players = {
+        game_id: UserTeam.objects.filter(team__game_id=game_id).count()
+        for game_id in {entry['game_id'] for entry in entries}
+    }
+    guesses, stats = [], []
+    for entry in entries:
+        players = game_players[entry['game_id']]
+        correct = gives_to.get((entry['game_id'], entry['gifter_id'])) == entry['gifted_id']
+        answer = adjudicate(correct, players)
+        guesses.append(Guess(
+            game_id=entry['game_id'], owner_id=entry['user_id'], gifter_id=entry['gifter_id'],
+            gifted_id=entry['gifted_id'], date=entry['date'], answer=answer,
+        ))
+        stats.append((entry['game_id'], entry['user_id'], entry['selection'], entry['team'],
+                      entry['date'], correct, answer, players))
+    Guess.objects.bulk_create(guesses, batch_size=settings.GUESS_BATCH_SIZE)
+
+    owners = [entry['user_id'] for entry in entries]
+    Group.objects.get(name='Guessing').user_set.remove(*owners)
+    Group.objects.get(name='Guessed').user_set.add(*owners)
+    by_selection = {}
+    for entry in entries:
+        by_selection.setdefault((entry['game_id'], entry['selection']), []).append(entry['user_id'])
+    for (game_id, selection), user_ids in by_selection.items():
+        mark_all_guessed(game_id, selection, user_ids)
+    record_guesses(stats)
+    return len(entries)
+
+
+def save_batch(entries):
+    with use_primary(), transaction.atomic():
+        return save_guesses(entries)
+
+
+def process_batch(batch_size=None):
+    """ Guarda el lote mas antiguo de la cola. Devuelve cuantas adivinanzas saco de la
+    cola, guardadas o apartadas (0 si estaba vacia). Los errores de conexion con la BD
+    se propagan y el lote sigue en la cola."""
+    queue = get_queue()
+    entries = queue.peek(batch_size or settings.GUESS_BATCH_SIZE)
+    if not entries:
+        return 0
+    for entry in entries:
+        entry['date'] = parse_datetime(entry['date'])
+    try:
+        save_batch(entries)
+    except (OperationalError, InterfaceError):
+        raise
+    except Exception:
+        logger.exception("Could not save a batch of %s guesses, saving them one by one", len(entries))
+        for entry in entries:
+            try:
+                save_batch([entry])
+            except (OperationalError, InterfaceError):
+                raise
+            except Exception as error:
+                logger.exception("Could not save the guess of user %s", entry['user_id'])
+                queue.fail(entry['id'], repr(error))
+    queue.remove([entry['id'] for entry in entries])
+    cache.delete_many([pending_key(entry['user_id']) for entry in entries])
+    return len(entries)
+
+
+def process_pending(batch_size=None):
+    """ Vacia la cola lote a lote. Devuelve el numero de adivinanzas procesadas."""
+    total = 0
+    while True:
+        processed = process_batch(batch_size)
+        if not processed:
+            return total
+        total += processed
+
+
+_lock = threading.Lock()
+_draining = False
+
+
+def _drain():
+    global _draining
+    try:
+        while True:
+            process_pending()
+            with _lock:
+                # Lo encolado despues de vaciarla se procesa en esta misma vuelta.
+                if not len(get_queue()):
+                    _draining = False
+                    return
+    except Exception:
+        # Las adivinanzas siguen en la cola: se reintentan en el siguiente wake().
+        logger.exception("Could not save the queued guesses")
+        with _lock:
+            _draining = False
+
+
+def wake():
+    """ Lanza el worker en el pool de tareas si GUESS_QUEUE_EMBEDDED y no esta ya en
+    marcha."""
+    global _draining
+    if not settings.GUESS_QUEUE_EMBEDDED:
+        return
+    with _lock:
+        if _draining:
+            return
+        _draining = True
+    submit(_drain)